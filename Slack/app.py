@@ -1,17 +1,36 @@
+import time
+STARTUP_BEGAN = time.perf_counter()
+
 import os
+import sys
 import re
 import json
-import pytz
 import threading
-import requests
-import time
+import atexit
+import uuid
+import functools
+from collections import OrderedDict, deque
 from datetime import datetime
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-from slack_bolt.adapter.flask import SlackRequestHandler
-from flask import Flask, request, redirect, render_template_string
+from slack_bolt import App, BoltResponse
 from dotenv import load_dotenv
 
+# Startup timing
+startup_timings = []
+
+def mark_startup(phase):
+    startup_timings.append((phase, time.perf_counter()))
+
+def startup_report():
+    """Per-phase startup durations since the first import"""
+    previous = STARTUP_BEGAN
+    parts = []
+    for phase, at in startup_timings:
+        parts.append(f"{phase} {(at - previous) * 1000:.0f}ms")
+        previous = at
+    return f"Startup: {', '.join(parts)} (total {(previous - STARTUP_BEGAN) * 1000:.0f}ms)"
+
+mark_startup('imports')
+
 load_dotenv()
 
 SLACK_APP_TOKEN = os.environ.get("SLACK_APP_TOKEN")
@@ -19,249 +38,200 @@ SLACK_CLIENT_ID = os.environ.get("SLACK_CLIENT_ID")
 SLACK_CLIENT_SECRET = os.environ.get("SLACK_CLIENT_SECRET")
 SLACK_REDIRECT_URI = os.environ.get("SLACK_REDIRECT_URI", "https://slackbot.leonardocerv.hackclub.app/oauth")
 
-USER_PREFS_PATH = '../shared/user_preferences.json'
-SHARED_TIMEZONES_PATH = '../shared/timezones.json'
+# Parsing, conversion and state shared with the Telegram bot
+sys.path.insert(0, '../shared')
+import tzcore
+from tzcore import (
+    ChannelMemberCache, REDIS_PREFIX, REDIS_URL, ReminderScheduler, TRAFFIC_LOG_PATH, TRAFFIC_LOG_SALT,
+    TrackedMessage, TrafficRecorder, abbreviation_resolver, allow_reply, benchmark_prefs_snapshot,
+    benchmark_timezone_backends, build_conversion, build_reminders, cache_warmer, check_parser, convert_query,
+    convert_times, convert_times_to_zones, convert_tracked_message, export_prefs_snapshot, extraction_stats,
+    find_overlap, format_conversion_response, format_group_conversion_response, format_overlap_response,
+    get_user_timezone, health_monitor, import_prefs_snapshot, init_offset_tables, isolate_replay_state,
+    parse_overlap_options, plan_reminder, read_traffic_log, render_message, render_reminder, reply_cache,
+    reply_tracker, report_replay, resolve_timezone_input, restore_replay_state, scan_time_spans, set_user_timezone,
+    zone_now, zone_suggester,
+)
 
-timezone_config = {'aliases': {}, 'popular': []}
-if os.path.exists(SHARED_TIMEZONES_PATH):
-    try:
-        with open(SHARED_TIMEZONES_PATH, 'r') as f:
-            timezone_config = json.load(f)
-    except:
-        pass
+# Workspace tokens
+TEAM_TOKENS_PATH = 'team_tokens.json'
 
-def init_user_prefs():
-    if not os.path.exists(USER_PREFS_PATH):
-        with open(USER_PREFS_PATH, 'w') as f:
-            json.dump({'discord': {}, 'slack': {}, 'telegram': {}}, f, indent=2)
+class TeamTokenFile:
+    """team_tokens.json held in memory: saves update the map at once and a background thread writes the file,
+    folding a burst of installs into one atomic replace; edits by other processes are picked up by mtime"""
 
-def read_user_prefs():
-    try:
-        if not os.path.exists(USER_PREFS_PATH):
-            init_user_prefs()
-        with open(USER_PREFS_PATH, 'r') as f:
-            full_data = json.load(f)
-            return {'users': full_data.get('slack', {})}
-    except:
-        return {'users': {}}
-
-def write_user_prefs(data):
-    try:
-        full_data = {'discord': {}, 'slack': {}, 'telegram': {}}
-        if os.path.exists(USER_PREFS_PATH):
-            with open(USER_PREFS_PATH, 'r') as f:
-                full_data = json.load(f)
-        
-        full_data['slack'] = data.get('users', {})
-        
-        with open(USER_PREFS_PATH, 'w') as f:
-            json.dump(full_data, f, indent=2)
+    def __init__(self, path=TEAM_TOKENS_PATH):
+        self.path = path
+        self.tokens = None
+        self.version = None
+        self.write_id = None
+        self.lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.thread = None
+
+    def _version(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _current(self):
+        # Never reload over a save that has not been written yet
+        version = self._version()
+        if self.tokens is None or (version != self.version and self.write_id is None):
+            tokens = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r') as f:
+                        tokens = json.load(f)
+                except:
+                    tokens = {}
+            self.tokens, self.version = tokens, version
+        return self.tokens
+
+    def load(self):
+        with self.lock:
+            return dict(self._current())
+
+    def get(self, team_id):
+        with self.lock:
+            return self._current().get(team_id, {})
+
+    def save(self, team_id, token_data):
+        with self.lock:
+            self._current()[team_id] = token_data
+            if self.write_id is None:
+                self.write_id = health_monitor.begin_write()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._write_forever, name='team-token-writer', daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+        self.dirty.set()
         return True
-    except:
-        return False
 
-def get_timezone_display_name(timezone_id):
-    if timezone_config.get('display_names') and timezone_id in timezone_config['display_names']:
-        return timezone_config['display_names'][timezone_id]
-    
-    try:
-        tz = pytz.timezone(timezone_id)
-        now = datetime.now(tz)
-        return now.strftime('%Z')
-    except:
-        return timezone_id.split('/')[-1].upper()
-
-def normalize_timezone(input_tz):
-    if not input_tz:
-        return None
-    
-    alias = timezone_config['aliases'].get(input_tz.upper())
-    if alias:
-        return alias
-    
-    try:
-        pytz.timezone(input_tz)
-        return input_tz
-    except:
-        pass
-    
-    offset_match = re.match(r'^(UTC)?([+-]\d{1,2}):?(\d{2})?$', input_tz, re.IGNORECASE)
-    if offset_match:
-        sign = '+' if offset_match.group(2).startswith('+') else '-'
-        hours = abs(int(offset_match.group(2)))
-        minutes = int(offset_match.group(3)) if offset_match.group(3) else 0
-        
-        if hours <= 14 and minutes <= 59:
-            return f"Etc/GMT{'-' if sign == '+' else '+'}{hours}"
-    
-    return None
+    def _write_forever(self):
+        while True:
+            self.dirty.wait()
+            self.dirty.clear()
+            if not self.flush():
+                time.sleep(1)
+                self.dirty.set()
 
-def set_user_timezone(user_id, timezone_input):
-    normalized_tz = normalize_timezone(timezone_input)
-    if not normalized_tz:
-        return False
-    
-    data = read_user_prefs()
-    data['users'][user_id] = {
-        'timezone': normalized_tz,
-        'displayName': timezone_input,
-        'lastUpdated': datetime.now().isoformat()
-    }
-    return write_user_prefs(data)
-
-def get_user_timezone(user_id):
-    data = read_user_prefs()
-    return data.get('users', {}).get(user_id, {}).get('timezone')
-
-# Time parsing and conversion
-def extract_times(content):
-    patterns = [
-        # With timezone: "3:00 PM EST", "2 PM PST", "3 PM SGT"
-        r'\b(\d{1,2}):(\d{2})\s*(AM|PM|am|pm)\s*([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b',
-        r'\b(\d{1,2})\s*(AM|PM|am|pm)\s*([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b',
-        # 12-hour: "3:00 PM", "3 PM"
-        r'\b(\d{1,2}):(\d{2})\s*(AM|PM|am|pm)\b',
-        r'\b(\d{1,2})\s*(AM|PM|am|pm)\b',
-        # 24-hour: "15:30", "09:00"
-        r'\b([01]?\d|2[0-3]):([0-5]\d)\b',
-        # With context: "at 3pm"
-        r'\b(at|around|by|before|after)\s+(\d{1,2}):?(\d{2})?\s*(AM|PM|am|pm)?\b'
-    ]
-    
-    times = []
-    spans = []
-    
-    for pattern in patterns:
-        for match in re.finditer(pattern, content, re.IGNORECASE):
-            start = match.start()
-            end = match.end()
-            
-            # Skip overlapping matches
-            overlaps = any(
-                (start >= span['start'] and start < span['end']) or
-                (end > span['start'] and end <= span['end']) or
-                (start <= span['start'] and end >= span['end'])
-                for span in spans
-            )
-            
-            if not overlaps:
-                times.append(match.group(0).strip())
-                spans.append({'start': start, 'end': end})
-    
-    return sorted([t for t in times if len(t) >= 2 and not re.match(r'^\d{1,2}$', t.strip())], 
-                 key=lambda x: content.find(x))
+    def flush(self):
+        """Write pending saves; returns False if they are still pending"""
+        with self.lock:
+            if self.write_id is None:
+                return True
+            tokens, write_id = dict(self.tokens), self.write_id
+            self.write_id = None
+        try:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(tokens, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as error:
+            print(f'Error writing team tokens: {error}')
+            with self.lock:
+                if self.write_id is None:
+                    # Keep the original write open so the flush lag keeps counting from the first save
+                    self.write_id = write_id
+                    return False
+            health_monitor.end_write(write_id, False)
+            return False
+        with self.lock:
+            self.version = self._version()
+        health_monitor.end_write(write_id)
+        return True
 
-def parse_time(time_str, context_tz='UTC'):
-    if not time_str:
-        return None
-    
-    timezone = context_tz
-    
-    # Look for timezone in string - improved regex to catch more formats, excluding AM/PM
-    tz_match = re.search(r'\b(?!AM|PM)([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b', time_str, re.IGNORECASE)
-    if tz_match:
-        tz_candidate = tz_match.group(1)
-        # Double-check it's not AM/PM
-        if tz_candidate.upper() not in ['AM', 'PM']:
-            normalized_tz = normalize_timezone(tz_candidate)
-            if normalized_tz:
-                timezone = normalized_tz
-    
-    # Clean up time string
-    clean_time = re.sub(r'\b(at|around|by|before|after)\s+', '', time_str, flags=re.IGNORECASE)
-    # Be more careful about removing timezone - don't remove AM/PM
-    clean_time = re.sub(r'\b(?!AM|PM)([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b', '', clean_time, flags=re.IGNORECASE).strip()
-    
-    try:
-        # Parse different formats
-        if re.match(r'^\d{1,2}:\d{2}\s*(AM|PM)$', clean_time, re.IGNORECASE):
-            dt = datetime.strptime(clean_time.upper(), '%I:%M %p')
-        elif re.match(r'^\d{1,2}\s+(AM|PM)$', clean_time, re.IGNORECASE):
-            dt = datetime.strptime(clean_time.upper(), '%I %p')
-        elif re.match(r'^\d{1,2}(AM|PM)$', clean_time, re.IGNORECASE):
-            # Handle cases like "3pm" without space
-            normalized = re.sub(r'(\d+)(AM|PM)', r'\1 \2', clean_time, flags=re.IGNORECASE)
-            dt = datetime.strptime(normalized.upper(), '%I %p')
-        elif re.match(r'^\d{1,2}:\d{2}$', clean_time):
-            dt = datetime.strptime(clean_time, '%H:%M')
-        else:
-            # Try some additional formats as fallback
-            formats = ['%I:%M:%S %p', '%H:%M:%S', '%I %p', '%H:%M']
-            dt = None
-            for fmt in formats:
-                try:
-                    dt = datetime.strptime(clean_time.upper(), fmt)
-                    break
-                except ValueError:
-                    continue
-            if dt is None:
-                return None
-        
-        # Create timezone-aware datetime for today
-        tz = pytz.timezone(timezone)
-        today = datetime.now(tz).date()
-        localized_dt = tz.localize(datetime.combine(today, dt.time()))
-        
-        return {'datetime': localized_dt, 'timezone': timezone}
-    except:
-        return None
+team_token_file = TeamTokenFile()
 
-def convert_times(content, target_timezone):
-    found_times = extract_times(content)
-    if not found_times:
-        return []
-    
-    results = []
-    
-    for time_str in found_times:
-        # Try to parse with timezone from string, fallback to UTC only if no TZ found
-        parsed = parse_time(time_str)
-        if parsed:
-            target_tz = pytz.timezone(target_timezone)
-            converted = parsed['datetime'].astimezone(target_tz)
-            same_day = parsed['datetime'].date() == converted.date()
-            
-            # Format consistently with proper timezone abbreviations
-            original_formatted = f"{parsed['datetime'].strftime('%I:%M%p').lstrip('0')} {get_timezone_display_name(parsed['timezone'])}"
-            converted_formatted = f"{converted.strftime('%I:%M%p').lstrip('0')} {get_timezone_display_name(target_timezone)}"
-            
-            results.append({
-                'original': original_formatted,
-                'converted': converted_formatted,
-                'date': converted.strftime('%A, %B %d'),
-                'same_day': same_day
-            })
-    
-    return results
+# Shared state
+class LocalStateStore(tzcore.LocalStateStore):
+    """Single-process state: JSON files for preferences and tokens, memory for dedup and rate limits"""
+
+    def __init__(self):
+        super().__init__()
+        self.installs = {}
+
+    def load_team_tokens(self):
+        return team_token_file.load()
+
+    def get_team_token(self, team_id):
+        return team_token_file.get(team_id)
+
+    def save_team_token(self, team_id, token_data):
+        return team_token_file.save(team_id, token_data)
+
+    def seen_event(self, key):
+        return event_dedup.check_and_add(key)
+
+    def set_install_state(self, job_id, state, ttl):
+        now = time.monotonic()
+        with self.lock:
+            for expired in [key for key, (_, until) in self.installs.items() if until <= now]:
+                del self.installs[expired]
+            self.installs[job_id] = (state, now + ttl)
+
+    def get_install_state(self, job_id):
+        with self.lock:
+            entry = self.installs.get(job_id)
+        return entry[0] if entry and entry[1] > time.monotonic() else None
+
+class RedisStateStore(tzcore.RedisStateStore):
+    """State shared by every worker through a Redis-protocol server, including workspace tokens"""
+
+    def __init__(self, url=REDIS_URL, prefix=REDIS_PREFIX, platform=None):
+        super().__init__(url, prefix, platform)
+        self.tokens_key = f'{prefix}:tokens'
+        self.event_prefix = f'{prefix}:event:'
+        self.install_prefix = f'{prefix}:install:'
+
+    def init(self):
+        """Seed Redis from the JSON files the first time a worker starts against an empty server"""
+        super().init()
+        if not self.client.exists(self.tokens_key):
+            tokens = team_token_file.load()
+            if tokens:
+                self.client.hset(self.tokens_key, mapping={t: json.dumps(d) for t, d in tokens.items()})
+
+    def load_team_tokens(self):
+        return {team_id: json.loads(raw) for team_id, raw in self.client.hgetall(self.tokens_key).items()}
+
+    def get_team_token(self, team_id):
+        raw = self.client.hget(self.tokens_key, team_id)
+        return json.loads(raw) if raw else {}
+
+    def save_team_token(self, team_id, token_data):
+        self.client.hset(self.tokens_key, team_id, json.dumps(token_data))
+        return True
+
+    def seen_event(self, key):
+        return not self.client.set(self.event_prefix + key, 1, nx=True, ex=event_dedup.ttl)
+
+    def set_install_state(self, job_id, state, ttl):
+        self.client.set(self.install_prefix + job_id, state, ex=int(ttl))
+
+    def get_install_state(self, job_id):
+        return self.client.get(self.install_prefix + job_id)
+
+class DiskStateStore(tzcore.DiskStateStore, LocalStateStore):
+    """Preferences in SQLite; tokens, dedup and install states as in the local store"""
+
+tzcore.setup('slack', {'local': LocalStateStore, 'redis': RedisStateStore, 'disk': DiskStateStore})
+mark_startup('config')
+
+channel_members = ChannelMemberCache(ttl=int(os.environ.get('CHANNEL_MEMBERS_TTL', '600')))
 
 # Token management
 def load_team_tokens():
-    tokens_file = 'team_tokens.json'
-    if os.path.exists(tokens_file):
-        try:
-            with open(tokens_file, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+    return tzcore.state_store.load_team_tokens()
 
 def get_team_token(team_id):
     """Get access token for a specific team"""
-    tokens = load_team_tokens()
-    return tokens.get(team_id, {}).get('access_token')
+    return tzcore.state_store.get_team_token(team_id).get('access_token')
 
 def save_team_token(team_id, access_token, bot_user_id, team_data=None):
-    tokens_file = 'team_tokens.json'
-    
     try:
-        tokens = {}
-        if os.path.exists(tokens_file):
-            try:
-                with open(tokens_file, 'r') as f:
-                    tokens = json.load(f)
-            except:
-                tokens = {}
-        
         token_data = {
             'access_token': access_token,
             'bot_user_id': bot_user_id,
@@ -272,10 +242,7 @@ def save_team_token(team_id, access_token, bot_user_id, team_data=None):
         if team_data:
             token_data.update(team_data)
         
-        tokens[team_id] = token_data
-        
-        with open(tokens_file, 'w') as f:
-            json.dump(tokens, f, indent=2)
+        tzcore.state_store.save_team_token(team_id, token_data)
             
         print(f"Saved token for team {team_id}")
         return True
@@ -284,14 +251,114 @@ def save_team_token(team_id, access_token, bot_user_id, team_data=None):
         print(f"Error saving team token: {e}")
         return False
 
+# OAuth token exchange
+OAUTH_ACCESS_URL = 'https://slack.com/api/oauth.v2.access'
+OAUTH_CONNECT_TIMEOUT = float(os.environ.get('OAUTH_CONNECT_TIMEOUT', '3'))
+OAUTH_READ_TIMEOUT = float(os.environ.get('OAUTH_READ_TIMEOUT', '10'))
+OAUTH_WORKERS = int(os.environ.get('OAUTH_WORKERS', '4'))
+# Seconds a finished install is remembered for the browser waiting on /installing
+OAUTH_RESULT_TTL = 600
+# A pending install outlives its exchange's timeouts only briefly, so one lost with its worker reads as failed
+OAUTH_PENDING_TTL = OAUTH_CONNECT_TIMEOUT + OAUTH_READ_TIMEOUT + 30
+
+class OAuthExchanger:
+    """Trades install codes for bot tokens on a few background threads over one pooled HTTP session, so the
+    /oauth callback returns at once instead of holding a server thread while Slack answers. Job states live in
+    the state store, so any replica can answer the browser's /installing polls"""
+
+    def __init__(self, workers=OAUTH_WORKERS):
+        self.workers = workers
+        self.session = None
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from concurrent.futures import ThreadPoolExecutor
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=self.workers))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='oauth')
+
+    def submit(self, code):
+        """Start exchanging `code`; returns the job id to poll with state()"""
+        with self.lock:
+            if self.executor is None:
+                self._start()
+        job_id = uuid.uuid4().hex
+        tzcore.state_store.set_install_state(job_id, 'pending', OAUTH_PENDING_TTL)
+        self.executor.submit(self.run, job_id, code)
+        return job_id
+
+    def run(self, job_id, code):
+        ok = self.exchange(code)
+        try:
+            tzcore.state_store.set_install_state(job_id, 'ok' if ok else 'failed', OAUTH_RESULT_TTL)
+        except Exception as error:
+            print(f"Error recording install {job_id}: {error}")
+
+    def state(self, job_id):
+        """'pending', 'ok' or 'failed'; unknown and expired jobs count as failed"""
+        try:
+            return tzcore.state_store.get_install_state(job_id) or 'failed'
+        except Exception as error:
+            print(f"Error reading install {job_id}: {error}")
+            return 'failed'
+
+    def exchange(self, code):
+        try:
+            token_response = self.session.post(OAUTH_ACCESS_URL, data={
+                'client_id': SLACK_CLIENT_ID,
+                'client_secret': SLACK_CLIENT_SECRET,
+                'code': code,
+                'redirect_uri': SLACK_REDIRECT_URI
+            }, timeout=(OAUTH_CONNECT_TIMEOUT, OAUTH_READ_TIMEOUT))
+            
+            if token_response.status_code != 200:
+                print(f"OAuth exchange failed with HTTP {token_response.status_code}")
+                return False
+            
+            token_data = token_response.json()
+            
+            # Check if the OAuth response is successful
+            if not token_data.get('ok'):
+                print(f"OAuth exchange rejected: {token_data.get('error')}")
+                return False
+            
+            # Extract team information
+            team_info = token_data.get('team', {})
+            team_id = team_info.get('id')
+            team_name = team_info.get('name', 'Unknown Team')
+            
+            # Get bot token and user ID
+            bot_token = token_data.get('access_token')
+            bot_user_id = token_data.get('bot_user_id')
+            
+            # Validate we have required data
+            if not all([team_id, bot_token, bot_user_id]):
+                return False
+            
+            # Save the team's token
+            additional_data = {
+                'team_name': team_name,
+                'app_id': token_data.get('app_id'),
+                'scope': token_data.get('scope', '')
+            }
+            
+            return save_team_token(team_id, bot_token, bot_user_id, additional_data)
+        except Exception as e:
+            print(f"OAuth exchange error: {e}")
+            return False
+
+oauth_exchanger = OAuthExchanger()
+
 # Socket mode app setup with multi-workspace support
 def authorize(enterprise_id, team_id, user_id):
     """Authorize function that loads bot tokens from team_tokens.json"""
     from slack_bolt.authorization import AuthorizeResult
     
-    # Load team tokens from file
-    tokens = load_team_tokens()
-    team_data = tokens.get(team_id, {})
+    # Load this team's token from the state store
+    team_data = tzcore.state_store.get_team_token(team_id)
     bot_token = team_data.get('access_token')
     bot_user_id = team_data.get('bot_user_id')
     
@@ -306,12 +373,206 @@ def authorize(enterprise_id, team_id, user_id):
         bot_user_id=bot_user_id
     )
 
+# Workspace scheduling
+class WorkspaceScheduler:
+    """Per-workspace queues served round-robin by a shared worker pool, with per-workspace concurrency caps"""
+
+    def __init__(self, workers=8, per_team_limit=2, max_queue=500):
+        self.worker_count = workers
+        self.per_team_limit = per_team_limit
+        self.max_queue = max_queue
+        self.queues = {}
+        self.running = {}
+        self.stats = {}
+        self.ready = deque()
+        self.ready_teams = set()
+        self.cond = threading.Condition()
+        self.workers = []
+
+    def _start(self):
+        for i in range(self.worker_count):
+            worker = threading.Thread(target=self._work, name=f'workspace-worker-{i}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _mark_ready(self, team_id):
+        if (team_id not in self.ready_teams and self.queues.get(team_id)
+                and self.running.get(team_id, 0) < self.per_team_limit):
+            self.ready.append(team_id)
+            self.ready_teams.add(team_id)
+            self.cond.notify()
+
+    def submit(self, team_id, fn, *args):
+        """Queue `fn(*args)` for a workspace; returns False if that workspace's queue is full"""
+        team_id = team_id or 'unknown'
+        with self.cond:
+            if not self.workers:
+                self._start()
+            queue = self.queues.setdefault(team_id, deque())
+            stats = self.stats.setdefault(team_id, {'processed': 0, 'dropped': 0, 'errors': 0, 'wait_ms': 0.0, 'run_ms': 0.0})
+            if len(queue) >= self.max_queue:
+                stats['dropped'] += 1
+                print(f"Dropping work for team {team_id}: queue full")
+                return False
+            queue.append((time.monotonic(), fn, args))
+            self._mark_ready(team_id)
+            return True
+
+    def _next(self):
+        while True:
+            while self.ready:
+                team_id = self.ready.popleft()
+                self.ready_teams.discard(team_id)
+                queue = self.queues.get(team_id)
+                if queue and self.running.get(team_id, 0) < self.per_team_limit:
+                    item = queue.popleft()
+                    self.running[team_id] = self.running.get(team_id, 0) + 1
+                    # Back of the line, so every other workspace gets a turn first
+                    self._mark_ready(team_id)
+                    return team_id, item
+            self.cond.wait()
+
+    def _work(self):
+        while True:
+            with self.cond:
+                team_id, (queued_at, fn, args) = self._next()
+            started = time.monotonic()
+            failed = False
+            try:
+                fn(*args)
+            except Exception as e:
+                failed = True
+                print(f"Error processing work for team {team_id}: {e}")
+            finished = time.monotonic()
+            health_monitor.observe(finished - queued_at)
+            with self.cond:
+                self.running[team_id] -= 1
+                stats = self.stats[team_id]
+                stats['processed'] += 1
+                stats['errors'] += failed
+                stats['wait_ms'] += (started - queued_at) * 1000
+                stats['run_ms'] += (finished - started) * 1000
+                self._mark_ready(team_id)
+
+    def depth(self):
+        """Work queued across every workspace"""
+        with self.cond:
+            return sum(map(len, self.queues.values()))
+
+    def snapshot(self):
+        """Queue depth, concurrency and average wait/run time per workspace"""
+        with self.cond:
+            report = {}
+            for team_id, stats in self.stats.items():
+                processed = stats['processed'] or 1
+                report[team_id] = {
+                    'queued': len(self.queues.get(team_id, ())),
+                    'running': self.running.get(team_id, 0),
+                    'processed': stats['processed'],
+                    'dropped': stats['dropped'],
+                    'errors': stats['errors'],
+                    'avg_wait_ms': round(stats['wait_ms'] / processed, 1),
+                    'avg_run_ms': round(stats['run_ms'] / processed, 1),
+                }
+            return report
+
+workspace_scheduler = WorkspaceScheduler(
+    workers=int(os.environ.get('SLACK_WORKERS', '8')),
+    per_team_limit=int(os.environ.get('SLACK_PER_WORKSPACE_CONCURRENCY', '2')),
+    max_queue=int(os.environ.get('SLACK_WORKSPACE_QUEUE_LIMIT', '500'))
+)
+
+# Traffic recording
+# Only the fields the handlers read are kept; everything else, such as response URLs, blocks, files and
+# profile details, is dropped
+TRAFFIC_KEPT_KEYS = {'type', 'subtype', 'event', 'event_id', 'event_time', 'command', 'text', 'user', 'user_id',
+                     'channel', 'channel_id', 'team', 'team_id', 'enterprise_id', 'ts', 'thread_ts', 'client_msg_id',
+                     'bot_id', 'message', 'previous_message', 'actions', 'action_id', 'selected_option', 'value', 'id'}
+# Scalars under these keys are user, channel or workspace ids
+TRAFFIC_ID_KEYS = {'id', 'user', 'user_id', 'channel', 'channel_id', 'team', 'team_id', 'enterprise_id', 'bot_id'}
+# Free text, masked apart from times and zone names; `value` holds what was typed into the zone picker
+TRAFFIC_TEXT_KEYS = {'text', 'value'}
+traffic_recorder = TrafficRecorder(TRAFFIC_LOG_PATH, TRAFFIC_LOG_SALT, TRAFFIC_KEPT_KEYS, TRAFFIC_ID_KEYS, TRAFFIC_TEXT_KEYS)
+atexit.register(traffic_recorder.close)
+
+# Event deduplication
+class EventDedupCache:
+    """Bounded set of recently seen event keys that expire after `ttl` seconds"""
+
+    def __init__(self, ttl=600, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.duplicates = 0
+
+    def check_and_add(self, key):
+        """Record `key`, returning True if it was already seen within the TTL"""
+        now = time.monotonic()
+        with self.lock:
+            while self.entries:
+                _, expires_at = next(iter(self.entries.items()))
+                if expires_at > now and len(self.entries) < self.max_size:
+                    break
+                self.entries.popitem(last=False)
+            if key in self.entries:
+                self.duplicates += 1
+                return True
+            self.entries[key] = now + self.ttl
+            return False
+
+def event_dedup_key(body):
+    """event_id for Events API payloads, falling back to the message's client_msg_id"""
+    if body.get("event_id"):
+        return body["event_id"]
+    event = body.get("event") or {}
+    if event.get("client_msg_id"):
+        return f"{event.get('type')}:{event['client_msg_id']}"
+    return None
+
+event_dedup = EventDedupCache(ttl=int(os.environ.get('SLACK_EVENT_DEDUP_TTL', '600')))
+
+def drop_duplicate_events(body, next):
+    """Acknowledge Slack retries of events already being handled without running them again; runs before
+    authorize, so a retry costs no token lookup"""
+    key = event_dedup_key(body)
+    if key and tzcore.state_store.seen_event(key):
+        return BoltResponse(status=200, body="")
+    next()
+
 app = App(
     authorize=authorize,
+    before_authorize=drop_duplicate_events,
     signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
     process_before_response=True
 )
 
+def traffic_kind(body):
+    """(kind, user id) of a Slack request body, for the traffic log"""
+    if body.get("command"):
+        return f"command:{body['command']}", body.get("user_id")
+    if body.get("type") == "event_callback":
+        event = body.get("event") or {}
+        return f"event:{event.get('type')}", event.get("user") or (event.get("message") or {}).get("user")
+    return body.get("type", "unknown"), (body.get("user") or {}).get("id")
+
+@app.middleware
+def record_traffic(body, next):
+    """Log incoming events, commands and actions when TRAFFIC_LOG_PATH is set"""
+    if traffic_recorder.enabled:
+        kind, user_id = traffic_kind(body)
+        traffic_recorder.record(kind, body, user_id)
+    next()
+
+@app.middleware
+def track_sends(context, next):
+    """Hand listeners say/respond wrappers that report whether replies went out, for /ready"""
+    for name in ("say", "respond"):
+        send = getattr(context, name)
+        if send is not None:
+            context[name] = functools.partial(health_monitor.track_send, send)
+    next()
+
 @app.event("app_installed")
 def handle_app_installed(event, say, context):
     """Handle app installation event"""
@@ -326,8 +587,21 @@ def handle_app_uninstalled(event, context):
     print(f"App uninstalled for team {team_id}")
     # Could remove token here if needed
 
+def workspace_scopes(team_id, channel_id, user_timezone=None):
+    """Abbreviation prior scopes for a channel and then its workspace, counting the user's zone in both"""
+    scopes = (('channel', channel_id), ('team', team_id))
+    for scope in scopes:
+        abbreviation_resolver.observe(scope, user_timezone)
+    return scopes
+
 @app.event("message")
-def handle_message(event, say):
+def handle_message(event, say, client, context):
+    if event.get("subtype") == "message_changed":
+        workspace_scheduler.submit(context.get("team_id"), process_message_edit, event, say, client)
+    else:
+        workspace_scheduler.submit(context.get("team_id"), process_message, event, say)
+
+def process_message(event, say):
     try:
         if event.get("subtype") == "bot_message" or event.get("bot_id"):
             return
@@ -339,153 +613,331 @@ def handle_message(event, say):
         if not user_timezone:
             return
         
-        conversions = convert_times(text, user_timezone)
-        if conversions:
-            response = f"*Times in your timezone ({user_timezone})*\n\n"
-            for conv in conversions:
-                if conv['same_day']:
-                    response += f"*{conv['original']}* → *{conv['converted']}*\n"
-                else:
-                    response += f"*{conv['original']}* → *{conv['converted']}* ({conv['date']})\n"
-            
-            say(response.strip())
+        key = (event.get("channel"), event.get("ts"))
+        scopes = workspace_scopes(event.get("team"), event.get("channel"), user_timezone)
+        tracked, conversions = convert_tracked_message(key, text, user_timezone, scopes=scopes)
+        if conversions and allow_reply(user_id):
+            tracked.response = format_conversion_response(conversions, user_timezone)
+            tracked.reply = say(tracked.response).get("ts")
+        reply_tracker.remember(key, tracked)
     except Exception as e:
         print(f"Error handling message: {e}")
 
+def process_message_edit(event, say, client):
+    """Rescan only the edited part of a message and update the earlier reply instead of posting again"""
+    try:
+        message = event.get("message", {})
+        if message.get("bot_id") or message.get("subtype") == "bot_message":
+            return
+        if message.get("text") == event.get("previous_message", {}).get("text"):
+            # Unfurls and other metadata-only changes
+            return
+        
+        user_id = message.get("user")
+        user_timezone = get_user_timezone(user_id)
+        if not user_timezone:
+            return
+        
+        channel = event.get("channel")
+        key = (channel, message.get("ts"))
+        if not reply_tracker.get(key) and event.get("previous_message"):
+            # Not seen by this process: scan the previous text so the rescan still has a baseline
+            previous = event["previous_message"].get("text", "")
+            reply_tracker.remember(key, TrackedMessage(previous, scan_time_spans(previous), user_timezone, {}))
+        scopes = workspace_scopes(message.get("team") or event.get("team"), channel)
+        tracked, conversions = convert_tracked_message(key, message.get("text", ""), user_timezone, scopes=scopes)
+        response = format_conversion_response(conversions, user_timezone)
+        if tracked.reply and response:
+            if response != tracked.response:
+                health_monitor.track_send(client.chat_update, channel=channel, ts=tracked.reply, text=response)
+        elif tracked.reply:
+            client.chat_delete(channel=channel, ts=tracked.reply)
+            tracked.reply = None
+        elif response and allow_reply(user_id):
+            tracked.reply = say(response).get("ts")
+        tracked.response = response
+        reply_tracker.remember(key, tracked)
+    except Exception as e:
+        print(f"Error handling message edit: {e}")
+
+def fetch_channel_members(client, channel_id):
+    """Page through conversations.members for a channel"""
+    members = []
+    cursor = None
+    while True:
+        response = client.conversations_members(channel=channel_id, limit=1000, cursor=cursor)
+        members.extend(response.get("members", []))
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            return members
+
+@app.event("member_joined_channel")
+def handle_member_joined(event):
+    channel_members.add_member(event.get("channel"), event.get("user"))
+
+@app.event("member_left_channel")
+def handle_member_left(event):
+    channel_members.remove_member(event.get("channel"), event.get("user"))
+
 @app.event("app_mention")
-def handle_app_mention(event, say):
+def handle_app_mention(event, say, client, context):
+    workspace_scheduler.submit(context.get("team_id"), process_app_mention, event, say, client)
+
+def process_app_mention(event, say, client):
     try:
         text = event.get("text", "")
         user_id = event.get("user")
+        channel_id = event.get("channel")
         
         user_timezone = get_user_timezone(user_id)
-        if not user_timezone:
-            say("No timezone set. Use `/timezone EST` to set one")
+        zones = set()
+        if channel_id:
+            zones = channel_members.get_zones(channel_id, lambda c: fetch_channel_members(client, c))
+        if user_timezone:
+            zones.add(user_timezone)
+        
+        if not zones:
+            say(render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"))
             return
         
-        conversions = convert_times(text, user_timezone)
-        if conversions:
-            response = f"*Times in your timezone ({user_timezone})*\n\n"
-            for conv in conversions:
-                if conv['same_day']:
-                    response += f"*{conv['original']}* → *{conv['converted']}*\n"
-                else:
-                    response += f"*{conv['original']}* → *{conv['converted']}* ({conv['date']})\n"
-            
-            say(response.strip())
+        scopes = workspace_scopes(event.get("team"), channel_id)
+        for zone in zones:
+            abbreviation_resolver.observe(scopes[0], zone)
+        if zones == {user_timezone}:
+            response = format_conversion_response(convert_times(text, user_timezone, scopes=scopes), user_timezone)
         else:
-            say("No times found. Use format: `/convert 3:00PM EST`")
+            response = format_group_conversion_response(convert_times_to_zones(text, zones, scopes))
+        
+        if response:
+            say(response)
+        else:
+            say(render_message('errors', 'no_times_found', "No times found. Use format: `/convert 3:00PM EST`"))
     except Exception as e:
         print(f"Error handling app mention: {e}")
 
 @app.command("/timezone")
 def set_timezone_command(ack, respond, command):
     ack()
-    
+    workspace_scheduler.submit(command.get("team_id"), run_timezone_command, respond, command)
+
+def run_timezone_command(respond, command):
     try:
         timezone_input = command['text'].strip()
         user_id = command['user_id']
         
         if not timezone_input:
             current_tz = get_user_timezone(user_id)
-            respond(f"Your timezone: `{current_tz or 'Not set'}`\n\nSet with: `/timezone EST` or `/timezone America/New_York`")
+            respond(render_message('commands', 'timezone_current', "Your timezone: `{timezone}`\n\nSet with: `/timezone EST` or `/timezone America/New_York`",
+                                   timezone=current_tz or 'Not set'))
             return
         
-        if not normalize_timezone(timezone_input):
-            respond("Invalid timezone. Try `/timezone EST` or `/timezone America/New_York`")
+        if not resolve_timezone_input(timezone_input):
+            if zone_suggester.suggest(timezone_input, 1):
+                prompt = render_message('errors', 'timezone_suggestions', "Unknown timezone `{input}`. Did you mean one of these?", input=timezone_input)
+                respond(text=prompt, blocks=timezone_picker_blocks(prompt, timezone_input))
+                return
+            respond(render_message('errors', 'invalid_timezone', "Invalid timezone. Try `/timezone EST` or `/timezone America/New_York`"))
             return
         
         success = set_user_timezone(user_id, timezone_input)
         
         if success:
-            tz = pytz.timezone(normalize_timezone(timezone_input))
-            current_time = datetime.now(tz)
+            workspace_scopes(command.get('team_id'), command.get('channel_id'), resolve_timezone_input(timezone_input))
+            current_time = zone_now(resolve_timezone_input(timezone_input))
             formatted_time = current_time.strftime('%I:%M %p %Z').lstrip('0')
             
-            respond(f"Timezone set to `{timezone_input}`\nCurrent time: *{formatted_time}*")
+            respond(render_message('success', 'timezone_set', "Timezone set to `{timezone}`\nCurrent time: **{time}**",
+                                   timezone=timezone_input, time=formatted_time))
         else:
-            respond("Failed to save timezone")
+            respond(render_message('errors', 'failed_to_save', "Failed to save timezone"))
     
     except Exception as e:
         print(f"Error in /timezone command: {e}")
         respond("An error occurred while processing your request.")
 
+def zone_option(label, zone):
+    return {"text": {"type": "plain_text", "text": (zone if label == zone else f"{label} ({zone})")[:75]}, "value": zone}
+
+def timezone_picker_blocks(prompt, query):
+    """A prompt with buttons for the best matches and a picker that searches through the options endpoint"""
+    buttons = [dict(zone_option(label, zone), type="button", action_id=f"timezone_choice_{i}")
+               for i, (label, zone) in enumerate(zone_suggester.suggest(query, 3))]
+    return [
+        {"type": "section", "text": {"type": "mrkdwn", "text": prompt}},
+        {"type": "actions", "elements": buttons + [{
+            "type": "external_select",
+            "action_id": "timezone_select",
+            "placeholder": {"type": "plain_text", "text": "Search timezones"},
+            "min_query_length": 1
+        }]}
+    ]
+
+@app.options("timezone_select")
+def timezone_options(ack, payload):
+    ack(options=[zone_option(label, zone) for label, zone in zone_suggester.suggest(payload.get("value", ""))])
+
+@app.action(re.compile(r"^timezone_(select|choice_\d+)$"))
+def timezone_selected(ack, body, action, respond):
+    ack()
+    zone = action.get("value") or action["selected_option"]["value"]
+    if not set_user_timezone(body["user"]["id"], zone):
+        respond(render_message('errors', 'failed_to_save', "Failed to save timezone"))
+        return
+    workspace_scopes(body.get("team", {}).get("id"), body.get("channel", {}).get("id"), zone)
+    formatted_time = zone_now(zone).strftime('%I:%M %p %Z').lstrip('0')
+    respond(replace_original=True,
+            text=render_message('success', 'timezone_set', "Timezone set to `{timezone}`\nCurrent time: **{time}**",
+                                timezone=zone, time=formatted_time))
+
 @app.command("/convert")
 def convert_time_command(ack, respond, command):
     ack()
-    
+    workspace_scheduler.submit(command.get("team_id"), run_convert_command, respond, command)
+
+def run_convert_command(respond, command):
     try:
         text = command['text'].strip()
         user_id = command['user_id']
         
         if not text:
-            respond("Provide a time to convert:\n• `/convert 3:00PM EST`\n• `/convert 14:30 PST`\n• `/convert 4 PM` (assumes UTC)")
+            respond(render_message('commands', 'convert_usage', "Provide a time to convert:\n• `/convert 3:00PM EST`\n• `/convert 14:30 PST`\n• `/convert 4 PM` (assumes UTC)"))
             return
         
         user_timezone = get_user_timezone(user_id)
         if not user_timezone:
-            respond("No timezone set. Use `/timezone EST` to set one")
+            respond(render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"))
             return
         
-        conversions = convert_times(text, user_timezone)
+        response = convert_query(text, user_timezone,
+                                 workspace_scopes(command.get('team_id'), command.get('channel_id'), user_timezone))
+        
+        if not response:
+            respond(render_message('errors', 'no_times_found', "No times found. Use format: `/convert 3:00PM EST`"))
+            return
         
-        if not conversions:
-            found_times = extract_times(text)
-            for time_str in found_times:
-                parsed = parse_time(time_str, 'UTC')
-                if parsed:
-                    target_tz = pytz.timezone(user_timezone)
-                    converted = parsed['datetime'].astimezone(target_tz)
-                    same_day = parsed['datetime'].date() == converted.date()
-                    
-                    original_formatted = f"{time_str} UTC"
-                    converted_formatted = f"{converted.strftime('%I:%M%p').lstrip('0')} {get_timezone_display_name(user_timezone)}"
-                    
-                    conversions.append({
-                        'original': original_formatted,
-                        'converted': converted_formatted,
-                        'date': converted.strftime('%A, %B %d'),
-                        'same_day': same_day
-                    })
+        respond(response)
+    
+    except Exception as e:
+        print(f"Error in /convert command: {e}")
+        respond("An error occurred while processing your request.")
+
+@app.command("/overlap")
+def overlap_command(ack, respond, command, client):
+    ack()
+    workspace_scheduler.submit(command.get("team_id"), run_overlap_command, respond, command, client)
+
+def run_overlap_command(respond, command, client):
+    """Common working hours for the mentioned users, or the whole channel when nobody is mentioned"""
+    try:
+        text = command.get('text', '')
+        user_id = command['user_id']
+        start_hour, end_hour, days = parse_overlap_options(re.sub(r'<[^>]*>', ' ', text))
         
-        if not conversions:
-            respond("No times found. Use format: `/convert 3:00PM EST`")
+        user_timezone = get_user_timezone(user_id)
+        if not user_timezone:
+            respond(render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"))
             return
         
-        response = f"*Times in your timezone ({user_timezone})*\n\n"
-        for conv in conversions:
-            if conv['same_day']:
-                response += f"*{conv['original']}* → *{conv['converted']}*\n"
-            else:
-                response += f"*{conv['original']}* → *{conv['converted']}* ({conv['date']})\n"
+        members = set(re.findall(r'<@([UW][A-Z0-9]+)', text))
+        if not members and command.get('channel_id'):
+            members = set(channel_members.get_members(command['channel_id'], lambda c: fetch_channel_members(client, c)))
+        members.add(user_id)
+        zones = tzcore.user_index.zones_for(members)
+        people = sum(1 for member in members if get_user_timezone(member))
+        for zone in zones:
+            abbreviation_resolver.observe(('channel', command.get('channel_id')), zone)
         
-        respond(response.strip())
+        windows = find_overlap(zones, start_hour, end_hour, days)
+        respond(format_overlap_response(windows, user_timezone, start_hour, end_hour, days, people))
     
     except Exception as e:
-        print(f"Error in /convert command: {e}")
+        print(f"Error in /overlap command: {e}")
+        respond("An error occurred while processing your request.")
+
+# Slack reserves /remind for its built-in reminders
+@app.command("/tzremind")
+def remind_command(ack, respond, command, client):
+    ack()
+    workspace_scheduler.submit(command.get("team_id"), run_remind_command, respond, command, client)
+
+def run_remind_command(respond, command, client):
+    try:
+        text = command['text'].strip()
+        user_id = command['user_id']
+        
+        if not text:
+            respond(render_message('commands', 'remind_usage', "Schedule a reminder for everyone here:\n• `{command} 3:00PM EST standup`", command='/tzremind'))
+            return
+        
+        user_timezone = get_user_timezone(user_id)
+        if not user_timezone:
+            respond(render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"))
+            return
+        
+        plan = plan_reminder(text, user_timezone,
+                             workspace_scopes(command.get('team_id'), command.get('channel_id'), user_timezone))
+        if not plan:
+            respond(render_message('errors', 'no_times_found', "No times found. Use format: `/convert 3:00PM EST`"))
+            return
+        
+        due, note = plan
+        if due is None:
+            respond(render_message('errors', 'reminder_in_past', "That time has already passed today"))
+            return
+        members = {user_id}
+        if command.get('channel_id'):
+            members |= channel_members.get_members(command['channel_id'], lambda c: fetch_channel_members(client, c))
+        participants = [(member, zone) for member, zone in ((m, get_user_timezone(m)) for m in members) if zone]
+        reminder_scheduler.schedule(build_reminders(due, note, participants, team=command.get('team_id')))
+        
+        local = build_conversion({'datetime': due, 'timezone': 'UTC'}, user_timezone)
+        respond(render_message('success', 'reminder_scheduled', "Reminder set for **{time}** ({count} people)",
+                               time=f"{local.converted}, {local.date}", count=len(participants)))
+    
+    except Exception as e:
+        print(f"Error in /tzremind command: {e}")
         respond("An error occurred while processing your request.")
 
+def deliver_reminder(reminder):
+    workspace_scheduler.submit(reminder.get('team'), send_reminder, reminder)
+
+def send_reminder(reminder):
+    """Post a reminder to the participant's DM with the bot, using their workspace's token"""
+    from slack_sdk import WebClient
+    token = get_team_token(reminder.get('team'))
+    if not token:
+        print(f"No token to deliver reminder for team {reminder.get('team')}")
+        return
+    try:
+        health_monitor.track_send(WebClient(token=token).chat_postMessage, channel=reminder['user'], text=render_reminder(reminder))
+    except Exception as e:
+        print(f"Could not deliver reminder to {reminder['user']}: {e}")
+
+reminder_scheduler = ReminderScheduler(deliver_reminder)
+
 @app.command("/mytimezone")
 def show_timezone_command(ack, respond, command):
     ack()
-    
+    workspace_scheduler.submit(command.get("team_id"), run_mytimezone_command, respond, command)
+
+def run_mytimezone_command(respond, command):
     try:
         user_id = command['user_id']
         user_timezone = get_user_timezone(user_id)
         
         if not user_timezone:
-            respond("No timezone set. Use `/timezone EST` to set one")
+            respond(render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"))
             return
         
         try:
-            tz = pytz.timezone(user_timezone)
-            current_time = datetime.now(tz)
+            current_time = zone_now(user_timezone)
             formatted_time = current_time.strftime('%I:%M %p %Z').lstrip('0')
             date_str = current_time.strftime('%A, %B %d, %Y')
             
-            respond(f"*Your timezone:* `{user_timezone}`\n*Current time:* {formatted_time}\n*Date:* {date_str}")
+            respond(render_message('success', 'mytimezone_display', "**Your timezone:** `{timezone}`\n**Current time:** {time}\n**Date:** {date}",
+                                   timezone=user_timezone, time=formatted_time, date=date_str))
         except:
-            respond(f"*Your timezone:* `{user_timezone}`")
+            respond(render_message('success', 'mytimezone_simple', "**Your timezone:** `{timezone}`", timezone=user_timezone))
     
     except Exception as e:
         print(f"Error in /mytimezone command: {e}")
@@ -496,25 +948,29 @@ def help_command(ack, respond, command):
     ack()
     
     try:
-        help_text = """*Commands:*
+        help_text = render_message('help', 'content', """**Commands:**
 /timezone <timezone> - Set your timezone
 /convert <time> - Convert a time
 /mytimezone - Show your timezone
 /help - Show this help
 
-*Formats:*
+**Formats:**
 • 4 PM EST - 12-hour with timezone
 • 4:30 PM PST - 12-hour with minutes  
 • 16:30 GMT - 24-hour format
 • 14:00 UTC - 24-hour format
 
-*Timezones:*
+**Timezones:**
 • EST, PST, GMT, UTC, etc.
 • America/New_York, Europe/London
 • UTC-5, UTC+3
 
-*Auto-detection:*
-I detect times in messages and convert them automatically."""
+**Auto-detection:**
+I detect times in messages and convert them automatically.""")
+        # Slack has no /meeting, and reserves /remind for its built-in reminders
+        help_text += '\n\n' + render_message('help', 'group_commands', """**Group commands:**
+{meeting}{remind} <time> <note> - Remind everyone here at that time
+/overlap [9-17] [7d] - Find working hours shared by everyone here""", meeting='', remind='/tzremind')
         
         respond(help_text)
     
@@ -528,9 +984,47 @@ def global_error_handler(error, body, logger):
 
 
 
-# Flask app for handling Slack events
-flask_app = Flask(__name__)
-handler = SlackRequestHandler(app)
+# Flask app for handling Slack events, built on first use so Flask stays out of socket-mode startup
+_flask_app = None
+_flask_routes = []
+handler = None
+
+def route(rule, **options):
+    """Record a Flask route to register when create_flask_app() builds the app"""
+    def register(view):
+        _flask_routes.append((rule, view, options))
+        return view
+    return register
+
+def create_flask_app():
+    global _flask_app, handler
+    if _flask_app is None:
+        from flask import Flask
+        from slack_bolt.adapter.flask import SlackRequestHandler
+        
+        flask_app = Flask(__name__)
+        for rule, view, options in _flask_routes:
+            flask_app.add_url_rule(rule, view_func=view, **options)
+        handler = SlackRequestHandler(app)
+        _flask_app = flask_app
+        # WSGI servers import the app without running __main__, so warm up alongside them
+        cache_warmer.start()
+    return _flask_app
+
+def __getattr__(name):
+    # Keep `app:flask_app` working for WSGI servers
+    if name == 'flask_app':
+        return create_flask_app()
+    raise AttributeError(name)
+
+_compiled_pages = {}
+
+def render_page(template, **context):
+    """Compile an HTML page template with Jinja on first use and reuse it afterwards"""
+    compiled = _compiled_pages.get(template)
+    if compiled is None:
+        compiled = _compiled_pages[template] = create_flask_app().jinja_env.from_string(template)
+    return compiled.render(**context)
 
 # Test website template
 TEST_WEBSITE = """
@@ -619,7 +1113,7 @@ TEST_WEBSITE = """
             <ul>
                 <li>✅ Main service: Running on port 8944</li>
                 <li>✅ Event handler: Ready to receive Slack events</li>
-                <li>✅ Commands: /timezone, /convert, /mytimezone, /help</li>
+                <li>✅ Commands: /timezone, /convert, /mytimezone, /tzremind, /overlap, /help</li>
             </ul>
         </div>
         
@@ -728,7 +1222,7 @@ INSTALL_TEMPLATE = """
         
         <p>ready to never miss a meeting due to timezone confusion again?</p>
         
-        <a href="https://slack.com/oauth/v2/authorize?client_id={{ client_id }}&scope=app_mentions:read,channels:history,chat:write,commands&redirect_uri={{ redirect_uri }}&state=install" class="install-button">
+        <a href="https://slack.com/oauth/v2/authorize?client_id={{ client_id }}&scope=app_mentions:read,channels:history,channels:read,groups:read,chat:write,commands&redirect_uri={{ redirect_uri }}&state=install" class="install-button">
             add to slack →
         </a>
     </div>
@@ -898,9 +1392,61 @@ ERROR_TEMPLATE = """
 </html>
 """
 
-@flask_app.route("/", methods=["GET", "POST"])
+INSTALLING_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta http-equiv="refresh" content="1">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>installing</title>
+    <style>
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'SF Mono', Monaco, 'Cascadia Code', 'Roboto Mono', Consolas, 'Courier New', monospace;
+            margin: 0;
+            padding: 0;
+            background: #f8f8f8;
+            min-height: 100vh;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+        }
+        .container {
+            background: #fff;
+            border: 1px solid #e5e5e5;
+            padding: 3rem 2rem;
+            max-width: 500px;
+            margin: 2rem;
+        }
+        h1 {
+            color: #1a1a1a;
+            margin-bottom: 1rem;
+            font-size: 1.5rem;
+            font-weight: 500;
+            letter-spacing: -0.015em;
+        }
+        p {
+            color: #666;
+            line-height: 1.5;
+            margin-bottom: 1rem;
+            font-size: 0.875rem;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>finishing installation…</h1>
+        <p>connecting the bot to your workspace. this page will move on by itself in a moment.</p>
+    </div>
+</body>
+</html>
+"""
+
+@route("/", methods=["GET", "POST"])
 def root():
     """Root endpoint - shows test website on GET, handles Slack events on POST"""
+    from flask import request
+    
     if request.method == "GET":
         return TEST_WEBSITE
     elif request.method == "POST":
@@ -913,12 +1459,14 @@ def root():
             traceback.print_exc()
             return "", 500
 
-@flask_app.route("/slack/events", methods=["POST"])
+@route("/slack/events", methods=["POST"])
 def slack_events():
     """Handle Slack events (backup endpoint)"""
+    from flask import request
+    
     return handler.handle(request)
 
-@flask_app.route("/status")
+@route("/status")
 def status():
     """Status endpoint"""
     tokens = load_team_tokens()
@@ -927,28 +1475,48 @@ def status():
         "mode": "socket" if SLACK_APP_TOKEN else "http",
         "oauth_enabled": bool(SLACK_CLIENT_ID and SLACK_CLIENT_SECRET),
         "installed_workspaces": len(tokens),
+        "startup": startup_report(),
+        "workspace_load": workspace_scheduler.snapshot(),
+        "reply_cache": reply_cache.stats(),
+        "extraction": extraction_stats,
+        "reminders": reminder_scheduler.snapshot(),
+        "abbreviations": abbreviation_resolver.snapshot(),
+        "warmup": cache_warmer.snapshot(),
         "workspaces": [{"team_id": tid, "team_name": data.get("team_name", "Unknown")} for tid, data in tokens.items()]
     }
 
-@flask_app.route("/health")
+@route("/health")
 def health():
-    """Health check endpoint"""
-    return {"status": "ok", "service": "timezone-bot-unified", "port": 8944, "oauth_enabled": True}
+    """Health check endpoint with rolling latency, queue, cache, storage and send figures; unhealthy until the
+    startup cache warm-up has finished"""
+    warmed = cache_warmer.ready.is_set()
+    report = health_monitor.report(workspace_scheduler.depth())
+    return {"status": "ok" if warmed else "warming", "service": "timezone-bot-unified", "port": 8944,
+            "oauth_enabled": True, **report}, 200 if warmed else 503
+
+@route("/ready")
+def ready():
+    """Readiness endpoint; 503 while any SLO is breached, so load balancers can shed or restart this instance"""
+    report = health_monitor.report(workspace_scheduler.depth())
+    breaches = health_monitor.breaches(report)
+    return {"status": "unready" if breaches else "ready", "breaches": breaches, **report}, 503 if breaches else 200
 
 
 
-@flask_app.route('/install')
+@route('/install')
 def install():
     """Show the installation page with Add to Slack button"""
-    return render_template_string(
+    return render_page(
         INSTALL_TEMPLATE,
         client_id=SLACK_CLIENT_ID,
         redirect_uri=SLACK_REDIRECT_URI
     )
 
-@flask_app.route('/oauth')
+@route('/oauth')
 def oauth_callback():
     """Handle the OAuth callback from Slack"""
+    from flask import request, redirect
+    
     try:
         # Get the authorization code from Slack
         code = request.args.get('code')
@@ -967,61 +1535,104 @@ def oauth_callback():
         if state != 'install':
             return redirect('/error')
         
-        # Exchange the code for an access token
-        token_response = requests.post('https://slack.com/api/oauth.v2.access', data={
-            'client_id': SLACK_CLIENT_ID,
-            'client_secret': SLACK_CLIENT_SECRET,
-            'code': code,
-            'redirect_uri': SLACK_REDIRECT_URI
-        })
-        
-        if token_response.status_code != 200:
-            return redirect('/error')
-        
-        token_data = token_response.json()
-        
-        # Check if the OAuth response is successful
-        if not token_data.get('ok'):
-            return redirect('/error')
-        
-        # Extract team information
-        team_info = token_data.get('team', {})
-        team_id = team_info.get('id')
-        team_name = team_info.get('name', 'Unknown Team')
-        
-        # Get bot token and user ID
-        bot_token = token_data.get('access_token')
-        bot_user_id = token_data.get('bot_user_id')
-        
-        # Validate we have required data
-        if not all([team_id, bot_token, bot_user_id]):
-            return redirect('/error')
-        
-        # Save the team's token
-        additional_data = {
-            'team_name': team_name,
-            'app_id': token_data.get('app_id'),
-            'scope': token_data.get('scope', '')
-        }
-        
-        if not save_team_token(team_id, bot_token, bot_user_id, additional_data):
-            return redirect('/error')
-        
-        return redirect('/thanks')
+        # Exchange the code in the background; the browser waits on /installing meanwhile
+        job_id = oauth_exchanger.submit(code)
+        return redirect(f'/installing?job={job_id}')
         
     except Exception as e:
         print(f"OAuth callback error: {e}")
         return redirect('/error')
 
-@flask_app.route('/thanks')
+@route('/installing')
+def installing():
+    """Wait page while an install's token exchange runs; moves on to /thanks or /error when it finishes"""
+    from flask import request, redirect
+    
+    state = oauth_exchanger.state(request.args.get('job', ''))
+    if state == 'pending':
+        return render_page(INSTALLING_TEMPLATE)
+    return redirect('/thanks' if state == 'ok' else '/error')
+
+@route('/thanks')
 def thanks():
     """Show success page after successful installation"""
-    return render_template_string(SUCCESS_TEMPLATE)
+    return render_page(SUCCESS_TEMPLATE)
 
-@flask_app.route('/error')
+@route('/error')
 def error():
     """Show error page if installation fails"""
-    return render_template_string(ERROR_TEMPLATE)
+    return render_page(ERROR_TEMPLATE)
+
+class ReplayClient:
+    """WebClient stand-in for replay: every call succeeds and member lists come back empty"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: {"ok": True, "ts": str(tzcore.clock.now().timestamp()), "members": [], "response_metadata": {}}
+
+def replay_slack_body(body, client):
+    """Run one recorded request body through the work it reached in production, synchronously"""
+    reply = lambda *args, **kwargs: {"ok": True, "ts": str(tzcore.clock.now().timestamp())}
+    if body.get("command"):
+        runners = {
+            "/timezone": lambda: run_timezone_command(reply, body),
+            "/convert": lambda: run_convert_command(reply, body),
+            "/overlap": lambda: run_overlap_command(reply, body, client),
+            "/tzremind": lambda: run_remind_command(reply, body, client),
+            "/mytimezone": lambda: run_mytimezone_command(reply, body),
+            "/help": lambda: help_command(reply, reply, body),
+        }
+        runner = runners.get(body["command"])
+        if runner:
+            runner()
+    elif body.get("type") == "event_callback":
+        event = body.get("event") or {}
+        if event.get("type") == "message" and event.get("subtype") == "message_changed":
+            process_message_edit(event, reply, client)
+        elif event.get("type") == "message":
+            process_message(event, reply)
+        elif event.get("type") == "app_mention":
+            process_app_mention(event, reply, client)
+        elif event.get("type") == "member_joined_channel":
+            handle_member_joined(event)
+        elif event.get("type") == "member_left_channel":
+            handle_member_left(event)
+    elif body.get("type") == "block_actions":
+        for action in body.get("actions", []):
+            if re.match(r"^timezone_(select|choice_\d+)$", action.get("action_id", "")):
+                timezone_selected(reply, body, action, reply)
+    elif body.get("type") == "block_suggestion":
+        timezone_options(reply, body)
+
+def replay_traffic(path=TRAFFIC_LOG_PATH):
+    """Feed a recorded traffic log through the handlers one request at a time, with the clock pinned to each
+    request's recorded time and the Slack API stubbed out; prints throughput and latency. Work runs inline
+    rather than through the workspace scheduler, so latencies are handler time only."""
+    records = read_traffic_log(path) if path else []
+    if not records:
+        print("No traffic to replay")
+        return False
+    init_offset_tables()
+    zone_suggester.build()
+    saved = isolate_replay_state(records, traffic_recorder)
+    client = ReplayClient()
+    latencies = {}
+    errors = 0
+    started = time.perf_counter()
+    try:
+        for number, record in enumerate(records, 1):
+            tzcore.clock.timestamp = record["t"]
+            began = time.perf_counter()
+            try:
+                replay_slack_body(record["update"], client)
+            except Exception as error:
+                errors += 1
+                print(f"Replayed request {number} failed: {error}")
+            latencies.setdefault(record["kind"], []).append(time.perf_counter() - began)
+    finally:
+        elapsed = time.perf_counter() - started
+        restore_replay_state(saved)
+    report_replay(latencies, elapsed)
+    return errors == 0
 
 def validate_environment():
     """Validate required environment variables"""
@@ -1042,13 +1653,38 @@ def validate_environment():
     return True
 
 if __name__ == "__main__":
+    import sys
+    if '--benchmark-backends' in sys.argv:
+        exit(0 if benchmark_timezone_backends() else 1)
+    if '--check-parser' in sys.argv:
+        exit(0 if check_parser() else 1)
+    if '--benchmark-prefs' in sys.argv:
+        exit(0 if benchmark_prefs_snapshot() else 1)
+    if '--export-prefs-snapshot' in sys.argv:
+        exit(0 if export_prefs_snapshot() else 1)
+    if '--import-prefs-snapshot' in sys.argv:
+        exit(0 if import_prefs_snapshot() else 1)
+    if '--replay-traffic' in sys.argv:
+        arguments = sys.argv[sys.argv.index('--replay-traffic') + 1:]
+        exit(0 if replay_traffic(arguments[0] if arguments else TRAFFIC_LOG_PATH) else 1)
+    
     print("Starting Timezone Bot...")
     
     # Validate environment
     if not validate_environment():
         exit(1)
     
-    init_user_prefs()
+    tzcore.state_store.init()
+    mark_startup('state store')
+    init_offset_tables()
+    mark_startup('offset tables')
+    zone_suggester.build()
+    mark_startup('zone suggestions')
+    reply_cache.load()
+    atexit.register(reply_cache.save)
+    reminder_scheduler.start()
+    cache_warmer.run()
+    mark_startup('cache warm-up')
     
     if SLACK_APP_TOKEN:
         print("Socket Mode: Bot will connect directly to Slack via WebSocket")
@@ -1057,18 +1693,21 @@ if __name__ == "__main__":
         print("Install URL: https://slackbot.leonardocerv.hackclub.app/install")
         print("Status URL: https://slackbot.leonardocerv.hackclub.app/status")
         
-        # Run Flask server in background thread for OAuth only
-        import threading
+        # Run Flask server in background thread for OAuth only, off the socket-mode startup path
         def run_flask():
-            flask_app.run(host='0.0.0.0', port=8944, debug=False, use_reloader=False)
+            create_flask_app().run(host='0.0.0.0', port=8944, debug=False, use_reloader=False)
         
         flask_thread = threading.Thread(target=run_flask, daemon=True)
         flask_thread.start()
         
         # Run Socket Mode as main process
         try:
-            handler = SocketModeHandler(app, SLACK_APP_TOKEN)
-            handler.start()
+            from slack_bolt.adapter.socket_mode import SocketModeHandler
+            
+            socket_handler = SocketModeHandler(app, SLACK_APP_TOKEN)
+            mark_startup('socket mode')
+            print(startup_report())
+            socket_handler.start()
         except KeyboardInterrupt:
             print("\nBot stopped")
         except Exception as e:
@@ -1079,6 +1718,9 @@ if __name__ == "__main__":
         print("Install URL: https://slackbot.leonardocerv.hackclub.app/install")
         
         try:
+            flask_app = create_flask_app()
+            mark_startup('flask')
+            print(startup_report())
             flask_app.run(host='0.0.0.0', port=8944, debug=False)
         except KeyboardInterrupt:
             print("\nBot stopped")
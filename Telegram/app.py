@@ -1,272 +1,111 @@
+import time
+STARTUP_BEGAN = time.perf_counter()
+
 import os
-import re
+import sys
 import json
-import pytz
-import subprocess
-from datetime import datetime
+import threading
+import atexit
 import telebot
 from dotenv import load_dotenv
 
-load_dotenv()
+# Startup timing
+startup_timings = []
 
-# File paths
-USER_PREFS_PATH = '../shared/user_preferences.json'
-SHARED_TIMEZONES_PATH = '../shared/timezones.json'
-RESPONSE_MESSAGES_PATH = '../shared/response_messages.json'
-
-# Load shared timezone config
-timezone_config = {'aliases': {}, 'popular': []}
-try:
-    if os.path.exists(SHARED_TIMEZONES_PATH):
-        with open(SHARED_TIMEZONES_PATH, 'r') as f:
-            timezone_config = json.load(f)
-except Exception as error:
-    print(f'Failed to load timezone config: {error}')
-
-# Load shared response messages
-response_messages = {}
-try:
-    if os.path.exists(RESPONSE_MESSAGES_PATH):
-        with open(RESPONSE_MESSAGES_PATH, 'r') as f:
-            response_messages = json.load(f)
-except Exception as error:
-    print(f'Failed to load response messages: {error}')
-
-# Database functions
-def init_user_prefs():
-    if not os.path.exists(USER_PREFS_PATH):
-        with open(USER_PREFS_PATH, 'w') as f:
-            json.dump({'discord': {}, 'slack': {}, 'telegram': {}}, f, indent=2)
-
-def read_user_prefs():
-    try:
-        if not os.path.exists(USER_PREFS_PATH):
-            init_user_prefs()
-        with open(USER_PREFS_PATH, 'r') as f:
-            full_data = json.load(f)
-            return {'users': full_data.get('telegram', {})}
-    except Exception as error:
-        print(f'Error reading user preferences: {error}')
-        return {'users': {}}
-
-def write_user_prefs(data):
-    try:
-        # Read existing data first
-        full_data = {'discord': {}, 'slack': {}, 'telegram': {}}
-        if os.path.exists(USER_PREFS_PATH):
-            with open(USER_PREFS_PATH, 'r') as f:
-                full_data = json.load(f)
-        
-        # Update only the telegram section
-        full_data['telegram'] = data.get('users', {})
-        
-        with open(USER_PREFS_PATH, 'w') as f:
-            json.dump(full_data, f, indent=2)
-        return True
-    except Exception as error:
-        print(f'Error writing user preferences: {error}')
-        return False
+def mark_startup(phase):
+    startup_timings.append((phase, time.perf_counter()))
 
-# Timezone utilities
-# Helper function to get display name for timezone
-def get_timezone_display_name(timezone_id):
-    # Check if we have a display name in the timezone config
-    if timezone_config.get('display_names') and timezone_id in timezone_config['display_names']:
-        return timezone_config['display_names'][timezone_id]
-    
-    # Fallback to timezone name
-    try:
-        tz = pytz.timezone(timezone_id)
-        now = datetime.now(tz)
-        return now.strftime('%Z')
-    except:
-        return timezone_id.split('/')[-1].upper()
+def startup_report():
+    """Per-phase startup durations since the first import"""
+    previous = STARTUP_BEGAN
+    parts = []
+    for phase, at in startup_timings:
+        parts.append(f"{phase} {(at - previous) * 1000:.0f}ms")
+        previous = at
+    return f"Startup: {', '.join(parts)} (total {(previous - STARTUP_BEGAN) * 1000:.0f}ms)"
 
-def normalize_timezone(input_tz):
-    if not input_tz:
-        return None
-    
-    # Check aliases first
-    alias = timezone_config['aliases'].get(input_tz.upper())
-    if alias:
-        return alias
-    
-    # Check if it's a valid pytz timezone
-    try:
-        pytz.timezone(input_tz)
-        return input_tz
-    except:
-        pass
-    
-    # Handle UTC offset formats (UTC-5, UTC+3:30)
-    offset_match = re.match(r'^(UTC)?([+-]\d{1,2}):?(\d{2})?$', input_tz, re.IGNORECASE)
-    if offset_match:
-        sign = '+' if offset_match.group(2).startswith('+') else '-'
-        hours = abs(int(offset_match.group(2)))
-        minutes = int(offset_match.group(3)) if offset_match.group(3) else 0
-        
-        if hours <= 14 and minutes <= 59:
-            # Etc/GMT offsets are inverted
-            return f"Etc/GMT{'-' if sign == '+' else '+'}{hours}"
-    
-    return None
+mark_startup('imports')
 
-def set_user_timezone(user_id, timezone_input):
-    normalized_tz = normalize_timezone(timezone_input)
-    if not normalized_tz:
-        return False
-    
-    data = read_user_prefs()
-    data['users'][str(user_id)] = {
-        'timezone': normalized_tz,
-        'displayName': timezone_input,
-        'lastUpdated': datetime.now().isoformat()
-    }
-    return write_user_prefs(data)
-
-def get_user_timezone(user_id):
-    data = read_user_prefs()
-    return data.get('users', {}).get(str(user_id), {}).get('timezone')
-
-# Time parsing and conversion
-def extract_times(content):
-    patterns = [
-        # With timezone: "3:00 PM EST", "2 PM PST", "3 PM SGT"
-        r'\b(\d{1,2}):(\d{2})\s*(AM|PM|am|pm)\s*([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b',
-        r'\b(\d{1,2})\s*(AM|PM|am|pm)\s*([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b',
-        # 12-hour: "3:00 PM", "3 PM"
-        r'\b(\d{1,2}):(\d{2})\s*(AM|PM|am|pm)\b',
-        r'\b(\d{1,2})\s*(AM|PM|am|pm)\b',
-        # 24-hour: "15:30", "09:00"
-        r'\b([01]?\d|2[0-3]):([0-5]\d)\b',
-        # With context: "at 3pm"
-        r'\b(at|around|by|before|after)\s+(\d{1,2}):?(\d{2})?\s*(AM|PM|am|pm)?\b'
-    ]
-    
-    times = []
-    spans = []
-    
-    for pattern in patterns:
-        for match in re.finditer(pattern, content, re.IGNORECASE):
-            start = match.start()
-            end = match.end()
-            
-            # Skip overlapping matches
-            overlaps = any(
-                (start >= span['start'] and start < span['end']) or
-                (end > span['start'] and end <= span['end']) or
-                (start <= span['start'] and end >= span['end'])
-                for span in spans
-            )
-            
-            if not overlaps:
-                times.append(match.group(0).strip())
-                spans.append({'start': start, 'end': end})
-    
-    return sorted([t for t in times if len(t) >= 2 and not re.match(r'^\d{1,2}$', t.strip())], 
-                 key=lambda x: content.find(x))
-
-def parse_time(time_str, context_tz='UTC'):
-    if not time_str:
-        return None
-    
-    timezone = context_tz
-    
-    # Look for timezone in string - improved regex to catch more formats, excluding AM/PM
-    tz_match = re.search(r'\b(?!AM|PM)([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b', time_str, re.IGNORECASE)
-    if tz_match:
-        tz_candidate = tz_match.group(1)
-        # Double-check it's not AM/PM
-        if tz_candidate.upper() not in ['AM', 'PM']:
-            normalized_tz = normalize_timezone(tz_candidate)
-            if normalized_tz:
-                timezone = normalized_tz
-    
-    # Clean up time string
-    clean_time = re.sub(r'\b(at|around|by|before|after)\s+', '', time_str, flags=re.IGNORECASE)
-    # Be more careful about removing timezone - don't remove AM/PM
-    clean_time = re.sub(r'\b(?!AM|PM)([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b', '', clean_time, flags=re.IGNORECASE).strip()
-    
-    try:
-        # Parse different formats
-        if re.match(r'^\d{1,2}:\d{2}\s*(AM|PM)$', clean_time, re.IGNORECASE):
-            dt = datetime.strptime(clean_time.upper(), '%I:%M %p')
-        elif re.match(r'^\d{1,2}\s+(AM|PM)$', clean_time, re.IGNORECASE):
-            dt = datetime.strptime(clean_time.upper(), '%I %p')
-        elif re.match(r'^\d{1,2}(AM|PM)$', clean_time, re.IGNORECASE):
-            # Handle cases like "3pm" without space
-            normalized = re.sub(r'(\d+)(AM|PM)', r'\1 \2', clean_time, flags=re.IGNORECASE)
-            dt = datetime.strptime(normalized.upper(), '%I %p')
-        elif re.match(r'^\d{1,2}:\d{2}$', clean_time):
-            dt = datetime.strptime(clean_time, '%H:%M')
-        else:
-            # Try some additional formats as fallback
-            formats = ['%I:%M:%S %p', '%H:%M:%S', '%I %p', '%H:%M']
-            dt = None
-            for fmt in formats:
-                try:
-                    dt = datetime.strptime(clean_time.upper(), fmt)
-                    break
-                except ValueError:
-                    continue
-            if dt is None:
-                return None
-        
-        # Create timezone-aware datetime for today
-        tz = pytz.timezone(timezone)
-        today = datetime.now(tz).date()
-        localized_dt = tz.localize(datetime.combine(today, dt.time()))
-        
-        return {'datetime': localized_dt, 'timezone': timezone}
-    except:
-        return None
-
-def convert_times(content, target_timezone):
-    found_times = extract_times(content)
-    if not found_times:
-        return []
-    
-    results = []
-    
-    for time_str in found_times:
-        # Try to parse with timezone from string, fallback to UTC only if no TZ found
-        parsed = parse_time(time_str)
-        if parsed:
-            target_tz = pytz.timezone(target_timezone)
-            converted = parsed['datetime'].astimezone(target_tz)
-            same_day = parsed['datetime'].date() == converted.date()
-            
-            # Format consistently with proper timezone abbreviations
-            original_formatted = f"{parsed['datetime'].strftime('%I:%M%p').lstrip('0')} {get_timezone_display_name(parsed['timezone'])}"
-            converted_formatted = f"{converted.strftime('%I:%M%p').lstrip('0')} {get_timezone_display_name(target_timezone)}"
-            
-            results.append({
-                'original': original_formatted,
-                'converted': converted_formatted,
-                'date': converted.strftime('%A, %B %d'),
-                'same_day': same_day
-            })
-    
-    return results
-
-def format_conversion_response(conversions, user_timezone):
-    """Format conversions into a response message"""
-    if not conversions:
-        return None
-    
-    response = (response_messages.get('success', {}).get('conversion_header', "**Times in your timezone ({timezone})**\n\n")).replace('{timezone}', user_timezone)
-    for conv in conversions:
-        template = (response_messages.get('success', {}).get('conversion_line', "**{original}** → **{converted}**") 
-                   if conv['same_day'] 
-                   else response_messages.get('success', {}).get('conversion_line_with_date', "**{original}** → **{converted}** ({date})"))
-        
-        line = template.replace('{original}', conv['original']).replace('{converted}', conv['converted']).replace('{date}', conv.get('date', ''))
-        response += f"{line}\n"
-    
-    return response.strip()
+load_dotenv()
+
+# Parsing, conversion and state shared with the Slack bot
+sys.path.insert(0, '../shared')
+import tzcore
+from tzcore import (
+    ChannelMemberCache, ReminderScheduler, TRAFFIC_LOG_PATH, TRAFFIC_LOG_SALT, TrafficRecorder,
+    abbreviation_resolver, allow_reply, benchmark_prefs_snapshot, benchmark_timezone_backends, build_conversion,
+    build_reminders, cache_warmer, check_parser, convert_query, convert_times_to_zones, convert_tracked_message,
+    export_prefs_snapshot, find_overlap, format_conversion_response, format_group_conversion_response,
+    format_overlap_response, get_user_timezone, health_monitor, import_prefs_snapshot, init_offset_tables,
+    isolate_replay_state, parse_overlap_options, plan_reminder, read_traffic_log, render_message, render_reminder,
+    reply_cache, reply_tracker, report_replay, resolve_timezone_input, restore_replay_state, set_user_timezone,
+    zone_now, zone_suggester,
+)
+tzcore.setup('telegram')
+mark_startup('config')
+
+# Only administrators can be listed through the Bot API; everyone else is learned from posts and joins
+channel_members = ChannelMemberCache(ttl=int(os.environ.get('CHANNEL_MEMBERS_TTL', '600')), complete_fetch=False)
+
+# Traffic recording
+# Only the fields the handlers (and the update types' required fields) read are kept; everything else, such as
+# contacts, locations, link URLs and media, is dropped
+TRAFFIC_KEPT_KEYS = {'message_id', 'from', 'date', 'edit_date', 'chat', 'type', 'id', 'is_bot', 'first_name', 'text',
+                     'caption', 'entities', 'offset', 'length', 'new_chat_members', 'left_chat_member', 'data',
+                     'chat_instance', 'message'}
+# Scalars under these keys are user, chat or callback ids
+TRAFFIC_ID_KEYS = {'id'}
+# Names are blanked rather than dropped, since they are required fields of the update types
+TRAFFIC_NAME_KEYS = {'first_name'}
+# Free text, masked apart from times and zone names
+TRAFFIC_TEXT_KEYS = {'text', 'caption'}
+traffic_recorder = TrafficRecorder(TRAFFIC_LOG_PATH, TRAFFIC_LOG_SALT, TRAFFIC_KEPT_KEYS, TRAFFIC_ID_KEYS,
+                                   TRAFFIC_TEXT_KEYS, TRAFFIC_NAME_KEYS)
+atexit.register(traffic_recorder.close)
 
 # Bot setup
-bot = telebot.TeleBot(os.environ.get('TELEGRAM_BOT_TOKEN'))
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL')
+if TELEGRAM_API_URL:
+    # Point the client at another Bot API server, e.g. a local fake for testing
+    telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+
+TRAFFIC_UPDATE_KINDS = ('message', 'edited_message', 'callback_query')
+
+class RecordingTeleBot(telebot.TeleBot):
+    """TeleBot that hands incoming updates to the traffic recorder before dispatching them, and reports handler
+    latency, queue depth and send results to the health monitor"""
+
+    def process_new_updates(self, updates):
+        if traffic_recorder.enabled:
+            for update in updates:
+                for kind in TRAFFIC_UPDATE_KINDS:
+                    item = getattr(update, kind, None)
+                    if item is not None:
+                        traffic_recorder.record(kind, item.json, item.from_user.id if item.from_user else None)
+        super().process_new_updates(updates)
+
+    def _exec_task(self, task, *args, **kwargs):
+        queued_at = time.monotonic()
+
+        def timed_task(*task_args, **task_kwargs):
+            try:
+                return task(*task_args, **task_kwargs)
+            finally:
+                health_monitor.observe(time.monotonic() - queued_at)
+
+        super()._exec_task(timed_task, *args, **kwargs)
+
+    def queue_depth(self):
+        """Handler calls waiting for a worker thread"""
+        return self.worker_pool.tasks.qsize() if self.threaded else 0
+
+    def send_message(self, *args, **kwargs):
+        return health_monitor.track_send(super().send_message, *args, **kwargs)
+
+    def edit_message_text(self, *args, **kwargs):
+        return health_monitor.track_send(super().edit_message_text, *args, **kwargs)
+
+bot = RecordingTeleBot(os.environ.get('TELEGRAM_BOT_TOKEN'), num_threads=int(os.environ.get('TELEGRAM_WORKER_THREADS', '4')))
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
@@ -283,6 +122,9 @@ I automatically convert times between timezones.
 /timezone EST - Set your timezone
 /convert "3:00PM EST" - Convert a time  
 /mytimezone - Show your timezone
+/meeting 3:00PM EST - Show a time for everyone in this chat
+/remind 3:00PM EST standup - Remind everyone here at that time
+/overlap 9-17 7d - Find working hours shared by everyone here
 /help - Show help
 
 **Example:**
@@ -292,7 +134,7 @@ Send "Meeting at 3:00PM EST" and I'll convert it to your timezone."""
 
 @bot.message_handler(commands=['help'])
 def send_help(message):
-    help_text = """**Commands**:
+    help_text = render_message('help', 'content', """**Commands**:
 • `/timezone <timezone>` - Set your timezone
 • `/convert <time>` - Convert a time
 • `/mytimezone` - Show your timezone
@@ -310,7 +152,11 @@ def send_help(message):
 • `UTC-5`, `UTC+3`
 
 **Auto-detection**:
-I detect times in messages and convert them automatically."""
+I detect times in messages and convert them automatically.""")
+    meeting = render_message('help', 'meeting_command', "/meeting <time> - Show a time for everyone in this chat\n")
+    help_text += '\n\n' + render_message('help', 'group_commands', """**Group commands:**
+{meeting}{remind} <time> <note> - Remind everyone here at that time
+/overlap [9-17] [7d] - Find working hours shared by everyone here""", meeting=meeting, remind='/remind')
     
     bot.reply_to(message, help_text, parse_mode="Markdown")
 
@@ -322,17 +168,27 @@ def handle_timezone(message):
     if len(command_parts) == 1:
         current_tz = get_user_timezone(user_id)
         bot.reply_to(message,
-            (response_messages.get('commands', {}).get('timezone_current', "Your timezone: `{timezone}`\n\nSet with: `/timezone EST` or `/timezone America/New_York`"))
-            .replace('{timezone}', current_tz or 'Not set'),
+            render_message('commands', 'timezone_current', "Your timezone: `{timezone}`\n\nSet with: `/timezone EST` or `/timezone America/New_York`",
+                           timezone=current_tz or 'Not set'),
             parse_mode="Markdown"
         )
         return
     
     timezone_input = ' '.join(command_parts[1:])
     
-    if not normalize_timezone(timezone_input):
+    if not resolve_timezone_input(timezone_input):
+        suggestions = zone_suggester.suggest(timezone_input, 5)
+        if suggestions:
+            keyboard = telebot.types.InlineKeyboardMarkup()
+            for label, zone in suggestions:
+                keyboard.add(telebot.types.InlineKeyboardButton(zone if label == zone else f"{label} ({zone})", callback_data=f"tz:{zone}"))
+            bot.reply_to(message,
+                render_message('errors', 'timezone_suggestions', "Unknown timezone `{input}`. Did you mean one of these?", input=timezone_input),
+                parse_mode="Markdown", reply_markup=keyboard
+            )
+            return
         bot.reply_to(message,
-            response_messages.get('errors', {}).get('invalid_timezone', "*Invalid timezone. Use format: /convert 3:00PM EST*"),
+            render_message('errors', 'invalid_timezone', "*Invalid timezone. Use format: /convert 3:00PM EST*"),
             parse_mode="Markdown"
         )
         return
@@ -340,18 +196,33 @@ def handle_timezone(message):
     success = set_user_timezone(user_id, timezone_input)
     
     if success:
-        tz = pytz.timezone(normalize_timezone(timezone_input))
-        current_time = datetime.now(tz)
+        chat_scopes(message, resolve_timezone_input(timezone_input))
+        current_time = zone_now(resolve_timezone_input(timezone_input))
         formatted_time = current_time.strftime('%I:%M %p %Z').lstrip('0')
         
         bot.reply_to(message,
-            (response_messages.get('success', {}).get('timezone_set', "Timezone set to `{timezone}`\nCurrent time: **{time}**"))
-            .replace('{timezone}', timezone_input)
-            .replace('{time}', formatted_time),
+            render_message('success', 'timezone_set', "Timezone set to `{timezone}`\nCurrent time: **{time}**",
+                           timezone=timezone_input, time=formatted_time),
             parse_mode="Markdown"
         )
     else:
-        bot.reply_to(message, response_messages.get('errors', {}).get('failed_to_save', "Failed to save timezone"), parse_mode="Markdown")
+        bot.reply_to(message, render_message('errors', 'failed_to_save', "Failed to save timezone"), parse_mode="Markdown")
+
+@bot.callback_query_handler(func=lambda call: (call.data or '').startswith('tz:'))
+def handle_timezone_choice(call):
+    """A suggestion button from /timezone: set it for whoever pressed it"""
+    zone = call.data[3:]
+    if not set_user_timezone(call.from_user.id, zone):
+        bot.answer_callback_query(call.id, render_message('errors', 'failed_to_save', "Failed to save timezone"))
+        return
+    chat_scopes(call.message, zone)
+    formatted_time = zone_now(zone).strftime('%I:%M %p %Z').lstrip('0')
+    bot.answer_callback_query(call.id)
+    bot.edit_message_text(
+        render_message('success', 'timezone_set', "Timezone set to `{timezone}`\nCurrent time: **{time}**",
+                       timezone=zone, time=formatted_time),
+        call.message.chat.id, call.message.message_id, parse_mode="Markdown"
+    )
 
 @bot.message_handler(commands=['convert'])
 def handle_convert(message):
@@ -360,7 +231,7 @@ def handle_convert(message):
     
     if len(command_parts) == 1:
         bot.reply_to(message,
-            response_messages.get('commands', {}).get('convert_usage', "Provide a time to convert:\n• `/convert 3:00PM EST`\n• `/convert 14:30 PST`\n• `/convert 4 PM` (assumes UTC)"),
+            render_message('commands', 'convert_usage', "Provide a time to convert:\n• `/convert 3:00PM EST`\n• `/convert 14:30 PST`\n• `/convert 4 PM` (assumes UTC)"),
             parse_mode="Markdown"
         )
         return
@@ -369,38 +240,16 @@ def handle_convert(message):
     user_timezone = get_user_timezone(user_id)
     
     if not user_timezone:
-        bot.reply_to(message, response_messages.get('errors', {}).get('no_timezone_set', "No timezone set. Use `/timezone EST` to set one"), parse_mode="Markdown")
+        bot.reply_to(message, render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"), parse_mode="Markdown")
         return
     
-    conversions = convert_times(time_text, user_timezone)
-    
-    # If no timezone specified, try assuming UTC
-    if not conversions:
-        found_times = extract_times(time_text)
-        for time_str in found_times:
-            parsed = parse_time(time_str, 'UTC')
-            if parsed:
-                target_tz = pytz.timezone(user_timezone)
-                converted = parsed['datetime'].astimezone(target_tz)
-                same_day = parsed['datetime'].date() == converted.date()
-                
-                # Format consistently with proper timezone abbreviations
-                original_formatted = f"{time_str} UTC"
-                converted_formatted = f"{converted.strftime('%I:%M%p').lstrip('0')} {get_timezone_display_name(user_timezone)}"
-                
-                conversions.append({
-                    'original': original_formatted,
-                    'converted': converted_formatted,
-                    'date': converted.strftime('%A, %B %d'),
-                    'same_day': same_day
-                })
-    
-    if conversions:
-        response = format_conversion_response(conversions, user_timezone)
+    response = convert_query(time_text, user_timezone, chat_scopes(message, user_timezone))
+    
+    if response:
         bot.reply_to(message, response, parse_mode="Markdown")
     else:
         bot.reply_to(message,
-            response_messages.get('errors', {}).get('no_times_found', "*No times found. Use format: /convert 3:00PM EST*"),
+            render_message('errors', 'no_times_found', "*No times found. Use format: /convert 3:00PM EST*"),
             parse_mode="Markdown"
         )
 
@@ -410,24 +259,164 @@ def handle_mytimezone(message):
     user_timezone = get_user_timezone(user_id)
     
     if not user_timezone:
-        bot.reply_to(message, response_messages.get('errors', {}).get('no_timezone_set', "No timezone set. Use `/timezone EST` to set one"), parse_mode="Markdown")
+        bot.reply_to(message, render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"), parse_mode="Markdown")
         return
     
     try:
-        tz = pytz.timezone(user_timezone)
-        current_time = datetime.now(tz)
+        current_time = zone_now(user_timezone)
         formatted_time = current_time.strftime('%I:%M %p %Z').lstrip('0')
         date_str = current_time.strftime('%A, %B %d, %Y')
         
         bot.reply_to(message,
-            (response_messages.get('success', {}).get('mytimezone_display', "**Your timezone:** `{timezone}`\n**Current time:** {time}\n**Date:** {date}"))
-            .replace('{timezone}', user_timezone)
-            .replace('{time}', formatted_time)
-            .replace('{date}', date_str),
+            render_message('success', 'mytimezone_display', "**Your timezone:** `{timezone}`\n**Current time:** {time}\n**Date:** {date}",
+                           timezone=user_timezone, time=formatted_time, date=date_str),
             parse_mode="Markdown"
         )
     except:
-        bot.reply_to(message, (response_messages.get('success', {}).get('mytimezone_simple', "**Your timezone:** `{timezone}`")).replace('{timezone}', user_timezone), parse_mode="Markdown")
+        bot.reply_to(message, render_message('success', 'mytimezone_simple', "**Your timezone:** `{timezone}`", timezone=user_timezone), parse_mode="Markdown")
+
+def fetch_chat_members(chat_id):
+    """Seed a group's member set with its administrators; other members are added as they post"""
+    return [str(member.user.id) for member in bot.get_chat_administrators(chat_id)]
+
+def track_chat_member(message):
+    if message.chat.type in ('group', 'supergroup'):
+        channel_members.get_members(message.chat.id, fetch_chat_members)
+        channel_members.add_member(message.chat.id, str(message.from_user.id))
+
+def chat_scopes(message, user_timezone=None):
+    """Abbreviation prior scopes for a message's chat, counting the sender's zone there first"""
+    scope = ('chat', message.chat.id)
+    abbreviation_resolver.observe(scope, user_timezone)
+    return (scope,)
+
+@bot.message_handler(content_types=['new_chat_members', 'left_chat_member'])
+def handle_membership_change(message):
+    for member in message.new_chat_members or []:
+        channel_members.add_member(message.chat.id, str(member.id))
+    if message.left_chat_member:
+        channel_members.remove_member(message.chat.id, str(message.left_chat_member.id))
+
+@bot.message_handler(commands=['meeting'])
+def handle_meeting(message):
+    user_id = message.from_user.id
+    command_parts = message.text.split(maxsplit=1)
+    
+    if len(command_parts) == 1:
+        bot.reply_to(message,
+            render_message('commands', 'convert_usage', "Provide a time to convert:\n• `/convert 3:00PM EST`\n• `/convert 14:30 PST`\n• `/convert 4 PM` (assumes UTC)"),
+            parse_mode="Markdown"
+        )
+        return
+    
+    track_chat_member(message)
+    zones = set()
+    if message.chat.type in ('group', 'supergroup'):
+        zones = channel_members.get_zones(message.chat.id, fetch_chat_members)
+    user_timezone = get_user_timezone(user_id)
+    if user_timezone:
+        zones.add(user_timezone)
+    
+    if not zones:
+        bot.reply_to(message, render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"), parse_mode="Markdown")
+        return
+    
+    scopes = chat_scopes(message)
+    for zone in zones:
+        abbreviation_resolver.observe(scopes[0], zone)
+    response = format_group_conversion_response(convert_times_to_zones(command_parts[1], zones, scopes))
+    if response:
+        bot.reply_to(message, response, parse_mode="Markdown")
+    else:
+        bot.reply_to(message,
+            render_message('errors', 'no_times_found', "*No times found. Use format: /convert 3:00PM EST*"),
+            parse_mode="Markdown"
+        )
+
+@bot.message_handler(commands=['remind'])
+def handle_remind(message):
+    user_id = message.from_user.id
+    command_parts = message.text.split(maxsplit=1)
+    
+    if len(command_parts) == 1:
+        bot.reply_to(message,
+            render_message('commands', 'remind_usage', "Schedule a reminder for everyone here:\n• `{command} 3:00PM EST standup`", command='/remind'),
+            parse_mode="Markdown"
+        )
+        return
+    
+    user_timezone = get_user_timezone(user_id)
+    if not user_timezone:
+        bot.reply_to(message, render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"), parse_mode="Markdown")
+        return
+    
+    plan = plan_reminder(command_parts[1], user_timezone, chat_scopes(message, user_timezone))
+    if not plan:
+        bot.reply_to(message,
+            render_message('errors', 'no_times_found', "*No times found. Use format: /convert 3:00PM EST*"),
+            parse_mode="Markdown"
+        )
+        return
+    
+    due, note = plan
+    if due is None:
+        bot.reply_to(message, render_message('errors', 'reminder_in_past', "That time has already passed today"), parse_mode="Markdown")
+        return
+    track_chat_member(message)
+    members = {str(user_id)}
+    if message.chat.type in ('group', 'supergroup'):
+        members |= channel_members.get_members(message.chat.id, fetch_chat_members)
+    participants = [(member, zone) for member, zone in ((m, get_user_timezone(m)) for m in members) if zone]
+    reminder_scheduler.schedule(build_reminders(due, note, participants, chat=message.chat.id))
+    
+    local = build_conversion({'datetime': due, 'timezone': 'UTC'}, user_timezone)
+    bot.reply_to(message,
+        render_message('success', 'reminder_scheduled', "Reminder set for **{time}** ({count} people)",
+                       time=f"{local.converted}, {local.date}", count=len(participants)),
+        parse_mode="Markdown"
+    )
+
+def deliver_reminder(reminder):
+    """Reminders go to each participant privately; Telegram only allows this once they have started the bot"""
+    try:
+        bot.send_message(int(reminder['user']), render_reminder(reminder), parse_mode="Markdown")
+    except telebot.apihelper.ApiTelegramException as e:
+        print(f"Could not deliver reminder to {reminder['user']}: {e}")
+
+reminder_scheduler = ReminderScheduler(deliver_reminder)
+
+@bot.message_handler(commands=['overlap'])
+def handle_overlap(message):
+    """Common working hours for everyone in this chat with a timezone set"""
+    user_id = message.from_user.id
+    command_parts = message.text.split(maxsplit=1)
+    start_hour, end_hour, days = parse_overlap_options(command_parts[1] if len(command_parts) > 1 else '')
+    
+    user_timezone = get_user_timezone(user_id)
+    if not user_timezone:
+        bot.reply_to(message, render_message('errors', 'no_timezone_set', "No timezone set. Use `/timezone EST` to set one"), parse_mode="Markdown")
+        return
+    
+    track_chat_member(message)
+    members = {str(user_id)}
+    if message.chat.type in ('group', 'supergroup'):
+        members |= channel_members.get_members(message.chat.id, fetch_chat_members)
+    zones = tzcore.user_index.zones_for(members)
+    people = sum(1 for member in members if get_user_timezone(member))
+    for zone in zones:
+        abbreviation_resolver.observe(('chat', message.chat.id), zone)
+    
+    windows = find_overlap(zones, start_hour, end_hour, days)
+    bot.reply_to(message, format_overlap_response(windows, user_timezone, start_hour, end_hour, days, people), parse_mode="Markdown")
+
+def code_entity_ranges(message):
+    """Index ranges of code blocks in a message; Telegram strips the fences and counts offsets in UTF-16 units"""
+    entities = [entity for entity in (message.entities or []) if entity.type == 'pre']
+    if not entities:
+        return ()
+    units = message.text.encode('utf-16-le')
+    index = lambda offset: len(units[:offset * 2].decode('utf-16-le', errors='ignore'))
+    return [(index(entity.offset), index(entity.offset + entity.length)) for entity in entities]
 
 # Handle regular messages for auto-detection
 @bot.message_handler(func=lambda message: True)
@@ -435,17 +424,238 @@ def handle_message(message):
     if not message.text or message.text.startswith('/'):
         return
     
+    track_chat_member(message)
+    
     user_id = message.from_user.id
     user_timezone = get_user_timezone(user_id)
     
     if not user_timezone:
         return
     
-    conversions = convert_times(message.text, user_timezone)
+    tracked, conversions = convert_tracked_message((message.chat.id, message.message_id), message.text, user_timezone,
+                                                   code_entity_ranges(message), chat_scopes(message, user_timezone))
     
-    if conversions:
-        response = format_conversion_response(conversions, user_timezone)
-        bot.reply_to(message, response, parse_mode="Markdown")
+    if conversions and allow_reply(user_id):
+        tracked.response = format_conversion_response(conversions, user_timezone)
+        tracked.reply = bot.reply_to(message, tracked.response, parse_mode="Markdown").message_id
+    reply_tracker.remember((message.chat.id, message.message_id), tracked)
+
+@bot.edited_message_handler(func=lambda message: bool(message.text) and not message.text.startswith('/'))
+def handle_edited_message(message):
+    """Rescan only the edited part of a message and update the earlier reply instead of posting again"""
+    user_id = message.from_user.id
+    user_timezone = get_user_timezone(user_id)
+    if not user_timezone:
+        return
+    
+    key = (message.chat.id, message.message_id)
+    tracked, conversions = convert_tracked_message(key, message.text, user_timezone, code_entity_ranges(message),
+                                                   chat_scopes(message))
+    response = format_conversion_response(conversions, user_timezone)
+    try:
+        if tracked.reply and response:
+            if response != tracked.response:
+                bot.edit_message_text(response, message.chat.id, tracked.reply, parse_mode="Markdown")
+        elif tracked.reply:
+            bot.delete_message(message.chat.id, tracked.reply)
+            tracked.reply = None
+        elif response and allow_reply(user_id):
+            tracked.reply = bot.reply_to(message, response, parse_mode="Markdown").message_id
+        tracked.response = response
+    except Exception as e:
+        print(f"Error updating reply: {e}")
+    reply_tracker.remember(key, tracked)
+
+class ReplayResponse:
+    """Just enough of a requests response for telebot to read a canned Bot API result"""
+    status_code = 200
+
+    def __init__(self, result):
+        self.payload = {'ok': True, 'result': result}
+        self.text = json.dumps(self.payload)
+
+    def json(self):
+        return self.payload
+
+def replay_request_sender(method, url, params=None, **kwargs):
+    """Bot API stand-in for replay: sends and edits succeed, member lookups come back empty"""
+    name = url.rsplit('/', 1)[-1]
+    params = params or {}
+    if name == 'getMe':
+        return ReplayResponse({'id': 1, 'is_bot': True, 'first_name': 'replay', 'username': 'replay_bot'})
+    if name == 'getChatAdministrators':
+        return ReplayResponse([])
+    if name.startswith(('send', 'edit')):
+        return ReplayResponse({'message_id': 1, 'date': int(tzcore.clock.now().timestamp()), 'text': params.get('text', ''),
+                               'chat': {'id': int(params.get('chat_id') or 0), 'type': 'private'}})
+    return ReplayResponse(True)
+
+def replay_traffic(path=TRAFFIC_LOG_PATH):
+    """Feed a recorded traffic log through the handlers one update at a time, with the clock pinned to each
+    update's recorded time and the Bot API stubbed out; prints throughput and latency"""
+    records = read_traffic_log(path) if path else []
+    if not records:
+        print('No traffic to replay')
+        return False
+    init_offset_tables()
+    zone_suggester.build()
+    saved = isolate_replay_state(records, traffic_recorder)
+    saved_sender, saved_threaded = telebot.apihelper.CUSTOM_REQUEST_SENDER, bot.threaded
+    telebot.apihelper.CUSTOM_REQUEST_SENDER = replay_request_sender
+    # Unthreaded, process_new_updates runs the handler before returning, so each update can be timed
+    bot.threaded = False
+    latencies = {}
+    errors = 0
+    started = time.perf_counter()
+    try:
+        for update_id, record in enumerate(records, 1):
+            tzcore.clock.timestamp = record['t']
+            update = telebot.types.Update.de_json({'update_id': update_id, record['kind']: record['update']})
+            began = time.perf_counter()
+            try:
+                bot.process_new_updates([update])
+            except Exception as error:
+                errors += 1
+                print(f"Replayed update {update_id} failed: {error}")
+            latencies.setdefault(record['kind'], []).append(time.perf_counter() - began)
+    finally:
+        elapsed = time.perf_counter() - started
+        telebot.apihelper.CUSTOM_REQUEST_SENDER, bot.threaded = saved_sender, saved_threaded
+        restore_replay_state(saved)
+    report_replay(latencies, elapsed)
+    return errors == 0
+
+# Startup
+def start_services():
+    """Load shared state and start background work; run once per process before handling updates"""
+    tzcore.state_store.init()
+    mark_startup('state store')
+    init_offset_tables()
+    mark_startup('offset tables')
+    zone_suggester.build()
+    mark_startup('zone suggestions')
+    reply_cache.load()
+    atexit.register(reply_cache.save)
+    reminder_scheduler.start()
+    cache_warmer.run()
+    mark_startup('cache warm-up')
+
+# Webhook mode
+TELEGRAM_MODE = os.environ.get('TELEGRAM_MODE', 'polling').lower()
+TELEGRAM_WEBHOOK_URL = os.environ.get('TELEGRAM_WEBHOOK_URL')
+TELEGRAM_WEBHOOK_SECRET = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+TELEGRAM_WEBHOOK_PORT = int(os.environ.get('TELEGRAM_WEBHOOK_PORT', '8947'))
+
+def create_webhook_app():
+    """Flask app that acks Telegram updates immediately and hands them to the bot's worker threads"""
+    from flask import Flask, request
+    
+    webhook_app = Flask(__name__)
+    
+    @webhook_app.route('/telegram/webhook', methods=['POST'])
+    def telegram_webhook():
+        if TELEGRAM_WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != TELEGRAM_WEBHOOK_SECRET:
+            return '', 403
+        try:
+            update = telebot.types.Update.de_json(request.get_data(as_text=True))
+        except Exception as error:
+            print(f'Invalid webhook update: {error}')
+            return '', 400
+        if update is None:
+            return '', 400
+        # With a threaded bot this only queues the update, so Telegram gets its ack right away
+        bot.process_new_updates([update])
+        return '', 200
+    
+    add_health_routes(webhook_app)
+    return webhook_app
+
+def ensure_webhook():
+    """Point Telegram at TELEGRAM_WEBHOOK_URL unless it already is; every replica behind the URL runs this, so a
+    restart must neither unregister the webhook for the others nor drop the updates queued meanwhile"""
+    if bot.get_webhook_info().url == TELEGRAM_WEBHOOK_URL:
+        print(f"Webhook already set to {TELEGRAM_WEBHOOK_URL}")
+        return
+    bot.set_webhook(
+        url=TELEGRAM_WEBHOOK_URL,
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        max_connections=int(os.environ.get('TELEGRAM_WEBHOOK_MAX_CONNECTIONS', '40')),
+        drop_pending_updates=False
+    )
+    print(f"Webhook set to {TELEGRAM_WEBHOOK_URL}")
+
+_webhook_app = None
+_webhook_lock = threading.Lock()
+_worker_lock = None
+
+def claim_single_worker():
+    """Refuse to serve from a second process unless state lives in Redis
+
+    The local and disk stores keep reminders, caches and rate limits per process, so a second worker would
+    run its own scheduler and redeliver reminders. The lock is released when the process exits."""
+    global _worker_lock
+    if tzcore.state_store.name == 'redis':
+        return
+    import fcntl
+    _worker_lock = open(f'{tzcore.REMINDERS_PATH}.lock', 'w')
+    try:
+        fcntl.flock(_worker_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        _worker_lock.close()
+        _worker_lock = None
+        raise RuntimeError(f"STATE_BACKEND={tzcore.state_store.name} serves from one process only; "
+                           "run a single worker or set STATE_BACKEND=redis")
+
+def get_webhook_app():
+    """The webhook app for a WSGI server, started like `python app.py` would start the bot"""
+    global _webhook_app
+    with _webhook_lock:
+        if _webhook_app is None:
+            if not TELEGRAM_WEBHOOK_URL:
+                raise RuntimeError("TELEGRAM_WEBHOOK_URL is required to serve the webhook")
+            claim_single_worker()
+            start_services()
+            ensure_webhook()
+            _webhook_app = create_webhook_app()
+            mark_startup('webhook')
+            print(startup_report())
+    return _webhook_app
+
+def __getattr__(name):
+    # `gunicorn app:webhook_app` serves the webhook; more than one worker needs STATE_BACKEND=redis
+    if name == 'webhook_app':
+        return get_webhook_app()
+    raise AttributeError(name)
+
+# Health endpoints
+TELEGRAM_HEALTH_PORT = int(os.environ.get('TELEGRAM_HEALTH_PORT', '8948'))
+
+def add_health_routes(flask_app):
+    """/health (liveness plus latency, queue, cache, storage and send figures) and /ready (503 while an SLO is breached)"""
+    
+    @flask_app.route('/health')
+    def health():
+        warmed = cache_warmer.ready.is_set()
+        report = health_monitor.report(bot.queue_depth())
+        return {'status': 'ok' if warmed else 'warming', 'service': 'timezone-bot-telegram', 'mode': TELEGRAM_MODE, **report}, 200 if warmed else 503
+    
+    @flask_app.route('/ready')
+    def ready():
+        report = health_monitor.report(bot.queue_depth())
+        breaches = health_monitor.breaches(report)
+        return {'status': 'unready' if breaches else 'ready', 'breaches': breaches, **report}, 503 if breaches else 200
+
+def start_health_server():
+    """Serve the health endpoints on TELEGRAM_HEALTH_PORT while long polling, which has no web server of its own"""
+    if not TELEGRAM_HEALTH_PORT:
+        return
+    from flask import Flask
+    
+    health_app = Flask(__name__)
+    add_health_routes(health_app)
+    threading.Thread(target=health_app.run, daemon=True,
+                     kwargs={'host': '0.0.0.0', 'port': TELEGRAM_HEALTH_PORT, 'debug': False, 'threaded': True}).start()
+    print(f"Health endpoints on port {TELEGRAM_HEALTH_PORT}: /health, /ready")
 
 def start_web_server():
     """Start the web server in a separate process"""
@@ -453,6 +663,7 @@ def start_web_server():
         print("Starting web server...")
         # Use sys.executable to get the current Python interpreter
         import sys
+        import subprocess
         subprocess.Popen(
             [sys.executable, "web_server.py"],
             cwd=os.path.dirname(os.path.abspath(__file__))
@@ -463,6 +674,21 @@ def start_web_server():
         print(f"Failed to start web server: {e}")
 
 if __name__ == '__main__':
+    import sys
+    if '--benchmark-backends' in sys.argv:
+        exit(0 if benchmark_timezone_backends() else 1)
+    if '--check-parser' in sys.argv:
+        exit(0 if check_parser() else 1)
+    if '--benchmark-prefs' in sys.argv:
+        exit(0 if benchmark_prefs_snapshot() else 1)
+    if '--export-prefs-snapshot' in sys.argv:
+        exit(0 if export_prefs_snapshot() else 1)
+    if '--import-prefs-snapshot' in sys.argv:
+        exit(0 if import_prefs_snapshot() else 1)
+    if '--replay-traffic' in sys.argv:
+        arguments = sys.argv[sys.argv.index('--replay-traffic') + 1:]
+        exit(0 if replay_traffic(arguments[0] if arguments else TRAFFIC_LOG_PATH) else 1)
+    
     print("Starting Timezone Bot...")
     print("Commands: /timezone EST, /convert '3:00PM EST', /mytimezone, /help")
     
@@ -471,13 +697,21 @@ if __name__ == '__main__':
         print("Error: TELEGRAM_BOT_TOKEN is not set in environment variables")
         exit(1)
     
+    if TELEGRAM_MODE == 'webhook':
+        print("TELEGRAM_MODE=webhook is served by a WSGI server, e.g.:")
+        workers = 4 if tzcore.state_store.name == 'redis' else 1
+        print(f"    gunicorn --workers {workers} --threads 8 --bind 0.0.0.0:{TELEGRAM_WEBHOOK_PORT} app:webhook_app")
+        if workers == 1:
+            print(f"STATE_BACKEND={tzcore.state_store.name} keeps state in this process; set STATE_BACKEND=redis to run more workers")
+        exit(1)
+    
     # Start web server first
     start_web_server()
+    start_health_server()
     
-    init_user_prefs()
+    start_services()
     
     # Start bot with error handling and restart mechanism
-    import time
     import requests
     from telebot.apihelper import ApiTelegramException
     
@@ -492,6 +726,8 @@ if __name__ == '__main__':
             try:
                 me = bot.get_me()
                 print(f"Bot authenticated: @{me.username}")
+                mark_startup('authenticated')
+                print(startup_report())
             except Exception as e:
                 print(f"Bot authentication failed: {e}")
                 if attempt == max_retries - 1:
@@ -0,0 +1,2512 @@
+"""Timezone parsing, conversion and bot state shared by the Slack and Telegram bots
+
+Each bot imports this module from ../shared and calls setup() with its platform name before handling anything.
+That picks its section of the preferences file, its message formatting and the state store, index and caches
+built from them. Those objects are module attributes that replay swaps out, so bots read them through the module.
+"""
+import os
+import re
+import time
+import struct
+import json
+import pytz
+import threading
+import heapq
+import uuid
+import gzip
+import base64
+import hashlib
+from collections import OrderedDict, deque
+from array import array
+from bisect import bisect_right, insort
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+# File paths
+USER_PREFS_PATH = '../shared/user_preferences.json'
+SHARED_TIMEZONES_PATH = '../shared/timezones.json'
+RESPONSE_MESSAGES_PATH = '../shared/response_messages.json'
+
+# Load shared timezone config
+timezone_config = {'aliases': {}, 'popular': []}
+try:
+    if os.path.exists(SHARED_TIMEZONES_PATH):
+        with open(SHARED_TIMEZONES_PATH, 'r') as f:
+            timezone_config = json.load(f)
+except Exception as error:
+    print(f'Failed to load timezone config: {error}')
+
+# Load shared response messages
+response_messages = {}
+try:
+    if os.path.exists(RESPONSE_MESSAGES_PATH):
+        with open(RESPONSE_MESSAGES_PATH, 'r') as f:
+            response_messages = json.load(f)
+except Exception as error:
+    print(f'Failed to load response messages: {error}')
+
+# Response templates
+class _TemplateValues(dict):
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+def compile_template(template):
+    """Compile a `{name}` template once into a renderer backed by str.format_map"""
+    escaped = template.replace('{', '{{').replace('}', '}}')
+    fmt = re.sub(r'\{\{(\w+)\}\}', r'{\1}', escaped)
+    return lambda **values: fmt.format_map(_TemplateValues(values))
+
+def apply_platform_formatting(template, platform):
+    """Rewrite the shared **bold** and `code` markup into the platform's own syntax"""
+    formatting = response_messages.get('formatting', {}).get(platform, {})
+    bold = formatting.get('bold', '**{text}**')
+    code = formatting.get('code', '`{text}`')
+    template = re.sub(r'\*\*(.+?)\*\*', lambda m: bold.replace('{text}', m.group(1)), template)
+    return re.sub(r'`([^`\n]+)`', lambda m: code.replace('{text}', m.group(1)), template)
+
+def compile_messages(platform):
+    """Compile every template in response_messages.json for one platform"""
+    compiled = {}
+    for section, templates in response_messages.items():
+        if section == 'formatting' or not isinstance(templates, dict):
+            continue
+        for name, template in templates.items():
+            compiled[(section, name)] = compile_template(apply_platform_formatting(template, platform))
+    return compiled
+
+# The bot this process serves ('slack' or 'telegram') and its compiled templates; both set by setup()
+PLATFORM = None
+compiled_messages = {}
+
+def render_message(section, name, default='', **values):
+    """Render a compiled response template, compiling `default` once if the key is missing"""
+    renderer = compiled_messages.get((section, name))
+    if renderer is None:
+        renderer = compile_template(apply_platform_formatting(default, PLATFORM))
+        compiled_messages[(section, name)] = renderer
+    return renderer(**values)
+
+# Database functions
+def init_user_prefs():
+    if not os.path.exists(USER_PREFS_PATH):
+        with open(USER_PREFS_PATH, 'w') as f:
+            json.dump({'discord': {}, 'slack': {}, 'telegram': {}}, f, indent=2)
+
+def read_user_prefs():
+    try:
+        if not os.path.exists(USER_PREFS_PATH):
+            init_user_prefs()
+        with open(USER_PREFS_PATH, 'r') as f:
+            full_data = json.load(f)
+            return {'users': full_data.get(PLATFORM, {})}
+    except Exception as error:
+        print(f'Error reading user preferences: {error}')
+        return {'users': {}}
+
+def write_user_prefs(data):
+    try:
+        # Read existing data first
+        full_data = {'discord': {}, 'slack': {}, 'telegram': {}}
+        if os.path.exists(USER_PREFS_PATH):
+            with open(USER_PREFS_PATH, 'r') as f:
+                full_data = json.load(f)
+        
+        # Update only this platform's section
+        full_data[PLATFORM] = data.get('users', {})
+        
+        with open(USER_PREFS_PATH, 'w') as f:
+            json.dump(full_data, f, indent=2)
+        return True
+    except Exception as error:
+        print(f'Error writing user preferences: {error}')
+        return False
+
+# Preference snapshots
+USER_PREFS_SNAPSHOT_PATH = os.environ.get('USER_PREFS_SNAPSHOT_PATH', '../shared/user_preferences.bin')
+SNAPSHOT_MAGIC = b'TZUP1'
+SNAPSHOT_RECORD = struct.Struct('<IIqB')
+SNAPSHOT_HAS_UPDATED = 1
+SNAPSHOT_UTC_MILLIS = 2
+SNAPSHOT_NO_DISPLAY_NAME = 4
+SNAPSHOT_RAW_UPDATED = 8
+
+def _pack_updated(value):
+    """lastUpdated as (microseconds since epoch, flags), keeping the JS and Python ISO spellings apart"""
+    if value is None:
+        return 0, 0
+    try:
+        utc_millis = value.endswith('Z')
+        parsed = datetime.fromisoformat(value[:-1] if utc_millis else value)
+        if parsed.tzinfo is not None:
+            raise ValueError(value)
+        micros = (parsed - EPOCH) // timedelta(microseconds=1)
+        flags = SNAPSHOT_HAS_UPDATED | (SNAPSHOT_UTC_MILLIS if utc_millis else 0)
+        if _unpack_updated(micros, flags) != value:
+            # Only store instants that format back to the exact original string
+            raise ValueError(value)
+        return micros, flags
+    except (ValueError, AttributeError):
+        return None, SNAPSHOT_HAS_UPDATED | SNAPSHOT_RAW_UPDATED
+
+def _unpack_updated(micros, flags):
+    moment = EPOCH + timedelta(microseconds=micros)
+    if flags & SNAPSHOT_UTC_MILLIS:
+        return moment.isoformat(timespec='milliseconds') + 'Z'
+    return moment.isoformat()
+
+def save_prefs_snapshot(prefs, path=USER_PREFS_SNAPSHOT_PATH):
+    """Write every platform's preferences as sorted fixed-width records over one interned string table"""
+    strings, string_ids = [], {}
+
+    def intern(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    sections = []
+    for platform, users in prefs.items():
+        keys = sorted((str(user_id).encode('utf-8'), record) for user_id, record in users.items())
+        width = max((len(key) for key, _ in keys), default=0)
+        rows = []
+        for key, record in keys:
+            micros, flags = _pack_updated(record.get('lastUpdated'))
+            if micros is None:
+                micros = intern(record['lastUpdated'])
+            display_name = record.get('displayName')
+            if display_name is None:
+                flags |= SNAPSHOT_NO_DISPLAY_NAME
+            rows.append(key.ljust(width, b'\0') + SNAPSHOT_RECORD.pack(
+                intern(record.get('timezone') or ''), intern(display_name or ''), micros, flags))
+        sections.append((platform, len(rows), width, b''.join(rows)))
+
+    def pack_str(value):
+        raw = value.encode('utf-8')
+        return struct.pack('<I', len(raw)) + raw
+
+    header = [SNAPSHOT_MAGIC, struct.pack('<I', len(strings))]
+    header.extend(pack_str(value) for value in strings)
+    header.append(struct.pack('<H', len(sections)))
+    header_size = sum(map(len, header)) + sum(len(pack_str(name)) + struct.calcsize('<IHQ') for name, *_ in sections)
+    offset = header_size
+    for platform, count, width, rows in sections:
+        header.append(pack_str(platform) + struct.pack('<IHQ', count, width, offset))
+        offset += len(rows)
+    try:
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(header))
+            f.writelines(rows for *_, rows in sections)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as error:
+        print(f'Error writing preference snapshot: {error}')
+        return False
+
+class PrefsSnapshot:
+    """Memory-mapped preference snapshot; lookups binary-search the records without decoding the file"""
+
+    def __init__(self, path=USER_PREFS_SNAPSHOT_PATH):
+        import mmap
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self.data
+        if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f'{path} is not a preference snapshot')
+        pos = len(SNAPSHOT_MAGIC)
+
+        def unpack_str():
+            nonlocal pos
+            (length,) = struct.unpack_from('<I', data, pos)
+            value = data[pos + 4:pos + 4 + length].decode('utf-8')
+            pos += 4 + length
+            return value
+
+        (count,) = struct.unpack_from('<I', data, pos)
+        pos += 4
+        self.strings = [unpack_str() for _ in range(count)]
+        (count,) = struct.unpack_from('<H', data, pos)
+        pos += 2
+        self.sections = {}
+        for _ in range(count):
+            platform = unpack_str()
+            self.sections[platform] = struct.unpack_from('<IHQ', data, pos)
+            pos += struct.calcsize('<IHQ')
+
+    def close(self):
+        self.data.close()
+
+    def _record(self, offset):
+        zone_id, display_id, micros, flags = SNAPSHOT_RECORD.unpack_from(self.data, offset)
+        updated = None
+        if flags & SNAPSHOT_RAW_UPDATED:
+            updated = self.strings[micros]
+        elif flags & SNAPSHOT_HAS_UPDATED:
+            updated = _unpack_updated(micros, flags)
+        return {
+            'timezone': self.strings[zone_id],
+            'displayName': None if flags & SNAPSHOT_NO_DISPLAY_NAME else self.strings[display_id],
+            'lastUpdated': updated
+        }
+
+    def get(self, platform, user_id):
+        """One user's record, or None"""
+        if platform not in self.sections:
+            return None
+        count, width, offset = self.sections[platform]
+        key = str(user_id).encode('utf-8')
+        if len(key) > width:
+            return None
+        key = key.ljust(width, b'\0')
+        stride = width + SNAPSHOT_RECORD.size
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = offset + mid * stride
+            if self.data[start:start + width] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = offset + lo * stride
+        if lo < count and self.data[start:start + width] == key:
+            return self._record(start + width)
+        return None
+
+    def users(self, platform):
+        """Every record for a platform, decoded into the JSON layout"""
+        if platform not in self.sections:
+            return {}
+        count, width, offset = self.sections[platform]
+        rows = struct.Struct(f'<{width}s{SNAPSHOT_RECORD.format[1:]}')
+        strings = self.strings
+        users = {}
+        for key, zone_id, display_id, micros, flags in rows.iter_unpack(self.data[offset:offset + count * rows.size]):
+            if flags & SNAPSHOT_RAW_UPDATED:
+                updated = strings[micros]
+            else:
+                updated = _unpack_updated(micros, flags) if flags & SNAPSHOT_HAS_UPDATED else None
+            users[key.rstrip(b'\0').decode('utf-8')] = {
+                'timezone': strings[zone_id],
+                'displayName': None if flags & SNAPSHOT_NO_DISPLAY_NAME else strings[display_id],
+                'lastUpdated': updated
+            }
+        return users
+
+    def to_json(self):
+        return {platform: self.users(platform) for platform in self.sections}
+
+def export_prefs_snapshot(path=USER_PREFS_SNAPSHOT_PATH):
+    """JSON preferences -> binary snapshot"""
+    with open(USER_PREFS_PATH, 'r') as f:
+        return save_prefs_snapshot(json.load(f), path)
+
+def import_prefs_snapshot(path=USER_PREFS_SNAPSHOT_PATH):
+    """Binary snapshot -> JSON preferences"""
+    snapshot = PrefsSnapshot(path)
+    try:
+        data = snapshot.to_json()
+    finally:
+        snapshot.close()
+    with open(USER_PREFS_PATH, 'w') as f:
+        json.dump(data, f, indent=2)
+    return True
+
+def benchmark_prefs_snapshot(iterations=20):
+    """Compare loading the JSON preferences with opening the snapshot and looking users up"""
+    with open(USER_PREFS_PATH, 'r') as f:
+        prefs = json.load(f)
+    path = f'{USER_PREFS_SNAPSHOT_PATH}.bench'
+    save_prefs_snapshot(prefs, path)
+    users = [(platform, user_id) for platform, section in prefs.items() for user_id in section]
+    try:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            with open(USER_PREFS_PATH, 'r') as f:
+                json.load(f)
+        json_load = (time.perf_counter() - started) / iterations
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            PrefsSnapshot(path).close()
+        snapshot_open = (time.perf_counter() - started) / iterations
+
+        snapshot = PrefsSnapshot(path)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            snapshot.to_json()
+        snapshot_decode = (time.perf_counter() - started) / iterations
+        started = time.perf_counter()
+        for platform, user_id in users:
+            snapshot.get(platform, user_id)
+        lookup = (time.perf_counter() - started) / max(len(users), 1)
+        identical = snapshot.to_json() == prefs
+        snapshot.close()
+        json_size, snapshot_size = os.path.getsize(USER_PREFS_PATH), os.path.getsize(path)
+    finally:
+        os.remove(path)
+    print(f"{len(users)} users: JSON {json_size} bytes, snapshot {snapshot_size} bytes")
+    print(f"     JSON load: {json_load * 1e6:.1f}us")
+    print(f" snapshot open: {snapshot_open * 1e6:.1f}us (decode all: {snapshot_decode * 1e6:.1f}us, lookup: {lookup * 1e6:.2f}us)")
+    print(f"Round trip identical: {'yes' if identical else 'no'}")
+    return identical
+
+# Shared state
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'local').lower()
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_PREFIX = os.environ.get('REDIS_PREFIX', 'tzbot')
+USER_PREFS_DB_PATH = os.environ.get('USER_PREFS_DB_PATH', '../shared/user_preferences.db')
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+# Defaults to ../shared/<platform>_reminders.jsonl; set by setup()
+REMINDERS_PATH = None
+
+class LocalStateStore:
+    """Single-process state: the JSON preferences file and in-memory rate limits"""
+    name = 'local'
+
+    def __init__(self):
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def init(self):
+        init_user_prefs()
+
+    def prefs_version(self):
+        try:
+            return os.path.getmtime(USER_PREFS_PATH)
+        except OSError:
+            return None
+
+    def load_user_prefs(self):
+        return read_user_prefs().get('users', {})
+
+    def set_user_pref(self, user_id, record):
+        data = read_user_prefs()
+        data['users'][user_id] = record
+        return write_user_prefs(data)
+
+    def load_reminders(self):
+        """Pending reminders from the append-only log, which is compacted as it is read"""
+        pending = {}
+        try:
+            with open(REMINDERS_PATH, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if 'add' in entry:
+                        pending[entry['add']['id']] = entry['add']
+                    else:
+                        pending.pop(entry.get('done'), None)
+        except OSError:
+            return []
+        with self.lock:
+            with open(f'{REMINDERS_PATH}.tmp', 'w') as f:
+                f.writelines(json.dumps({'add': reminder}) + '\n' for reminder in pending.values())
+            os.replace(f'{REMINDERS_PATH}.tmp', REMINDERS_PATH)
+        return list(pending.values())
+
+    def add_reminders(self, reminders):
+        with self.lock, open(REMINDERS_PATH, 'a') as f:
+            f.writelines(json.dumps({'add': reminder}) + '\n' for reminder in reminders)
+
+    def claim_reminder(self, reminder_id):
+        """Mark a reminder as sent; True when this process should deliver it"""
+        with self.lock, open(REMINDERS_PATH, 'a') as f:
+            f.write(json.dumps({'done': reminder_id}) + '\n')
+        return True
+
+    def allow(self, key, limit, window):
+        """Fixed-window rate limit: True while `key` has made fewer than `limit` calls this window"""
+        now = time.time()
+        with self.lock:
+            start, count = self.windows.get(key, (now, 0))
+            if now - start >= window:
+                start, count = now, 0
+            if len(self.windows) > 100000:
+                self.windows = {k: v for k, v in self.windows.items() if now - v[0] < window}
+            self.windows[key] = (start, count + 1)
+            return count < limit
+
+class RedisStateStore:
+    """State shared by every worker through a Redis-protocol server"""
+    name = 'redis'
+
+    def __init__(self, url=REDIS_URL, prefix=REDIS_PREFIX, platform=None):
+        import redis
+        platform = platform or PLATFORM
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        # Connect now, so a misconfigured server fails startup instead of the first request
+        self.client.ping()
+        self.prefs_key = f'{prefix}:prefs:{platform}'
+        self.version_key = f'{self.prefs_key}:version'
+        self.rate_prefix = f'{prefix}:rate:'
+        self.reminders_key = f'{prefix}:reminders:{platform}'
+
+    def init(self):
+        """Seed Redis from the JSON file the first time a worker starts against an empty server"""
+        if not self.client.exists(self.prefs_key) and os.path.exists(USER_PREFS_PATH):
+            users = read_user_prefs().get('users', {})
+            if users:
+                self.client.hset(self.prefs_key, mapping={u: json.dumps(r) for u, r in users.items()})
+                self.client.incr(self.version_key)
+
+    def prefs_version(self):
+        version = self.client.get(self.version_key)
+        return int(version) if version is not None else None
+
+    def load_user_prefs(self):
+        return {user_id: json.loads(raw) for user_id, raw in self.client.hgetall(self.prefs_key).items()}
+
+    def set_user_pref(self, user_id, record):
+        """Returns the preference version this write produced, so indexes can tell whether they missed others"""
+        pipe = self.client.pipeline()
+        pipe.hset(self.prefs_key, user_id, json.dumps(record))
+        pipe.incr(self.version_key)
+        _, version = pipe.execute()
+        return version
+
+    def load_reminders(self):
+        return [json.loads(raw) for raw in self.client.hvals(self.reminders_key)]
+
+    def add_reminders(self, reminders):
+        if reminders:
+            self.client.hset(self.reminders_key, mapping={r['id']: json.dumps(r) for r in reminders})
+
+    def claim_reminder(self, reminder_id):
+        # Every worker holds the same heap; only the one whose delete succeeds sends
+        return self.client.hdel(self.reminders_key, reminder_id) == 1
+
+    def allow(self, key, limit, window):
+        bucket = f'{self.rate_prefix}{key}:{int(time.time() // window)}'
+        pipe = self.client.pipeline()
+        pipe.incr(bucket)
+        pipe.expire(bucket, window)
+        count, _ = pipe.execute()
+        return count <= limit
+
+class DiskStateStore(LocalStateStore):
+    """Preferences in SQLite with zone names interned, so only the users being looked up are loaded"""
+    name = 'disk'
+
+    def __init__(self, path=USER_PREFS_DB_PATH, platform=None):
+        super().__init__()
+        import sqlite3
+        self.platform = platform or PLATFORM
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db_lock = threading.Lock()
+        with self.db_lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS zones (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS prefs (platform TEXT NOT NULL, user_id TEXT NOT NULL, zone_id INTEGER NOT NULL, '
+                            'display_name TEXT, updated TEXT, PRIMARY KEY (platform, user_id)) WITHOUT ROWID')
+            self.db.execute('CREATE INDEX IF NOT EXISTS prefs_by_zone ON prefs (platform, zone_id)')
+
+    def init(self):
+        """Import the platform's section of the JSON file the first time the database is used"""
+        with self.db_lock:
+            empty = self.db.execute('SELECT 1 FROM prefs WHERE platform = ? LIMIT 1', (self.platform,)).fetchone() is None
+        if empty and os.path.exists(USER_PREFS_PATH):
+            self.import_user_prefs(read_user_prefs().get('users', {}))
+
+    def import_user_prefs(self, users):
+        """Insert many preferences in one transaction"""
+        users = {user_id: record for user_id, record in users.items() if record.get('timezone')}
+        with self.db_lock, self.db:
+            zone_ids = {zone: self._zone_id(zone) for zone in {record['timezone'] for record in users.values()}}
+            self.db.executemany('INSERT OR REPLACE INTO prefs (platform, user_id, zone_id, display_name, updated) VALUES (?, ?, ?, ?, ?)',
+                                ((self.platform, user_id, zone_ids[record['timezone']], record.get('displayName'), record.get('lastUpdated'))
+                                 for user_id, record in users.items()))
+
+    def _zone_id(self, name):
+        self.db.execute('INSERT OR IGNORE INTO zones (name) VALUES (?)', (name,))
+        return self.db.execute('SELECT id FROM zones WHERE name = ?', (name,)).fetchone()[0]
+
+    def prefs_version(self):
+        with self.db_lock:
+            return self.db.execute('PRAGMA data_version').fetchone()[0]
+
+    def _record(self, row):
+        zone, display_name, updated = row
+        # Databases written before timestamps were kept verbatim hold epoch seconds
+        if isinstance(updated, (int, float)):
+            updated = datetime.fromtimestamp(updated).isoformat()
+        return {'timezone': zone, 'displayName': display_name, 'lastUpdated': updated}
+
+    def get_user_pref(self, user_id):
+        with self.db_lock:
+            row = self.db.execute('SELECT z.name, p.display_name, p.updated FROM prefs p JOIN zones z ON z.id = p.zone_id '
+                                  'WHERE p.platform = ? AND p.user_id = ?', (self.platform, user_id)).fetchone()
+        return self._record(row) if row else None
+
+    def load_user_prefs(self):
+        with self.db_lock:
+            rows = self.db.execute('SELECT p.user_id, z.name, p.display_name, p.updated FROM prefs p JOIN zones z ON z.id = p.zone_id '
+                                   'WHERE p.platform = ?', (self.platform,)).fetchall()
+        return {row[0]: self._record(row[1:]) for row in rows}
+
+    def set_user_pref(self, user_id, record):
+        with self.db_lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO prefs (platform, user_id, zone_id, display_name, updated) VALUES (?, ?, ?, ?, ?)',
+                            (self.platform, user_id, self._zone_id(record['timezone']), record.get('displayName'), record.get('lastUpdated')))
+        return True
+
+    def users_in_zone(self, zone):
+        with self.db_lock:
+            rows = self.db.execute('SELECT p.user_id FROM prefs p JOIN zones z ON z.id = p.zone_id '
+                                   'WHERE p.platform = ? AND z.name = ?', (self.platform, zone))
+            return {row[0] for row in rows}
+
+    def zones_in_use(self):
+        with self.db_lock:
+            rows = self.db.execute('SELECT DISTINCT z.name FROM prefs p JOIN zones z ON z.id = p.zone_id WHERE p.platform = ?', (self.platform,))
+            return [row[0] for row in rows]
+
+# A bot that stores more than preferences and reminders passes its own subclasses to setup()
+STATE_STORES = {'local': LocalStateStore, 'redis': RedisStateStore, 'disk': DiskStateStore}
+state_stores = STATE_STORES
+
+def load_state_store(name):
+    if name == 'redis':
+        try:
+            return state_stores['redis']()
+        except Exception as error:
+            # Falling back to local files would split state between workers without anyone noticing
+            print(f'Redis state store unavailable ({error}); refusing to start with STATE_BACKEND=redis')
+            raise SystemExit(1)
+    if name == 'disk':
+        return state_stores['disk']()
+    return state_stores['local']()
+
+# Built by setup()
+state_store = None
+
+RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', '0'))
+
+def allow_reply(user_id):
+    """Per-user reply budget for automatic conversions; disabled when RATE_LIMIT_PER_MINUTE is 0"""
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return True
+    try:
+        return state_store.allow(f'reply:{user_id}', RATE_LIMIT_PER_MINUTE, 60)
+    except Exception as error:
+        print(f'Rate limiter error: {error}')
+        return True
+
+class UserTimezoneIndex:
+    """In-memory user -> timezone index with reverse lookups by zone"""
+
+    def __init__(self):
+        self.users = {}
+        self.zone_users = {}
+        self.version = None
+        self.lock = threading.Lock()
+
+    def ensure_loaded(self):
+        """(Re)build the index when preferences changed outside this process"""
+        version = state_store.prefs_version()
+        if self.version is not None and version == self.version:
+            return
+        users = state_store.load_user_prefs()
+        with self.lock:
+            self.users = {}
+            self.zone_users = {}
+            for user_id, record in users.items():
+                self._add(user_id, record)
+            self.version = version
+
+    def _add(self, user_id, record):
+        self.users[user_id] = record
+        zone = record.get('timezone')
+        if zone:
+            self.zone_users.setdefault(zone, set()).add(user_id)
+
+    def update(self, user_id, record, version=None):
+        """Apply a single preference change without rebuilding the index. `version` is the store version the
+        write produced, if the store reports one; unless it directly follows the loaded version, other
+        workers wrote in between and the index is marked stale so the next read reloads"""
+        with self.lock:
+            previous = self.users.get(user_id)
+            if previous and previous.get('timezone') in self.zone_users:
+                members = self.zone_users[previous['timezone']]
+                members.discard(user_id)
+                if not members:
+                    del self.zone_users[previous['timezone']]
+            self._add(user_id, record)
+            if version is None:
+                self.version = state_store.prefs_version()
+            elif self.version is not None and version == self.version + 1:
+                self.version = version
+            else:
+                self.version = None
+
+    def get_timezone(self, user_id):
+        self.ensure_loaded()
+        return self.users.get(user_id, {}).get('timezone')
+
+    def users_in_zone(self, zone):
+        self.ensure_loaded()
+        return set(self.zone_users.get(zone, ()))
+
+    def zones_for(self, user_ids):
+        """Distinct zones used by the given users"""
+        self.ensure_loaded()
+        return {self.users[u]['timezone'] for u in user_ids if self.users.get(u, {}).get('timezone')}
+
+    def zones_in_use(self):
+        """Zones assigned to at least one user"""
+        self.ensure_loaded()
+        return list(self.zone_users)
+
+class LruUserTimezoneIndex:
+    """Bounded user -> timezone cache over the disk store; reverse lookups are answered by the store's zone index"""
+
+    def __init__(self, store, capacity=10000):
+        self.store = store
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+
+    def ensure_loaded(self):
+        """Forget cached users once another process sharing the database has committed changes"""
+        version = self.store.prefs_version()
+        with self.lock:
+            if version != self.version:
+                self.cache.clear()
+                self.version = version
+
+    def _remember(self, user_id, zone):
+        self.cache[user_id] = zone
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+    def update(self, user_id, record, version=None):
+        with self.lock:
+            self._remember(user_id, record.get('timezone'))
+
+    def get_timezone(self, user_id):
+        self.ensure_loaded()
+        with self.lock:
+            if user_id in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(user_id)
+                return self.cache[user_id]
+            self.misses += 1
+        record = self.store.get_user_pref(user_id)
+        zone = record.get('timezone') if record else None
+        with self.lock:
+            self._remember(user_id, zone)
+        return zone
+
+    def users_in_zone(self, zone):
+        return self.store.users_in_zone(zone)
+
+    def zones_for(self, user_ids):
+        return {zone for zone in map(self.get_timezone, user_ids) if zone}
+
+    def zones_in_use(self):
+        return self.store.zones_in_use()
+
+# Built by setup() to match the state store
+user_index = None
+
+# Channel member cache
+class ChannelMemberCache:
+    """Channel -> member ids with TTL eviction, resolved to zones through user_index. With `complete_fetch` off,
+    `fetch` only returns part of a channel (e.g. its admins), so refreshes add to the members already learned"""
+
+    # Seconds to wait before retrying a failed fetch for a channel that is already cached
+    RETRY_AFTER = 60
+
+    def __init__(self, ttl=600, max_channels=1000, complete_fetch=True):
+        self.ttl = ttl
+        self.max_channels = max_channels
+        self.complete_fetch = complete_fetch
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_members(self, channel_id, fetch):
+        """Cached member ids for a channel, calling `fetch(channel_id)` only on a miss or expiry"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(channel_id)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(channel_id)
+                return set(entry[1])
+        try:
+            members = set(fetch(channel_id))
+        except Exception as error:
+            print(f'Error fetching members for {channel_id}: {error}')
+            # Keep what is known, but never cache a failed fetch as an empty channel
+            with self.lock:
+                entry = self.entries.get(channel_id)
+                if not entry:
+                    return set()
+                self.entries[channel_id] = (now + self.RETRY_AFTER, entry[1])
+                return set(entry[1])
+        with self.lock:
+            entry = self.entries.get(channel_id)
+            if entry and not self.complete_fetch:
+                members |= entry[1]
+            self.entries[channel_id] = (now + self.ttl, members)
+            self.entries.move_to_end(channel_id)
+            while len(self.entries) > self.max_channels:
+                self.entries.popitem(last=False)
+            return set(members)
+
+    def add_member(self, channel_id, user_id):
+        with self.lock:
+            entry = self.entries.get(channel_id)
+            if entry:
+                entry[1].add(user_id)
+
+    def remove_member(self, channel_id, user_id):
+        with self.lock:
+            entry = self.entries.get(channel_id)
+            if entry:
+                entry[1].discard(user_id)
+
+    def invalidate(self, channel_id):
+        with self.lock:
+            self.entries.pop(channel_id, None)
+
+    def get_zones(self, channel_id, fetch):
+        return user_index.zones_for(self.get_members(channel_id, fetch))
+
+
+# Timezone backends
+class PytzBackend:
+    """Zone lookups through pytz, localizing with is_dst=False"""
+    name = 'pytz'
+
+    def canonical_name(self, zone):
+        """The zone name to store for `zone`, or None if it is not a known zone"""
+        try:
+            pytz.timezone(zone)
+            return zone
+        except Exception:
+            return None
+
+    def convert(self, dt, zone):
+        return dt.astimezone(pytz.timezone(zone))
+
+    def localize(self, naive, zone):
+        return pytz.timezone(zone).localize(naive)
+
+class ZoneinfoBackend:
+    """Zone lookups through the stdlib's cached zoneinfo objects, resolving folds like pytz"""
+    name = 'zoneinfo'
+
+    def __init__(self):
+        from zoneinfo import ZoneInfo, available_timezones
+        self.ZoneInfo = ZoneInfo
+        self.names = {name.lower(): name for name in available_timezones()}
+
+    def canonical_name(self, zone):
+        # pytz accepts any casing but keeps the caller's spelling, so mirror that
+        return zone if zone and zone.lower() in self.names else None
+
+    def get_zone(self, zone):
+        return self.ZoneInfo(self.names.get(zone.lower(), zone))
+
+    def convert(self, dt, zone):
+        return dt.astimezone(self.get_zone(zone))
+
+    def localize(self, naive, zone):
+        tz = self.get_zone(zone)
+        earlier = naive.replace(tzinfo=tz, fold=0)
+        later = naive.replace(tzinfo=tz, fold=1)
+        if earlier.utcoffset() == later.utcoffset():
+            return earlier
+        if earlier.astimezone(dt_timezone.utc).astimezone(tz).replace(tzinfo=None) != naive:
+            # Skipped wall-clock time: keep the offset in force before the gap
+            return earlier
+        standard = [dt for dt in (earlier, later) if not dt.dst()]
+        return standard[0] if len(standard) == 1 else later
+
+TIMEZONE_BACKENDS = {'pytz': PytzBackend, 'zoneinfo': ZoneinfoBackend}
+
+def load_timezone_backend(name):
+    try:
+        return TIMEZONE_BACKENDS[name]()
+    except Exception as error:
+        print(f'Timezone backend {name!r} unavailable ({error}), using pytz')
+        return PytzBackend()
+
+timezone_backend = load_timezone_backend(os.environ.get('TIMEZONE_BACKEND', 'pytz').lower())
+
+# Offset tables
+OFFSET_TABLE_PATH = os.environ.get('OFFSET_TABLE_PATH', '../shared/offset_tables.bin')
+OFFSET_TABLE_YEARS = int(os.environ.get('OFFSET_TABLE_YEARS', '5'))
+OFFSET_TABLE_MAGIC = b'TZOT1'
+EPOCH = datetime(1970, 1, 1)
+
+offset_tables = {}
+offset_abbreviations = []
+offset_abbreviation_ids = {}
+offset_table_window = (0, 0)
+_fixed_zones = {}
+
+def _abbreviation_id(name):
+    if name not in offset_abbreviation_ids:
+        offset_abbreviation_ids[name] = len(offset_abbreviations)
+        offset_abbreviations.append(name)
+    return offset_abbreviation_ids[name]
+
+def _fixed_zone(offset, abbr_id):
+    key = (offset, abbr_id)
+    tz = _fixed_zones.get(key)
+    if tz is None:
+        tz = _fixed_zones[key] = dt_timezone(timedelta(seconds=offset), offset_abbreviations[abbr_id])
+    return tz
+
+class OffsetTable:
+    """UTC transition instants for one zone with the offset, DST flag and abbreviation in force from each"""
+    __slots__ = ('instants', 'offsets', 'dst', 'abbrs')
+
+    def __init__(self, instants, offsets, dst, abbrs):
+        self.instants = instants
+        self.offsets = offsets
+        self.dst = dst
+        self.abbrs = abbrs
+
+    @classmethod
+    def from_pytz(cls, zone, start, until):
+        tz = pytz.timezone(zone)
+        instants, offsets, dst, abbrs = array('q'), array('i'), array('b'), array('H')
+        transitions = getattr(tz, '_utc_transition_times', None)
+        if not transitions:
+            sample = datetime(2000, 1, 1)
+            instants.append(start)
+            offsets.append(int(tz.utcoffset(sample).total_seconds()))
+            dst.append(0)
+            abbrs.append(_abbreviation_id(tz.tzname(sample)))
+            return cls(instants, offsets, dst, abbrs)
+        for i, (when, info) in enumerate(zip(transitions, tz._transition_info)):
+            instant = int((when - EPOCH).total_seconds()) if when.year > 1 else start
+            next_instant = (int((transitions[i + 1] - EPOCH).total_seconds())
+                            if i + 1 < len(transitions) else until)
+            if next_instant <= start or instant >= until:
+                continue
+            utcoffset, dst_delta, tzname = info
+            instants.append(max(instant, start))
+            offsets.append(int(utcoffset.total_seconds()))
+            dst.append(1 if dst_delta else 0)
+            abbrs.append(_abbreviation_id(tzname))
+        return cls(instants, offsets, dst, abbrs)
+
+    def index_at(self, instant):
+        """Index of the entry in force at a UTC instant, or -1 outside the table window"""
+        if instant >= offset_table_window[1]:
+            return -1
+        return bisect_right(self.instants, instant) - 1
+
+    def index_for_local(self, local_seconds):
+        """Index for a wall-clock time; ambiguous and skipped times resolve like pytz is_dst=False"""
+        guess = bisect_right(self.instants, local_seconds) - 1
+        candidates = [i for i in (guess - 1, guess, guess + 1) if 0 <= i < len(self.instants)]
+        valid = []
+        for i in candidates:
+            utc = local_seconds - self.offsets[i]
+            end = self.instants[i + 1] if i + 1 < len(self.instants) else offset_table_window[1]
+            if self.instants[i] <= utc < end:
+                valid.append(i)
+        if len(valid) == 1:
+            return valid[0]
+        if not valid:
+            # Skipped wall-clock time: pytz keeps the offset in force before the gap
+            return self.index_at(local_seconds - 6 * 3600 - self.offsets[guess]) if guess >= 0 else -1
+        standard = [i for i in valid if not self.dst[i]]
+        return (standard or valid)[-1]
+
+def build_offset_tables(zones):
+    """Precompute offset tables for a rolling window of years around now"""
+    global offset_table_window
+    year = datetime.utcnow().year
+    start = int((datetime(year - 1, 1, 1) - EPOCH).total_seconds())
+    until = int((datetime(year + OFFSET_TABLE_YEARS, 1, 1) - EPOCH).total_seconds())
+    offset_table_window = (start, until)
+    for zone in zones:
+        try:
+            offset_tables[zone] = OffsetTable.from_pytz(zone, start, until)
+        except Exception:
+            continue
+
+def save_offset_tables(path=OFFSET_TABLE_PATH):
+    """Write the offset tables as a compact binary file for instant startup"""
+    def pack_str(value):
+        raw = value.encode('utf-8')
+        return struct.pack('<H', len(raw)) + raw
+
+    chunks = [OFFSET_TABLE_MAGIC, pack_str(pytz.__version__), struct.pack('<qqH', *offset_table_window, len(offset_abbreviations))]
+    chunks.extend(pack_str(name) for name in offset_abbreviations)
+    chunks.append(struct.pack('<I', len(offset_tables)))
+    for zone, table in offset_tables.items():
+        chunks.append(pack_str(zone))
+        chunks.append(struct.pack('<I', len(table.instants)))
+        chunks.extend([table.instants.tobytes(), table.offsets.tobytes(), table.dst.tobytes(), table.abbrs.tobytes()])
+    try:
+        # Both bots share the file, so replace it whole rather than let a reader see it half written
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(chunks))
+        os.replace(tmp_path, path)
+        return True
+    except Exception as error:
+        print(f'Error writing offset tables: {error}')
+        return False
+
+def load_offset_tables(path=OFFSET_TABLE_PATH):
+    """Load offset tables written by save_offset_tables; returns False if missing or stale"""
+    global offset_table_window
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return False
+    try:
+        if not data.startswith(OFFSET_TABLE_MAGIC):
+            return False
+        pos = len(OFFSET_TABLE_MAGIC)
+
+        def unpack_str():
+            nonlocal pos
+            (length,) = struct.unpack_from('<H', data, pos)
+            value = data[pos + 2:pos + 2 + length].decode('utf-8')
+            pos += 2 + length
+            return value
+
+        if unpack_str() != pytz.__version__:
+            return False
+        start, until, abbr_count = struct.unpack_from('<qqH', data, pos)
+        pos += struct.calcsize('<qqH')
+        now = int(time.time())
+        if not (start <= now < until - 366 * 86400):
+            return False
+        names = [unpack_str() for _ in range(abbr_count)]
+        (zone_count,) = struct.unpack_from('<I', data, pos)
+        pos += 4
+        tables = {}
+        for _ in range(zone_count):
+            zone = unpack_str()
+            (count,) = struct.unpack_from('<I', data, pos)
+            pos += 4
+            columns = []
+            for typecode in 'qibH':
+                column = array(typecode)
+                size = column.itemsize * count
+                if pos + size > len(data):
+                    raise ValueError(f'{zone} table is truncated')
+                column.frombytes(data[pos:pos + size])
+                pos += size
+                columns.append(column)
+            tables[zone] = OffsetTable(*columns)
+        if pos != len(data):
+            raise ValueError(f'{len(data) - pos} unexpected trailing bytes')
+    except Exception as error:
+        print(f'Error reading offset tables: {error}')
+        return False
+    offset_abbreviations[:] = names
+    offset_abbreviation_ids.clear()
+    offset_abbreviation_ids.update((name, i) for i, name in enumerate(names))
+    offset_tables.clear()
+    offset_tables.update(tables)
+    offset_table_window = (start, until)
+    return True
+
+def configured_zones():
+    """Every zone reachable through the shared timezone config"""
+    zones = set(timezone_config.get('aliases', {}).values())
+    zones.update(timezone_config.get('display_names', {}))
+    zones.update(timezone_config.get('popular', []))
+    zones.update(['UTC', 'GMT'])
+    return zones
+
+def init_offset_tables():
+    if timezone_backend.name != 'pytz':
+        # Tables are derived from pytz data; other backends convert directly
+        return
+    if load_offset_tables():
+        return
+    build_offset_tables(configured_zones())
+    save_offset_tables()
+
+def get_offset_table(zone):
+    table = offset_tables.get(zone)
+    if table is None and offset_table_window[1]:
+        try:
+            table = offset_tables[zone] = OffsetTable.from_pytz(zone, *offset_table_window)
+        except Exception:
+            return None
+    return table
+
+# Clock
+class SystemClock:
+    """Wall-clock time"""
+
+    def now(self):
+        return datetime.now(dt_timezone.utc)
+
+class ReplayClock:
+    """Time pinned to the update being replayed, so "today" and "now" match the recording"""
+
+    def __init__(self, timestamp=0.0):
+        self.timestamp = timestamp
+
+    def now(self):
+        return datetime.fromtimestamp(self.timestamp, dt_timezone.utc)
+
+clock = SystemClock()
+
+def zone_now(zone):
+    """Current time in a zone, from the offset table when possible"""
+    return to_zone(clock.now(), zone)
+
+def to_zone(dt, zone):
+    """Convert an aware datetime to a zone without creating pytz objects on the fast path"""
+    table = get_offset_table(zone)
+    if table is not None:
+        utc = dt.astimezone(dt_timezone.utc).replace(tzinfo=None)
+        i = table.index_at(int((utc - EPOCH).total_seconds()))
+        if i >= 0:
+            return (utc + timedelta(seconds=table.offsets[i])).replace(tzinfo=_fixed_zone(table.offsets[i], table.abbrs[i]))
+    return timezone_backend.convert(dt, zone)
+
+def localize_in_zone(naive, zone):
+    """Attach a zone to a wall-clock datetime, matching pytz localize(is_dst=False)"""
+    table = get_offset_table(zone)
+    if table is not None:
+        local_seconds = int((naive.replace(microsecond=0) - EPOCH).total_seconds())
+        i = table.index_for_local(local_seconds)
+        if i >= 0 and table.index_at(local_seconds - table.offsets[i]) >= 0:
+            return naive.replace(tzinfo=_fixed_zone(table.offsets[i], table.abbrs[i]))
+    return timezone_backend.localize(naive, zone)
+
+# Timezone suggestions
+class ZoneSuggester:
+    """Prefix trie and trigram index over aliases, zone names, cities and countries for autocomplete and near misses"""
+    MAX_RESULTS = 10
+
+    def __init__(self):
+        self.root = {}
+        self.keys = {}
+        self.labels = []
+        self.trigrams = {}
+        self.lock = threading.Lock()
+        self.built = False
+
+    @staticmethod
+    def fold(text):
+        return re.sub(r'[^a-z0-9+-]', '', text.lower())
+
+    @staticmethod
+    def grams(folded):
+        padded = f'  {folded} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, label, zone, rank):
+        key = self.fold(label)
+        if not key:
+            return
+        zones = self.keys.setdefault(key, {})
+        if zone in zones:
+            return
+        zones[zone] = rank
+        entry = (rank, len(key), label, zone)
+        self.labels.append(entry)
+        # Every node keeps its best few completions so a lookup never walks the subtree
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {'': []})
+            best = node['']
+            if len(best) < self.MAX_RESULTS or entry < best[-1]:
+                insort(best, entry)
+                del best[self.MAX_RESULTS:]
+        for gram in self.grams(key):
+            self.trigrams.setdefault(gram, []).append(len(self.labels) - 1)
+
+    def build(self):
+        with self.lock:
+            if self.built:
+                return
+            for zone in timezone_config.get('popular', []):
+                self.add(zone, zone, 0)
+            for alias, zone in timezone_config.get('aliases', {}).items():
+                self.add(alias, zone, 1)
+            for zone in pytz.common_timezones:
+                self.add(zone, zone, 2)
+                if '/' in zone:
+                    self.add(zone.rsplit('/', 1)[1].replace('_', ' '), zone, 2)
+            for code, zones in pytz.country_timezones.items():
+                if len(zones) == 1:
+                    self.add(pytz.country_names[code], zones[0], 3)
+            for zone in pytz.all_timezones:
+                self.add(zone, zone, 4)
+            self.built = True
+
+    def resolve(self, text):
+        """The zone `text` names once case, spaces and punctuation are ignored, if it names exactly one"""
+        self.build()
+        zones = self.keys.get(self.fold(text), {})
+        return next(iter(zones)) if len(zones) == 1 else None
+
+    def complete(self, prefix):
+        self.build()
+        node = self.root
+        for char in self.fold(prefix):
+            node = node.get(char)
+            if node is None:
+                return []
+        return [(label, zone) for _, _, label, zone in node.get('', [])]
+
+    def fuzzy(self, text, limit=MAX_RESULTS):
+        """Closest labels by trigram overlap (Dice coefficient), for misspellings a prefix can't reach"""
+        self.build()
+        key = self.fold(text)
+        grams = self.grams(key)
+        counts = {}
+        for gram in grams:
+            for index in self.trigrams.get(gram, ()):
+                counts[index] = counts.get(index, 0) + 1
+        scored = []
+        for index, common in counts.items():
+            rank, length, label, zone = self.labels[index]
+            score = 2 * common / (len(grams) + length + 1)
+            if score >= 0.4:
+                scored.append((-score, rank, label, zone))
+        scored.sort()
+        return [(label, zone) for _, _, label, zone in scored[:limit]]
+
+    def suggest(self, text, limit=MAX_RESULTS):
+        """Completions for `text`, topped up with fuzzy matches; one entry per zone"""
+        candidates = self.complete(text)
+        if len(candidates) < limit:
+            candidates += self.fuzzy(text, limit)
+        results = []
+        seen = set()
+        for label, zone in candidates:
+            if zone not in seen:
+                seen.add(zone)
+                results.append((label, zone))
+        return results[:limit]
+
+zone_suggester = ZoneSuggester()
+
+# Abbreviation priors
+ABBREVIATION_PRIOR_HALF_LIFE = float(os.environ.get('ABBREVIATION_PRIOR_HALF_LIFE_HOURS', '168')) * 3600
+ABBREVIATION_PRIOR_SCOPES = int(os.environ.get('ABBREVIATION_PRIOR_SCOPES', '5000'))
+# Zones remembered per scope; the lightest is dropped to make room
+ABBREVIATION_PRIOR_ZONES = 16
+# How much a zone in the same region as a candidate counts towards it, and how much each resolution adds back
+ABBREVIATION_REGION_WEIGHT = 0.5
+ABBREVIATION_RESOLUTION_WEIGHT = 0.25
+
+class AbbreviationResolver:
+    """Picks what an abbreviation with several meanings (CST, IST, BST) refers to in a chat or workspace,
+    from decayed counts of the zones seen there; kept in memory so resolving adds no I/O"""
+
+    def __init__(self, config, half_life=ABBREVIATION_PRIOR_HALF_LIFE, max_scopes=ABBREVIATION_PRIOR_SCOPES):
+        self.half_life = half_life
+        self.max_scopes = max_scopes
+        self.priors = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'resolved': 0, 'overridden': 0}
+        self.candidates = {}
+        aliases = config.get('aliases', {})
+        # Keys like CST_CHINA are the old workaround for clashes; they name the other meanings of CST
+        for key, zone in aliases.items():
+            base, _, qualifier = key.partition('_')
+            if qualifier and base in aliases:
+                self._add_candidate(base, aliases[base])
+                self._add_candidate(base, zone)
+        for abbreviation, zones in config.get('ambiguous', {}).items():
+            for zone in [aliases.get(abbreviation, zones[0])] + zones:
+                self._add_candidate(abbreviation, zone)
+        self.candidates = {abbreviation: zones for abbreviation, zones in self.candidates.items() if len(zones) > 1}
+
+    def _add_candidate(self, abbreviation, zone):
+        zones = self.candidates.setdefault(abbreviation, [])
+        if zone not in zones:
+            zones.append(zone)
+
+    def _weight(self, entry, now):
+        return entry[0] * 0.5 ** ((now - entry[1]) / self.half_life)
+
+    def _observe(self, scope, zone, weight, now):
+        zones = self.priors.get(scope)
+        if zones is None:
+            zones = self.priors[scope] = {}
+            while len(self.priors) > self.max_scopes:
+                self.priors.popitem(last=False)
+        else:
+            self.priors.move_to_end(scope)
+        entry = zones.get(zone)
+        if entry:
+            entry[0] = self._weight(entry, now) + weight
+            entry[1] = now
+            return
+        if len(zones) >= ABBREVIATION_PRIOR_ZONES:
+            del zones[min(zones, key=lambda name: self._weight(zones[name], now))]
+        zones[zone] = [weight, now]
+
+    def observe(self, scope, zone, weight=1.0):
+        """Count `zone` as in use in `scope`, e.g. ('chat', chat_id)"""
+        if scope is None or scope[1] is None or not zone:
+            return
+        with self.lock:
+            self._observe(scope, zone, weight, time.time())
+
+    def resolve(self, abbreviation, scopes, record=True):
+        """The zone `abbreviation` most likely means in `scopes` (most specific first), or None if it has one meaning"""
+        candidates = self.candidates.get(abbreviation.upper())
+        if not candidates:
+            return None
+        scopes = [scope for scope in scopes if scope[1] is not None]
+        if not scopes:
+            return candidates[0]
+        now = time.time()
+        scores = dict.fromkeys(candidates, 0.0)
+        with self.lock:
+            for scope in scopes:
+                for zone, entry in self.priors.get(scope, {}).items():
+                    weight = self._weight(entry, now)
+                    region = zone.split('/')[0]
+                    for candidate in candidates:
+                        if candidate == zone:
+                            scores[candidate] += weight
+                        elif candidate.split('/')[0] == region:
+                            scores[candidate] += weight * ABBREVIATION_REGION_WEIGHT
+            # max keeps the first of equal scores, so without evidence the usual alias wins
+            best = max(candidates, key=scores.get)
+            if record:
+                self.stats['resolved'] += 1
+                self.stats['overridden'] += best != candidates[0]
+                if scores[best]:
+                    self._observe(scopes[0], best, ABBREVIATION_RESOLUTION_WEIGHT, now)
+        return best
+
+    def signature(self, text, scopes):
+        """The non-default choices `text` would get in `scopes`, for keying anything cached on them"""
+        if not scopes:
+            return ''
+        choices = []
+        for word in set(re.findall(r'\b[A-Za-z]{3,4}\b', text)):
+            if word.upper() in self.candidates:
+                zone = self.resolve(word, scopes, record=False)
+                if zone != self.candidates[word.upper()][0]:
+                    choices.append(f"{word.upper()}={zone}")
+        return ','.join(sorted(choices))
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, scopes=len(self.priors), ambiguous=sorted(self.candidates))
+
+abbreviation_resolver = AbbreviationResolver(timezone_config)
+
+# Timezone utilities
+# Helper function to get display name for timezone
+def get_timezone_display_name(timezone_id):
+    # Check if we have a display name in the timezone config
+    if timezone_config.get('display_names') and timezone_id in timezone_config['display_names']:
+        return timezone_config['display_names'][timezone_id]
+    
+    # Fallback to timezone name
+    try:
+        return zone_now(timezone_id).strftime('%Z')
+    except:
+        return timezone_id.split('/')[-1].upper()
+
+def normalize_timezone(input_tz):
+    if not input_tz:
+        return None
+    
+    # Check aliases first
+    alias = timezone_config['aliases'].get(input_tz.upper())
+    if alias:
+        return alias
+    
+    # Check if it's a valid timezone name
+    if timezone_backend.canonical_name(input_tz):
+        return input_tz
+    
+    # Handle UTC offset formats (UTC-5, UTC+3:30)
+    offset_match = re.match(r'^(UTC)?([+-]\d{1,2}):?(\d{2})?$', input_tz, re.IGNORECASE)
+    if offset_match:
+        sign = '+' if offset_match.group(2).startswith('+') else '-'
+        hours = abs(int(offset_match.group(2)))
+        minutes = int(offset_match.group(3)) if offset_match.group(3) else 0
+        
+        if hours <= 14 and minutes <= 59:
+            # Etc/GMT offsets are inverted
+            return f"Etc/GMT{'-' if sign == '+' else '+'}{hours}"
+    
+    return None
+
+def resolve_timezone_input(input_tz):
+    """What someone typed into /timezone: a strict match, else a near miss such as "america/new york" or "Singapore"
+
+    Kept out of normalize_timezone, which also reads every word after a time in chat."""
+    return normalize_timezone(input_tz) or zone_suggester.resolve(input_tz)
+
+def set_user_timezone(user_id, timezone_input):
+    normalized_tz = resolve_timezone_input(timezone_input)
+    if not normalized_tz:
+        return False
+    
+    record = {
+        'timezone': normalized_tz,
+        'displayName': timezone_input,
+        'lastUpdated': clock.now().astimezone().replace(tzinfo=None).isoformat()
+    }
+    write = health_monitor.begin_write()
+    saved = False
+    try:
+        saved = state_store.set_user_pref(str(user_id), record)
+    except Exception as error:
+        print(f'Error saving user preference: {error}')
+    finally:
+        health_monitor.end_write(write, saved)
+    if not saved:
+        return False
+    # Stores that version writes return the new version rather than True
+    user_index.update(str(user_id), record, None if saved is True else saved)
+    return True
+
+def get_user_timezone(user_id):
+    return user_index.get_timezone(str(user_id))
+
+# Time parsing and conversion
+# Optional pieces folded into the clock patterns, so a date word or the start of a range is
+# claimed by the same match as the time it belongs to instead of a second scan around it
+TIME_ZONE_TOKEN = r'(?:[A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})'
+DAY_WORD = r'(?:today|tonight|tomorrow|mon(?:day)?|tue(?:s(?:day)?)?|wed(?:nesday)?|thu(?:r(?:s(?:day)?)?)?|fri(?:day)?|sat(?:urday)?|sun(?:day)?)'
+# Date words only join a time on the same line
+DATE_PREFIX = rf'(?:(?:next[ \t]+)?{DAY_WORD}[ \t]+(?:at[ \t]+|@[ \t]*)?)?'
+DATE_SUFFIX = rf'(?:[ \t]+(?:on[ \t]+)?(?:next[ \t]+)?{DAY_WORD})?'
+RANGE_START_12H = r'(?:\d{1,2}(?::\d{2})?\s*(?:AM|PM)?\s*(?:-|–|to)\s*)?'
+RANGE_START_24H = r'(?:(?:[01]?\d|2[0-3]):[0-5]\d\s*(?:-|–|to)\s*)?'
+TIME_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    # One pass for every clock form, longest alternative first: "3:00 PM EST", "2 PM PST", "3:00 PM", "3 PM",
+    # "15:30", "Monday 10:00 PST" (zone abbreviations must be upper case after a 24-hour time), "tomorrow at 3pm",
+    # "3-5pm EST". The lookahead is a cheap first-character check that rejects most word starts before the
+    # optional date and range groups are tried.
+    rf'\b(?=[\dmtwfsn]){DATE_PREFIX}'
+    rf'(?:{RANGE_START_12H}(\d{{1,2}})(?::(\d{{2}}))?\s*(AM|PM)(?:\s*({TIME_ZONE_TOKEN}))?'
+    rf'|{RANGE_START_24H}([01]?\d|2[0-3]):([0-5]\d)(?:\s*(?-i:{TIME_ZONE_TOKEN}))?){DATE_SUFFIX}\b',
+    # With context: "at 3pm"
+    r'\b(at|around|by|before|after)\s+(\d{1,2}):?(\d{2})?\s*(AM|PM|am|pm)?\b'
+)]
+
+def find_time_spans(content, offset=0):
+    """(pattern index, start, end, text) for each time expression, in the order the patterns claim them"""
+    spans = []
+    
+    for index, pattern in enumerate(TIME_PATTERNS):
+        for match in pattern.finditer(content):
+            start = match.start()
+            end = match.end()
+            
+            # Skip overlapping matches
+            overlaps = any(
+                (start >= span_start and start < span_end) or
+                (end > span_start and end <= span_end) or
+                (start <= span_start and end >= span_end)
+                for _, span_start, span_end, _ in spans
+            )
+            
+            if not overlaps:
+                spans.append((index, start, end, match.group(0).strip()))
+    
+    if offset:
+        spans = [(index, start + offset, end + offset, text) for index, start, end, text in spans]
+    return spans
+
+def times_from_spans(content, spans):
+    """The usable time strings from `spans`, ordered by where they first appear in `content`"""
+    times = [text for _, _, _, text in sorted(spans)]
+    return sorted([t for t in times if len(t) >= 2 and not re.match(r'^\d{1,2}$', t.strip())], 
+                 key=lambda x: content.find(x))
+
+def extract_times(content):
+    return times_from_spans(content, scan_time_spans(content))
+
+# Extraction guard
+EXTRACTION_MAX_CHARS = int(os.environ.get('EXTRACTION_MAX_CHARS', '4000'))
+EXTRACTION_BUDGET_MS = float(os.environ.get('EXTRACTION_BUDGET_MS', '100'))
+EXTRACTION_CHUNK_CHARS = 1024
+# Longer than any single time expression, so rescans past a cut or an edit always see whole matches
+TIME_SPAN_MARGIN = 64
+# Anything longer is whitespace padding around digits, not a time anyone wrote
+MAX_TIME_EXPRESSION = 64
+CODE_FENCE = re.compile(r'```.*?(?:```|$)', re.DOTALL)
+extraction_stats = {'scans': 0, 'chunked': 0, 'truncated_by_size': 0, 'truncated_by_time': 0, 'code_chars_skipped': 0}
+
+def scannable_ranges(content, skip=()):
+    """(start, end) ranges of `content` to scan: outside code fences and `skip`, within EXTRACTION_MAX_CHARS"""
+    limit = min(len(content), EXTRACTION_MAX_CHARS)
+    excluded = sorted(list(skip) + [match.span() for match in CODE_FENCE.finditer(content, 0, limit)])
+    ranges = []
+    pos = 0
+    for start, end in excluded:
+        if start > pos:
+            ranges.append((pos, min(start, limit)))
+        extraction_stats['code_chars_skipped'] += max(0, min(end, limit) - max(start, pos))
+        pos = max(pos, end)
+    if pos < limit:
+        ranges.append((pos, limit))
+    return [(start, end) for start, end in ranges if start < end]
+
+def scan_time_spans(content, skip=()):
+    """find_time_spans with bounded cost: code skipped, text past the size cap ignored, chunks scanned within a time budget"""
+    extraction_stats['scans'] += 1
+    if len(content) <= EXTRACTION_CHUNK_CHARS and not skip and '```' not in content:
+        return [span for span in find_time_spans(content) if len(span[3]) <= MAX_TIME_EXPRESSION]
+    
+    extraction_stats['chunked'] += 1
+    if len(content) > EXTRACTION_MAX_CHARS:
+        extraction_stats['truncated_by_size'] += 1
+    deadline = time.perf_counter() + EXTRACTION_BUDGET_MS / 1000
+    spans = []
+    for range_start, range_end in scannable_ranges(content, skip):
+        pos = range_start
+        previous = []
+        while pos < range_end:
+            if time.perf_counter() > deadline:
+                extraction_stats['truncated_by_time'] += 1
+                return sorted(spans)
+            end = min(pos + EXTRACTION_CHUNK_CHARS, range_end)
+            if end < range_end:
+                # Cut at whitespace; the scan runs a margin past the cut so a time straddling it is still found whole
+                cut = max(content.rfind(' ', pos + 1, end), content.rfind('\n', pos + 1, end))
+                end = cut if cut > pos else end
+            chunk = []
+            for span in find_time_spans(content[pos:min(end + TIME_SPAN_MARGIN, range_end)], offset=pos):
+                if span[1] >= end or len(span[3]) > MAX_TIME_EXPRESSION:
+                    continue
+                if any(span[1] < other[2] and other[1] < span[2] for other in previous):
+                    continue
+                chunk.append(span)
+            spans.extend(chunk)
+            previous = chunk
+            # Resume after a time that crossed the cut, as a single pass over the whole text would
+            pos = max([end] + [span[2] for span in chunk])
+    return sorted(spans)
+
+DATE_WORD = re.compile(rf'\b(?:on\s+)?(next\s+)?({DAY_WORD})\b(?:\s+(?:at\s+|@\s*))?', re.IGNORECASE)
+# Only a separator followed by another clock starts a range, so the "to" in "3 PM to discuss" stays prose
+TIME_RANGE = re.compile(r'^(\d{1,2})(?::(\d{2}))?\s*(AM|PM)?\s*(?:-|–|to)\s*(?=\d)', re.IGNORECASE)
+WEEKDAY_PREFIXES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+def resolve_day(today, word, skip_this_week=False):
+    """The date `word` ("tomorrow", "Monday", ...) means when said on `today`"""
+    word = word.lower()
+    if word in ('today', 'tonight'):
+        return today
+    if word == 'tomorrow':
+        return today + timedelta(days=1)
+    ahead = (WEEKDAY_PREFIXES.index(word[:3]) - today.weekday()) % 7
+    if skip_this_week and not ahead:
+        ahead = 7
+    return today + timedelta(days=ahead)
+
+def parse_clock(clock):
+    """A naive time from "3:00 PM", "3pm" or "15:30", or None"""
+    # Parse different formats
+    if re.match(r'^\d{1,2}:\d{2}\s*(AM|PM)$', clock, re.IGNORECASE):
+        return datetime.strptime(clock.upper(), '%I:%M %p' if ' ' in clock else '%I:%M%p').time()
+    if re.match(r'^\d{1,2}\s+(AM|PM)$', clock, re.IGNORECASE):
+        return datetime.strptime(clock.upper(), '%I %p').time()
+    if re.match(r'^\d{1,2}(AM|PM)$', clock, re.IGNORECASE):
+        # Handle cases like "3pm" without space
+        normalized = re.sub(r'(\d+)(AM|PM)', r'\1 \2', clock, flags=re.IGNORECASE)
+        return datetime.strptime(normalized.upper(), '%I %p').time()
+    if re.match(r'^\d{1,2}:\d{2}$', clock):
+        return datetime.strptime(clock, '%H:%M').time()
+    # Try some additional formats as fallback
+    for fmt in ['%I:%M:%S %p', '%H:%M:%S', '%I %p', '%H:%M']:
+        try:
+            return datetime.strptime(clock.upper(), fmt).time()
+        except ValueError:
+            continue
+    return None
+
+def range_start(match, end_clock, end_time):
+    """The start of "3-5pm" or "11-1pm", taking AM/PM from the end when only it has one"""
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if meridiem:
+        return datetime.strptime(f"{hour}:{minute:02d} {meridiem.upper()}", '%I:%M %p').time()
+    if not re.search(r'(AM|PM)$', end_clock, re.IGNORECASE):
+        return datetime.strptime(f"{hour}:{minute:02d}", '%H:%M').time()
+    start = datetime.strptime(f"{hour}:{minute:02d} {end_clock[-2:].upper()}", '%I:%M %p').time()
+    if start > end_time:
+        start = datetime.strptime(f"{hour}:{minute:02d} AM", '%I:%M %p').time()
+    return start
+
+def parse_time(time_str, context_tz='UTC', scopes=()):
+    if not time_str:
+        return None
+    
+    timezone = context_tz
+    
+    # Date words come out first so "Mon" or "Tue" are never taken for a zone abbreviation
+    date_match = DATE_WORD.search(time_str)
+    if date_match:
+        time_str = (time_str[:date_match.start()] + ' ' + time_str[date_match.end():]).strip()
+    
+    # Filler words and the start of a range come off next, so "at" or the "to" in "3 to 5pm" is never a zone
+    time_str = re.sub(r'\b(at|around|by|before|after)\s+', '', time_str, flags=re.IGNORECASE).strip()
+    range_match = TIME_RANGE.match(time_str)
+    if range_match:
+        time_str = time_str[range_match.end():]
+    
+    # Look for timezone in string - improved regex to catch more formats, excluding AM/PM
+    tz_match = re.search(r'\b(?!AM|PM)([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b', time_str, re.IGNORECASE)
+    if tz_match:
+        tz_candidate = tz_match.group(1)
+        # Double-check it's not AM/PM
+        if tz_candidate.upper() not in ['AM', 'PM']:
+            # An abbreviation with several meanings is read the way the chat or workspace uses it
+            normalized_tz = abbreviation_resolver.resolve(tz_candidate, scopes) if scopes else None
+            normalized_tz = normalized_tz or normalize_timezone(tz_candidate)
+            if normalized_tz:
+                timezone = normalized_tz
+    
+    # Be more careful about removing timezone - don't remove AM/PM
+    clock = re.sub(r'\b(?!AM|PM)([A-Z]{2,4}|UTC[+-]\d{1,2}:?\d{0,2}|GMT[+-]\d{1,2}:?\d{0,2})\b', '', time_str, flags=re.IGNORECASE).strip()
+    
+    try:
+        clock_time = parse_clock(clock)
+        if clock_time is None:
+            return None
+        
+        # Create timezone-aware datetime for the day named in the string, or today
+        day = zone_now(timezone).date()
+        if date_match:
+            day = resolve_day(day, date_match.group(2), bool(date_match.group(1)))
+        if not range_match:
+            return {'datetime': localize_in_zone(datetime.combine(day, clock_time), timezone), 'timezone': timezone}
+        
+        start_time = range_start(range_match, clock, clock_time)
+        # "10pm-2am" ends the next day
+        end_day = day + timedelta(days=1) if clock_time <= start_time else day
+        return {
+            'datetime': localize_in_zone(datetime.combine(day, start_time), timezone),
+            'end': localize_in_zone(datetime.combine(end_day, clock_time), timezone),
+            'timezone': timezone,
+        }
+    except:
+        return None
+
+def format_clock(moment, until=None):
+    """"3:00PM", or "3:00PM–5:00PM" for a range"""
+    clock = moment.strftime('%I:%M%p').lstrip('0')
+    if until is None:
+        return clock
+    return f"{clock}–{until.strftime('%I:%M%p').lstrip('0')}"
+
+class Conversion:
+    """A detected time (or range) converted to a target timezone, formatted on demand"""
+    __slots__ = ('source', 'result', 'source_timezone', 'target_timezone', 'label', 'source_end', 'result_end')
+
+    def __init__(self, source, result, source_timezone, target_timezone, label=None, source_end=None, result_end=None):
+        self.source = source
+        self.result = result
+        self.source_timezone = source_timezone
+        self.target_timezone = target_timezone
+        self.label = label
+        self.source_end = source_end
+        self.result_end = result_end
+
+    @property
+    def original(self):
+        if self.label is not None:
+            return self.label
+        return f"{format_clock(self.source, self.source_end)} {get_timezone_display_name(self.source_timezone)}"
+
+    @property
+    def converted(self):
+        return f"{format_clock(self.result, self.result_end)} {get_timezone_display_name(self.target_timezone)}"
+
+    @property
+    def date(self):
+        return self.result.strftime('%A, %B %d')
+
+    @property
+    def same_day(self):
+        return self.source.date() == self.result.date()
+
+def build_conversion(parsed, target_timezone, label=None):
+    converted = to_zone(parsed['datetime'], target_timezone)
+    end = parsed.get('end')
+    converted_end = to_zone(end, target_timezone) if end is not None else None
+    return Conversion(parsed['datetime'], converted, parsed['timezone'], target_timezone, label, end, converted_end)
+
+def convert_times(content, target_timezone, found_times=None, scopes=()):
+    if found_times is None:
+        found_times = extract_times(content)
+    if not found_times:
+        return []
+    
+    results = []
+    
+    for time_str in found_times:
+        # Try to parse with timezone from string, fallback to UTC only if no TZ found
+        parsed = parse_time(time_str, scopes=scopes)
+        if parsed:
+            results.append(build_conversion(parsed, target_timezone))
+    
+    return results
+
+def convert_times_to_zones(content, target_timezones, scopes=()):
+    """Convert every detected time into each target zone, parsing each time only once"""
+    groups = []
+    for time_str in extract_times(content):
+        parsed = parse_time(time_str, scopes=scopes)
+        if parsed:
+            groups.append([build_conversion(parsed, zone) for zone in sorted(target_timezones)])
+    return groups
+
+def format_conversion_response(conversions, user_timezone):
+    """Format conversions into a response message"""
+    if not conversions:
+        return None
+    
+    lines = [render_message('success', 'conversion_header', "**Times in your timezone ({timezone})**\n\n", timezone=user_timezone)]
+    for conv in conversions:
+        if conv.same_day:
+            lines.append(render_message('success', 'conversion_line', "**{original}** → **{converted}**",
+                                        original=conv.original, converted=conv.converted))
+        else:
+            lines.append(render_message('success', 'conversion_line_with_date', "**{original}** → **{converted}** ({date})",
+                                        original=conv.original, converted=conv.converted, date=conv.date))
+        lines.append('\n')
+    
+    return ''.join(lines).strip()
+
+def format_group_conversion_response(groups):
+    """Format per-zone conversions for every member zone in a channel"""
+    if not groups:
+        return None
+    
+    lines = [render_message('success', 'group_conversion_header', "**Times for everyone here**\n\n")]
+    for conversions in groups:
+        lines.append(render_message('success', 'group_conversion_source', "**{original}**", original=conversions[0].original))
+        lines.append('\n')
+        for conv in conversions:
+            if conv.same_day:
+                lines.append(render_message('success', 'group_conversion_target', "• {converted}", converted=conv.converted))
+            else:
+                lines.append(render_message('success', 'group_conversion_target_with_date', "• {converted} ({date})",
+                                            converted=conv.converted, date=conv.date))
+            lines.append('\n')
+        lines.append('\n')
+    
+    return ''.join(lines).strip()
+
+# Reply cache
+REPLY_CACHE_SIZE = int(os.environ.get('REPLY_CACHE_SIZE', '2000'))
+# Defaults to ../shared/<platform>_reply_cache.json; set by setup()
+REPLY_CACHE_PATH = None
+_CACHE_MISS = object()
+
+def next_local_midnight(zone):
+    """UTC timestamp of the next midnight in `zone`"""
+    tomorrow = zone_now(zone).date() + timedelta(days=1)
+    return localize_in_zone(datetime.combine(tomorrow, datetime.min.time()), zone).timestamp()
+
+class ReplyCache:
+    """LRU of rendered /convert replies keyed by (query, user zone, user's date), saved between runs"""
+
+    def __init__(self, max_entries=REPLY_CACHE_SIZE, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, query, user_timezone, variant=''):
+        key = f"{user_timezone}|{zone_now(user_timezone).date().isoformat()}|{' '.join(query.split())}"
+        return f"{key}|{variant}" if variant else key
+
+    def get(self, key):
+        """The cached reply (None meaning "no times found"), or _CACHE_MISS"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return _CACHE_MISS
+
+    def put(self, key, response, expires):
+        with self.lock:
+            self.entries[key] = (expires, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None
+        }
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self.lock:
+            for key, expires, response in saved[-self.max_entries:]:
+                if expires > now:
+                    self.entries[key] = (expires, response)
+
+    def save(self):
+        with self.lock:
+            saved = [[key, expires, response] for key, (expires, response) in self.entries.items()]
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(saved, f)
+        except Exception as error:
+            print(f'Error writing reply cache: {error}')
+
+# Saved to REPLY_CACHE_PATH once setup() has picked it
+reply_cache = ReplyCache()
+
+def convert_query(text, user_timezone, scopes=()):
+    """Rendered /convert reply for `text` in the user's zone, or None when it contains no times"""
+    key = reply_cache.key(text, user_timezone, abbreviation_resolver.signature(text, scopes))
+    response = reply_cache.get(key)
+    if response is not _CACHE_MISS:
+        return response
+    # parse_time already reads times without a zone as UTC, so a single pass covers the old UTC fallback
+    conversions = convert_times(text, user_timezone, scopes=scopes)
+    response = format_conversion_response(conversions, user_timezone)
+    # A reply stays valid until "today" rolls over in the user's zone or any zone a time was given in
+    zones = {user_timezone} | {conversion.source_timezone for conversion in conversions}
+    reply_cache.put(key, response, min(next_local_midnight(zone) for zone in zones))
+    return response
+
+# Cache warm-up
+# Touches the parser, both abbreviation kinds, a relative day and a range
+WARMUP_SAMPLE = 'Standup at 9:30 AM EST, retro tomorrow 3-4pm PST'
+
+class CacheWarmer:
+    """Pays the cold costs of a restart before traffic arrives: the preference index, tz objects, offset tables,
+    display names and one full conversion into each popular or assigned zone"""
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stats = {'zones': 0, 'failed': 0, 'ms': None}
+
+    def zones(self):
+        zones = set(timezone_config.get('popular', [])) | {'UTC'}
+        try:
+            zones.update(user_index.zones_in_use())
+        except Exception as error:
+            print(f'Error listing assigned zones for warm-up: {error}')
+        return sorted(zones)
+
+    def run(self):
+        started = time.perf_counter()
+        zones = self.zones()
+        failed = 0
+        for zone in zones:
+            try:
+                timezone_backend.canonical_name(zone)
+                get_offset_table(zone)
+                get_timezone_display_name(zone)
+                format_conversion_response(convert_times(WARMUP_SAMPLE, zone), zone)
+            except Exception as error:
+                failed += 1
+                print(f'Warm-up failed for {zone}: {error}')
+        with self.lock:
+            self.stats = {'zones': len(zones), 'failed': failed, 'ms': round((time.perf_counter() - started) * 1000, 1)}
+        self.ready.set()
+        return self.stats
+
+    def start(self):
+        """Warm up in the background unless it has already run, for servers that import the app without __main__"""
+        with self.lock:
+            if self.ready.is_set() or self.thread:
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, ready=self.ready.is_set())
+
+cache_warmer = CacheWarmer()
+
+# Health and readiness
+HEALTH_WINDOW = int(os.environ.get('HEALTH_WINDOW', '1000'))
+SLO_P99_MS = float(os.environ.get('SLO_P99_MS', '2000'))
+SLO_QUEUE_DEPTH = int(os.environ.get('SLO_QUEUE_DEPTH', '100'))
+SLO_FLUSH_LAG_SECONDS = float(os.environ.get('SLO_FLUSH_LAG_SECONDS', '10'))
+SLO_SEND_FAILURES = int(os.environ.get('SLO_SEND_FAILURES', '5'))
+# The latency SLO is only judged once this many handler runs are in the window
+SLO_MIN_SAMPLES = 20
+
+def hit_ratio(hits, misses):
+    lookups = hits + misses
+    return round(hits / lookups, 3) if lookups else None
+
+class HealthMonitor:
+    """Rolling handler latencies, pending storage writes and outgoing send results, judged against the SLOs"""
+
+    def __init__(self, window=HEALTH_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.writes = {}
+        self.next_write = 0
+        self.write_errors = 0
+        self.last_flush = None
+        self.last_send = None
+        self.send_failures = 0
+
+    def observe(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def begin_write(self):
+        """Note a state change on its way to storage; pass the result to end_write once it has landed (or failed)"""
+        with self.lock:
+            write_id = self.next_write
+            self.next_write += 1
+            self.writes[write_id] = time.monotonic()
+        return write_id
+
+    def end_write(self, write_id, ok=True):
+        with self.lock:
+            self.writes.pop(write_id, None)
+            if ok:
+                self.last_flush = time.time()
+            else:
+                self.write_errors += 1
+
+    def track_send(self, send, *args, **kwargs):
+        """Call `send` and remember whether the message went out"""
+        try:
+            result = send(*args, **kwargs)
+        except Exception:
+            self.sent(False)
+            raise
+        self.sent(getattr(result, 'status_code', 200) < 400)
+        return result
+
+    def sent(self, ok=True):
+        with self.lock:
+            if ok:
+                self.last_send = time.time()
+                self.send_failures = 0
+            else:
+                self.send_failures += 1
+
+    def report(self, queue_depth):
+        with self.lock:
+            ordered = sorted(self.latencies)
+            oldest_write = min(self.writes.values(), default=None)
+            report = {
+                'latency_ms': {
+                    'samples': len(ordered),
+                    'p50': round(percentile(ordered, 0.5) * 1000, 1),
+                    'p95': round(percentile(ordered, 0.95) * 1000, 1),
+                    'p99': round(percentile(ordered, 0.99) * 1000, 1),
+                },
+                'queue_depth': queue_depth,
+                'cache_hit_ratio': {
+                    'replies': hit_ratio(reply_cache.hits, reply_cache.misses),
+                    'users': hit_ratio(user_index.hits, user_index.misses) if hasattr(user_index, 'hits') else None,
+                },
+                'storage': {
+                    'flush_lag_seconds': round(time.monotonic() - oldest_write, 3) if oldest_write is not None else 0.0,
+                    'pending_writes': len(self.writes),
+                    'write_errors': self.write_errors,
+                    'last_flush': datetime.fromtimestamp(self.last_flush).isoformat() if self.last_flush else None,
+                },
+                'last_successful_send': datetime.fromtimestamp(self.last_send).isoformat() if self.last_send else None,
+                'send_failures': self.send_failures,
+            }
+        return report
+
+    def breaches(self, report):
+        """SLOs the report misses; readiness fails while any are listed"""
+        breaches = []
+        if not cache_warmer.ready.is_set():
+            breaches.append('cache warm-up still running')
+        latency = report['latency_ms']
+        if latency['samples'] >= SLO_MIN_SAMPLES and latency['p99'] > SLO_P99_MS:
+            breaches.append(f"p99 latency {latency['p99']}ms over {SLO_P99_MS:g}ms")
+        if report['queue_depth'] > SLO_QUEUE_DEPTH:
+            breaches.append(f"queue depth {report['queue_depth']} over {SLO_QUEUE_DEPTH}")
+        if report['storage']['flush_lag_seconds'] > SLO_FLUSH_LAG_SECONDS:
+            breaches.append(f"storage flush lag {report['storage']['flush_lag_seconds']}s over {SLO_FLUSH_LAG_SECONDS:g}s")
+        if report['send_failures'] >= SLO_SEND_FAILURES:
+            breaches.append(f"{report['send_failures']} sends failed in a row")
+        return breaches
+
+health_monitor = HealthMonitor()
+
+# Reminders
+class ReminderScheduler:
+    """Pending reminders in a min-heap on due time; one thread sleeps until the earliest and hands it to `deliver`"""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+        self.heap = []
+        self.pending = {}
+        self.cond = threading.Condition()
+        self.thread = None
+        self.delivered = 0
+
+    def start(self):
+        """Reload pending reminders from the state store and start firing them"""
+        reminders = state_store.load_reminders()
+        with self.cond:
+            for reminder in reminders:
+                self.pending[reminder['id']] = reminder
+            self.heap = [(reminder['due'], reminder['id']) for reminder in self.pending.values()]
+            heapq.heapify(self.heap)
+        if not self.thread:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def schedule(self, reminders):
+        state_store.add_reminders(reminders)
+        with self.cond:
+            earliest = self.heap[0][0] if self.heap else None
+            for reminder in reminders:
+                self.pending[reminder['id']] = reminder
+                heapq.heappush(self.heap, (reminder['due'], reminder['id']))
+            # Only wake the timer thread when its current sleep would overshoot
+            if earliest is None or self.heap[0][0] < earliest:
+                self.cond.notify()
+
+    def _next_due(self):
+        with self.cond:
+            while True:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                due, reminder_id = self.heap[0]
+                delay = due - time.time()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                reminder = self.pending.pop(reminder_id, None)
+                if reminder:
+                    return reminder
+
+    def _run(self):
+        while True:
+            reminder = self._next_due()
+            try:
+                # Another worker sharing the store may already have sent it
+                if state_store.claim_reminder(reminder['id']):
+                    self.deliver(reminder)
+                    self.delivered += 1
+            except Exception as e:
+                print(f"Error delivering reminder: {e}")
+
+    def snapshot(self):
+        with self.cond:
+            return {
+                "pending": len(self.pending),
+                "next_due": self.heap[0][0] if self.heap else None,
+                "delivered": self.delivered
+            }
+
+def plan_reminder(text, user_timezone, scopes=()):
+    """(due datetime, note) for the first time in `text`, read in the user's zone unless one is given
+
+    A time that has passed moves to its next occurrence: tomorrow for a bare time, next week for a weekday.
+    A time given for today that has passed has no next occurrence, so due is None."""
+    spans = scan_time_spans(text)
+    for time_str in times_from_spans(text, spans):
+        parsed = parse_time(time_str, user_timezone, scopes)
+        if not parsed:
+            continue
+        due, zone = parsed['datetime'], parsed['timezone']
+        date_match = DATE_WORD.search(time_str)
+        if due <= clock.now():
+            if not date_match:
+                due = localize_in_zone(due.replace(tzinfo=None) + timedelta(days=1), zone)
+            elif date_match.group(2).lower() in ('today', 'tonight'):
+                due = None
+            else:
+                day = resolve_day(zone_now(zone).date(), date_match.group(2), skip_this_week=True)
+                due = localize_in_zone(datetime.combine(day, due.replace(tzinfo=None).time()), zone)
+        # The note drops the time and any date words joined to it, such as the "on" of "on Friday 9 AM"
+        start = text.find(time_str)
+        end = start + len(time_str)
+        for word in DATE_WORD.finditer(text):
+            if word.start() <= end and word.end() >= start:
+                start, end = min(start, word.start()), max(end, word.end())
+        note = re.sub(r'\s+', ' ', text[:start] + ' ' + text[end:]).strip(' ,-:') or text.strip()
+        return due, note
+    return None
+
+def build_reminders(due, note, participants, **target):
+    """One reminder per (user, zone) participant, all due at the same instant"""
+    return [dict(target, id=uuid.uuid4().hex, due=due.timestamp(), user=user, timezone=zone, note=note)
+            for user, zone in participants]
+
+def render_reminder(reminder):
+    due = datetime.fromtimestamp(reminder['due'], dt_timezone.utc)
+    local = build_conversion({'datetime': due, 'timezone': 'UTC'}, reminder['timezone'])
+    return render_message('success', 'reminder', "**Reminder:** {note}\n**{time}** in your timezone",
+                          note=reminder['note'], time=local.converted)
+
+# Working hours overlap
+WORKING_HOURS_START = float(os.environ.get('WORKING_HOURS_START', '9'))
+WORKING_HOURS_END = float(os.environ.get('WORKING_HOURS_END', '17'))
+OVERLAP_DAYS = int(os.environ.get('OVERLAP_DAYS', '7'))
+OVERLAP_MAX_DAYS = 31
+OVERLAP_MAX_WINDOWS = 10
+
+def working_intervals(zone, start_hour, end_hour, first_day, days, weekdays_only=True):
+    """UTC (start, end) timestamps of each local working day in `zone`, localized per day so DST is honoured"""
+    intervals = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        if weekdays_only and day.weekday() >= 5:
+            continue
+        midnight = datetime.combine(day, datetime.min.time())
+        begin = localize_in_zone(midnight + timedelta(hours=start_hour), zone)
+        # An end at or before the start is an overnight shift ending the next morning
+        end_offset = end_hour if end_hour > start_hour else end_hour + 24
+        finish = localize_in_zone(midnight + timedelta(hours=end_offset), zone)
+        intervals.append((begin.timestamp(), finish.timestamp()))
+    return intervals
+
+def find_overlap(zones, start_hour=WORKING_HOURS_START, end_hour=WORKING_HOURS_END, days=OVERLAP_DAYS, now=None):
+    """UTC windows over the next `days` days when every zone is inside working hours, by sweeping interval endpoints"""
+    zones = set(zones)
+    if not zones:
+        return []
+    now = now or clock.now()
+    range_start, range_end = now.timestamp(), now.timestamp() + days * 86400
+    events = []
+    for zone in zones:
+        # Start a day early so a shift already running in a zone ahead of UTC is included
+        first_day = to_zone(now, zone).date() - timedelta(days=1)
+        for begin, finish in working_intervals(zone, start_hour, end_hour, first_day, days + 2):
+            begin, finish = max(begin, range_start), min(finish, range_end)
+            if begin < finish:
+                events.append((begin, 1))
+                events.append((finish, -1))
+    # Ends sort before starts at the same instant, so back-to-back shifts never count as overlapping
+    events.sort()
+    windows = []
+    active = 0
+    opened = None
+    for instant, delta in events:
+        if active == len(zones) and delta < 0 and instant > opened:
+            windows.append((datetime.fromtimestamp(opened, dt_timezone.utc), datetime.fromtimestamp(instant, dt_timezone.utc)))
+        active += delta
+        if active == len(zones) and delta > 0:
+            opened = instant
+    return windows
+
+def parse_overlap_options(text):
+    """Working hours ("8-18") and range ("14d") from a command's text, falling back to the configured defaults"""
+    start_hour, end_hour, days = WORKING_HOURS_START, WORKING_HOURS_END, OVERLAP_DAYS
+    hours = re.search(r'\b(\d{1,2}(?:\.\d+)?)\s*-\s*(\d{1,2}(?:\.\d+)?)\b', text)
+    if hours and float(hours.group(1)) <= 24 and float(hours.group(2)) <= 24:
+        start_hour, end_hour = float(hours.group(1)), float(hours.group(2))
+    span = re.search(r'\b(\d{1,2})\s*d(?:ays?)?\b', text, re.IGNORECASE)
+    if span:
+        days = max(1, min(int(span.group(1)), OVERLAP_MAX_DAYS))
+    return start_hour, end_hour, days
+
+def format_overlap_response(windows, zone, start_hour, end_hour, days, people):
+    """Render overlap windows in the caller's zone"""
+    hours = lambda value: f"{int(value)}:{int(round(value % 1 * 60)):02d}"
+    if not windows:
+        return render_message('errors', 'no_overlap', "No common working hours for {people} people in the next {days} days",
+                              people=people, days=days)
+    lines = [render_message('success', 'overlap_header', "**Common working hours ({start}–{end} local) for {people} people**\nShown in `{timezone}`\n\n",
+                            start=hours(start_hour), end=hours(end_hour), people=people, timezone=zone)]
+    for begin, end in windows[:OVERLAP_MAX_WINDOWS]:
+        local_begin, local_end = to_zone(begin, zone), to_zone(end, zone)
+        minutes = int((end - begin).total_seconds() // 60)
+        lines.append(render_message('success', 'overlap_line', "• {day} **{start}** → **{end}** ({duration})",
+                                    day=local_begin.strftime('%a %b %d'),
+                                    start=local_begin.strftime('%I:%M%p').lstrip('0'),
+                                    end=local_end.strftime('%I:%M%p').lstrip('0'),
+                                    duration=f"{minutes // 60}h{minutes % 60:02d}m"))
+        lines.append('\n')
+    if len(windows) > OVERLAP_MAX_WINDOWS:
+        lines.append(render_message('success', 'overlap_more', "…and {count} more", count=len(windows) - OVERLAP_MAX_WINDOWS))
+    return ''.join(lines).strip()
+
+# Edit tracking
+EDIT_TRACKER_SIZE = int(os.environ.get('EDIT_TRACKER_SIZE', '5000'))
+
+class TrackedMessage:
+    """A processed message: its text, the time spans found in it, their conversions and the bot's reply"""
+    __slots__ = ('text', 'spans', 'timezone', 'conversions', 'reply', 'response')
+
+    def __init__(self, text, spans, timezone, conversions, reply=None, response=None):
+        self.text = text
+        self.spans = spans
+        self.timezone = timezone
+        self.conversions = conversions
+        self.reply = reply
+        self.response = response
+
+class ReplyTracker:
+    """LRU of recently processed messages so an edit can be rescanned incrementally and its reply updated in place"""
+
+    def __init__(self, max_messages=EDIT_TRACKER_SIZE):
+        self.max_messages = max_messages
+        self.messages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            tracked = self.messages.get(key)
+            if tracked:
+                self.messages.move_to_end(key)
+            return tracked
+
+    def remember(self, key, tracked):
+        with self.lock:
+            self.messages[key] = tracked
+            self.messages.move_to_end(key)
+            while len(self.messages) > self.max_messages:
+                self.messages.popitem(last=False)
+
+reply_tracker = ReplyTracker()
+
+def rescan_time_spans(old_text, old_spans, new_text):
+    """Spans for `new_text`, re-running extraction only around the regions that differ from `old_text`"""
+    from difflib import SequenceMatcher
+    opcodes = SequenceMatcher(None, old_text, new_text, autojunk=False).get_opcodes()
+    windows = []
+    for tag, _, _, start, end in opcodes:
+        if tag == 'equal':
+            continue
+        start, end = max(start - TIME_SPAN_MARGIN, 0), min(end + TIME_SPAN_MARGIN, len(new_text))
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = end
+        else:
+            windows.append([start, end])
+    if not windows:
+        return old_spans
+
+    # Carry over spans from unchanged text, shifted to their new position
+    kept = []
+    for index, start, end, text in old_spans:
+        for tag, old_start, old_end, new_start, _ in opcodes:
+            if tag == 'equal' and old_start <= start and end <= old_end:
+                kept.append((index, start + new_start - old_start, end + new_start - old_start, text))
+                break
+
+    # Widen each window out to whitespace and over any carried span it cuts, then rescan just that text
+    rescanned = []
+    for window in windows:
+        widened = None
+        while widened != window:
+            widened = list(window)
+            for _, start, end, _ in kept:
+                if start < window[1] and end > window[0]:
+                    window[0], window[1] = min(window[0], start), max(window[1], end)
+            while window[0] > 0 and not new_text[window[0] - 1].isspace():
+                window[0] -= 1
+            while window[1] < len(new_text) and not new_text[window[1]].isspace():
+                window[1] += 1
+        if rescanned and window[0] <= rescanned[-1][1]:
+            rescanned[-1][1] = max(rescanned[-1][1], window[1])
+        else:
+            rescanned.append(window)
+    spans = [span for span in kept if not any(span[1] < end and span[2] > start for start, end in rescanned)]
+    for start, end in rescanned:
+        spans.extend(span for span in find_time_spans(new_text[start:end], offset=start) if len(span[3]) <= MAX_TIME_EXPRESSION)
+    return sorted(spans)
+
+# Every zone's UTC offset is a multiple of 15 minutes, so the local date behind "3pm" or "tomorrow" can only
+# change on a quarter hour; conversions are reused within the same one
+CONVERSION_REUSE_SECONDS = 900
+
+def convert_tracked_message(key, text, user_timezone, skip=(), scopes=()):
+    """Conversions for a message, reusing the previous scan and conversions when `key` was seen before"""
+    reference = int(clock.now().timestamp() // CONVERSION_REUSE_SECONDS)
+    tracked = reply_tracker.get(key)
+    if tracked and tracked.timezone == user_timezone and len(text) <= EXTRACTION_CHUNK_CHARS and not skip and '```' not in text:
+        spans = rescan_time_spans(tracked.text, tracked.spans, text)
+        previous = tracked.conversions
+    else:
+        spans = scan_time_spans(text, skip)
+        previous = tracked.conversions if tracked and tracked.timezone == user_timezone else {}
+    found_times = times_from_spans(text, spans)
+    conversions = {}
+    for time_str in found_times:
+        conversion_key = (time_str, reference)
+        if conversion_key in previous:
+            conversions[conversion_key] = previous[conversion_key]
+        elif conversion_key not in conversions:
+            parsed = parse_time(time_str, scopes=scopes)
+            conversions[conversion_key] = build_conversion(parsed, user_timezone) if parsed else None
+    ordered = [conversions[(time_str, reference)] for time_str in found_times]
+    updated = TrackedMessage(text, spans, user_timezone, conversions)
+    if tracked:
+        updated.reply, updated.response = tracked.reply, tracked.response
+    return updated, [conversion for conversion in ordered if conversion]
+
+# Traffic recording
+TRAFFIC_LOG_PATH = os.environ.get('TRAFFIC_LOG_PATH', '')
+# Pseudonyms are stable for one salt; without one they change on every restart
+TRAFFIC_LOG_SALT = os.environ.get('TRAFFIC_LOG_SALT') or os.urandom(16).hex()
+TRAFFIC_FLUSH_EVERY = 100
+MASKED_TOKEN = re.compile(r'<([@#])([A-Z][A-Z0-9]+)(?:\|[^>]*)?>|[^\W_][\w/+-]*')
+LEADING_COMMAND = re.compile(r'/\w+(?:@\w+)?')
+
+class TrafficRecorder:
+    """Appends anonymized incoming updates to a gzip JSONL log for offline replay
+
+    Only fields under `kept_keys` survive. Scalars under `id_keys` become pseudonyms, strings under `text_keys`
+    are masked, and strings under `name_keys` are blanked for payloads that require a name."""
+
+    def __init__(self, path, salt, kept_keys, id_keys, text_keys, name_keys=()):
+        self.path = path
+        self.salt = salt.encode()
+        self.kept_keys = kept_keys
+        self.id_keys = id_keys
+        self.text_keys = text_keys
+        self.name_keys = name_keys
+        self.file = None
+        self.pending = 0
+        self.recorded = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def pseudonym(self, value):
+        """A stable stand-in for an id that keeps its type, sign and Slack prefix letter"""
+        digest = hashlib.blake2b(str(value).encode(), key=self.salt, digest_size=8).digest()
+        if isinstance(value, int) and not isinstance(value, bool):
+            number = int.from_bytes(digest[:6], 'big')
+            return -number if value < 0 else number
+        if re.match(r'^[A-Z][A-Z0-9]{2,}$', value):
+            return value[0] + base64.b32encode(digest).decode()[:10]
+        return digest.hex()
+
+    def mask_text(self, text):
+        """Time expressions, zone names and a leading /command kept; other letters and digits become x and 0"""
+        spans = sorted((start, end) for _, start, end, _ in scan_time_spans(text))
+        command = LEADING_COMMAND.match(text)
+        pos = command.end() if command else 0
+        parts = [text[:pos]]
+        for start, end in spans + [(len(text), len(text))]:
+            if end <= pos:
+                continue
+            start = max(start, pos)
+            parts.append(MASKED_TOKEN.sub(self._mask_token, text[pos:start]))
+            parts.append(text[start:end])
+            pos = end
+        return ''.join(parts)
+
+    def _mask_token(self, match):
+        token = match.group(0)
+        if match.group(1):
+            return f"<{match.group(1)}{self.pseudonym(match.group(2))}>"
+        if token.upper() in timezone_config['aliases'] or ('/' in token and timezone_backend.canonical_name(token)):
+            return token
+        return re.sub(r'\d', '0', re.sub(r'[^\W\d_]', 'x', token))
+
+    def anonymize(self, value, key=None):
+        if isinstance(value, dict):
+            return {k: self.anonymize(v, k) for k, v in value.items() if k in self.kept_keys}
+        if isinstance(value, list):
+            return [self.anonymize(item, key) for item in value]
+        if key in self.name_keys and isinstance(value, str):
+            return 'x'
+        if key in self.id_keys and isinstance(value, (int, str)) and not isinstance(value, bool):
+            return self.pseudonym(value)
+        if key in self.text_keys and isinstance(value, str):
+            return self.mask_text(value)
+        return value
+
+    def record(self, kind, payload, user_id=None):
+        """Log one incoming update with the sender's zone, so replay can recreate the preference it met"""
+        if not self.enabled:
+            return
+        try:
+            line = json.dumps({
+                't': clock.now().timestamp(),
+                'kind': kind,
+                'user': self.pseudonym(user_id) if user_id is not None else None,
+                'zone': get_user_timezone(user_id) if user_id is not None else None,
+                'update': self.anonymize(payload),
+            }, ensure_ascii=False)
+            with self.lock:
+                if self.file is None:
+                    self.file = gzip.open(self.path, 'at', encoding='utf-8')
+                self.file.write(line + '\n')
+                self.recorded += 1
+                self.pending += 1
+                if self.pending >= TRAFFIC_FLUSH_EVERY:
+                    self.file.flush()
+                    self.pending = 0
+        except Exception as error:
+            print(f'Error recording traffic: {error}')
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def read_traffic_log(path):
+    """Records from a traffic log; a tail cut short by a crash is ignored"""
+    records = []
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except (EOFError, OSError) as error:
+        print(f'Traffic log ends early ({error}); replaying {len(records)} records')
+    return records
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def report_replay(latencies, elapsed):
+    """Print throughput and per-kind latency for a replay; latencies maps kind -> seconds per update"""
+    total = sum(len(values) for values in latencies.values())
+    print(f"Replayed {total} updates in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.1f}/s)")
+    for kind, values in sorted(latencies.items()):
+        ordered = sorted(values)
+        print(f"{kind:>20}: {len(ordered):>6}  p50 {percentile(ordered, 0.5) * 1000:.2f}ms  "
+              f"p95 {percentile(ordered, 0.95) * 1000:.2f}ms  p99 {percentile(ordered, 0.99) * 1000:.2f}ms  "
+              f"max {ordered[-1] * 1000:.2f}ms")
+
+def isolate_replay_state(records, recorder):
+    """Point the clock, preferences and reminders at scratch state seeded with the zones each sender first had,
+    and stop `recorder` from logging the replay; returns what restore_replay_state needs to undo it"""
+    global clock, state_store, user_index, USER_PREFS_PATH, REMINDERS_PATH
+    import tempfile
+    saved = (clock, state_store, user_index, USER_PREFS_PATH, REMINDERS_PATH, recorder, recorder.path)
+    workdir = tempfile.mkdtemp(prefix='tzbot-replay-')
+    USER_PREFS_PATH = os.path.join(workdir, 'user_preferences.json')
+    REMINDERS_PATH = os.path.join(workdir, 'reminders.jsonl')
+    state_store = state_stores['local']()
+    state_store.init()
+    users = {}
+    for record in records:
+        if record.get('user') is not None and record.get('zone'):
+            users.setdefault(str(record['user']), {'timezone': record['zone'], 'displayName': record['zone'], 'lastUpdated': ''})
+    write_user_prefs({'users': users})
+    user_index = UserTimezoneIndex()
+    clock = ReplayClock()
+    # Replayed updates must not be recorded again
+    recorder.path = ''
+    return saved
+
+def restore_replay_state(saved):
+    global clock, state_store, user_index, USER_PREFS_PATH, REMINDERS_PATH
+    clock, state_store, user_index, USER_PREFS_PATH, REMINDERS_PATH, recorder, recorder.path = saved
+
+# Extraction and parsing cases that have regressed before: message, expected extracted times, and the first
+# one's start, end and zone
+PARSER_CHECKS = [
+    ('Meet 3pm to 5pm EST', ['3pm to 5pm EST'], '15:00', '17:00', 'America/New_York'),
+    ('Call 3 to 5pm EST', ['3 to 5pm EST'], '15:00', '17:00', 'America/New_York'),
+    ('Office hours from 9 to 5pm', ['9 to 5pm'], '09:00', '17:00', 'UTC'),
+    ('Sync 3-5pm EST', ['3-5pm EST'], '15:00', '17:00', 'America/New_York'),
+    ('Deploy tomorrow 10pm-2am PST', ['tomorrow 10pm-2am PST'], '22:00', '02:00', 'America/Los_Angeles'),
+    ('Standup at 3pm EST', ['3pm EST'], '15:00', None, 'America/New_York'),
+    ('Lunch 12:15 pm CET', ['12:15 pm CET'], '12:15', None, 'Europe/Paris'),
+    # Prose after a time is neither the end of a range nor a zone
+    ('meet at 3 PM to discuss', ['3 PM to'], '15:00', None, 'UTC'),
+    ('Call at 2pm to review', ['2pm to'], '14:00', None, 'UTC'),
+    ('7 AM wake up call', ['7 AM wake'], '07:00', None, 'UTC'),
+    ('3 PM Chad will present', ['3 PM Chad'], '15:00', None, 'UTC'),
+    ('Sync at 9 AM Oslo', ['9 AM Oslo'], '09:00', None, 'UTC'),
+]
+
+def check_parser():
+    """Run PARSER_CHECKS through extract_times and parse_time; prints and counts every mismatch"""
+    failures = 0
+    for message, expected_times, start, end, zone in PARSER_CHECKS:
+        times = extract_times(message)
+        parsed = parse_time(times[0]) if times else None
+        got = (times, parsed and parsed['datetime'].strftime('%H:%M'),
+               parsed and parsed.get('end') and parsed['end'].strftime('%H:%M'), parsed and parsed['timezone'])
+        if got != (expected_times, start, end, zone):
+            failures += 1
+            print(f"FAIL {message!r}: got {got}, expected {(expected_times, start, end, zone)}")
+    print(f"{len(PARSER_CHECKS) - failures}/{len(PARSER_CHECKS)} parser checks passed")
+    return failures == 0
+
+def benchmark_timezone_backends(iterations=50):
+    """Time the conversion corpus under each backend and check both produce identical replies"""
+    global timezone_backend, offset_table_window
+    corpus = [
+        'Standup at 9:30 AM PST, retro at 4 PM EST',
+        'Deploy window 23:30 UTC, rollback by 1:00 AM GMT+2',
+        'Call at 3pm JST or 10:00 SGT',
+        'Lunch around 12:15 pm CET',
+    ]
+    targets = timezone_config.get('popular', []) or ['UTC']
+    saved_backend, saved_window = timezone_backend, offset_table_window
+    offset_table_window = (0, 0)
+    outputs = {}
+    try:
+        for name in TIMEZONE_BACKENDS:
+            timezone_backend = load_timezone_backend(name)
+            replies = []
+            started = time.perf_counter()
+            for _ in range(iterations):
+                replies = [format_conversion_response(convert_times(text, zone), zone) for text in corpus for zone in targets]
+            elapsed = time.perf_counter() - started
+            outputs[name] = replies
+            per_reply = elapsed / (iterations * len(replies)) * 1e6
+            print(f"{name:>9}: {elapsed * 1000:.1f}ms for {iterations * len(replies)} replies ({per_reply:.1f}us each)")
+    finally:
+        timezone_backend, offset_table_window = saved_backend, saved_window
+    mismatches = sum(a != b for a, b in zip(*outputs.values()))
+    print(f"Identical output: {'yes' if not mismatches else f'no ({mismatches} replies differ)'}")
+    return mismatches == 0
+
+# Setup
+def setup(platform, stores=None):
+    """Bind the module to one bot: `platform` is its section of the preferences file ('slack' or 'telegram'),
+    and `stores` replaces entries of STATE_STORES with the bot's own subclasses. Builds the state store for
+    STATE_BACKEND, so a Redis server that cannot be reached stops the process here."""
+    global PLATFORM, compiled_messages, state_stores, state_store, user_index, REMINDERS_PATH, REPLY_CACHE_PATH
+    PLATFORM = platform
+    compiled_messages = compile_messages(platform)
+    REMINDERS_PATH = os.environ.get('REMINDERS_PATH', f'../shared/{platform}_reminders.jsonl')
+    REPLY_CACHE_PATH = os.environ.get('REPLY_CACHE_PATH', f'../shared/{platform}_reply_cache.json')
+    reply_cache.path = REPLY_CACHE_PATH
+    state_stores = dict(STATE_STORES, **(stores or {}))
+    state_store = load_state_store(STATE_BACKEND)
+    if state_store.name == 'disk':
+        user_index = LruUserTimezoneIndex(state_store, USER_CACHE_SIZE)
+    else:
+        user_index = UserTimezoneIndex()